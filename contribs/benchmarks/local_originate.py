@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+# Times LocalOriginateCELInterpretor on a large linkedid group: a local
+# originate to a queue ringing many members before one of them answers.
+#
+# usage: python3 contribs/benchmarks/local_originate.py [MEMBER_COUNT [REPEAT]]
+
+import datetime
+import sys
+import timeit
+
+from collections import namedtuple
+
+from wazo_call_logd.cel_interpretor import LocalOriginateCELInterpretor
+from wazo_call_logd.raw_call_log import RawCallLog
+
+CEL = namedtuple('CEL', ['id', 'eventtype', 'eventtime', 'uniqueid', 'linkedid', 'channame',
+                         'cid_name', 'cid_num', 'exten', 'userfield', 'call_log_id'])
+
+
+class NoParticipantLookup(object):
+
+    def get_line(self, line_name):
+        return None
+
+
+def generate_cels(member_count):
+    start = datetime.datetime(2017, 1, 1)
+    cels = []
+
+    def add(eventtype, uniqueid, channame):
+        cels.append(CEL(id=len(cels), eventtype=eventtype, eventtime=start + datetime.timedelta(seconds=len(cels)),
+                        uniqueid=uniqueid, linkedid='1', channame=channame, cid_name='name', cid_num='1000',
+                        exten='s', userfield='', call_log_id=None))
+
+    add('CHAN_START', '1', 'Local/1000@default-00000001;1')
+    add('ANSWER', '1', 'Local/1000@default-00000001;1')
+    add('CHAN_START', '2', 'Local/1000@default-00000001;2')
+    add('CHAN_START', '3', 'SIP/source-00000001')
+    add('ANSWER', '3', 'SIP/source-00000001')
+    add('ANSWER', '2', 'Local/1000@default-00000001;2')
+    add('APP_START', '1', 'Local/1000@default-00000001;1')
+    add('XIVO_INCALL', '2', 'Local/1000@default-00000001;2')
+    for member in range(member_count):
+        uniqueid = str(10 + member)
+        channame = 'SIP/member{}-{:08}'.format(member, member)
+        add('CHAN_START', uniqueid, channame)
+        add('APP_START', uniqueid, channame)
+    answering = str(10 + member_count - 1)
+    channame = 'SIP/member{}-{:08}'.format(member_count - 1, member_count - 1)
+    add('ANSWER', answering, channame)
+    add('BRIDGE_ENTER', answering, channame)
+    for member in range(member_count):
+        uniqueid = str(10 + member)
+        channame = 'SIP/member{}-{:08}'.format(member, member)
+        add('HANGUP', uniqueid, channame)
+        add('CHAN_END', uniqueid, channame)
+    add('CHAN_END', '3', 'SIP/source-00000001')
+    add('LINKEDID_END', '3', 'SIP/source-00000001')
+    return cels
+
+
+def main():
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    cels = generate_cels(member_count)
+    interpretor = LocalOriginateCELInterpretor(NoParticipantLookup())
+
+    def run():
+        if interpretor.can_interpret(cels):
+            interpretor.interpret_cels(cels, RawCallLog())
+
+    duration = min(timeit.repeat(run, number=repeat, repeat=3))
+    print('{} CEL: {:.3f} ms per call'.format(len(cels), duration / repeat * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -78,7 +78,7 @@ def lines():
     lines = _responses['lines'].values()
     if 'name' in request.args:
         lines = [line for line in lines if line['name'] == request.args['name']]
-    return jsonify({'items': lines})
+    return jsonify({'items': lines, 'total': len(lines)})
 
 
 @app.route('/1.1/lines/<line_id>')
@@ -2,6 +2,8 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 import csv
+import json
+import requests
 
 from io import StringIO
 from functools import wraps
@@ -11,6 +13,7 @@ from hamcrest import calling
 from hamcrest import contains
 from hamcrest import contains_inanyorder
 from hamcrest import empty
+from hamcrest import equal_to
 from hamcrest import has_entry
 from hamcrest import has_entries
 from hamcrest import has_key
@@ -200,6 +203,47 @@ class TestListCDR(IntegrationTest):
         ),
                     'CSV received: {}'.format(result_raw))
 
+    @call_logs([
+        {'id': 12,
+         'date': '2017-03-23 00:00:00',
+         'participants': [{'user_uuid': '1',
+                           'line_id': '1',
+                           'tags': ['rh']}]},
+        {'id': 23, 'date': '2017-03-23 11:11:11'},
+        {'id': 34, 'date': '2017-03-24 00:00:00'},
+    ])
+    def test_given_call_logs_when_list_cdr_in_csv_with_paging_then_list_cdr_in_csv_paginated(self):
+        result_raw = self.call_logd.cdr.list_csv(order='start', direction='desc', limit=2, offset=1)
+        result = list(csv.DictReader(StringIO(result_raw)))
+
+        assert_that(result, contains(has_entries(id='23', tags=''),
+                                     has_entries(id='12', tags='rh')),
+                    'CSV received: {}'.format(result_raw))
+
+    @call_logs([
+        {'id': 12,
+         'date': '2017-03-23 00:00:00',
+         'date_answer': '2017-03-23 00:01:00',
+         'date_end': '2017-03-23 00:02:27',
+         'participants': [{'user_uuid': '1',
+                           'line_id': '1',
+                           'tags': ['rh']}]},
+        {'id': 34,
+         'date': '2017-03-23 11:11:11'},
+    ])
+    def test_given_call_logs_when_list_cdr_in_ndjson_then_one_cdr_per_line(self):
+        url = 'https://localhost:{port}/1.0/cdr'.format(port=self.service_port(9298, 'call-logd'))
+        response = requests.get(url,
+                                params={'order': 'start', 'direction': 'asc'},
+                                headers={'Accept': 'application/x-ndjson', 'X-Auth-Token': VALID_TOKEN},
+                                verify=False)
+
+        assert_that(response.status_code, equal_to(200))
+        result = [json.loads(line) for line in response.text.splitlines()]
+        assert_that(result, contains(has_entries(id=12, answered=True, duration=87, tags=['rh']),
+                                     has_entries(id=34, answered=False, duration=None, tags=[])),
+                    'NDJSON received: {}'.format(response.text))
+
     def test_given_wrong_params_when_list_cdr_then_400(self):
         wrong_params = {'abcd', '12:345', '2017-042-10'}
         for wrong_param in wrong_params:
@@ -314,6 +358,68 @@ class TestListCDR(IntegrationTest):
                                                       result_unpaginated['items'][1],
                                                   )))
 
+    @call_logs([
+        {'date': '2017-04-10'},
+        {'date': '2017-04-12'},
+        {'date': '2017-04-11'},
+        {'date': '2017-04-11'},
+    ])
+    def test_given_call_logs_when_list_cdr_with_cursor_then_list_next_pages(self):
+        result_unpaginated = self.call_logd.cdr.list(order='start', direction='desc')
+
+        page_1 = self.call_logd.cdr.list(order='start', direction='desc', limit=2)
+        page_2 = self.call_logd.cdr.list(order='start', direction='desc', limit=2, cursor=page_1['next'])
+        page_3 = self.call_logd.cdr.list(order='start', direction='desc', limit=2, cursor=page_2['next'])
+
+        assert_that(page_1['items'] + page_2['items'], contains(*result_unpaginated['items']))
+        assert_that(page_1, has_entries(filtered=4, total=4))
+        assert_that(page_2, has_entries(filtered=None, total=None))
+        assert_that(page_3, has_entries(filtered=None, total=None, items=empty(), next=None))
+
+    @call_logs([
+        {'date': '2017-04-10'},
+        {'date': '2017-04-11'},
+    ])
+    def test_given_call_logs_when_list_cdr_with_cursor_and_count_then_counts(self):
+        page_1 = self.call_logd.cdr.list(limit=1)
+
+        page_2 = self.call_logd.cdr.list(limit=1, cursor=page_1['next'], count=True)
+
+        assert_that(page_2, has_entries(filtered=2, total=2, items=contains(has_key('id'))))
+
+    @call_logs([
+        {'date': '2017-04-10'},
+        {'date': '2017-04-11'},
+    ])
+    def test_given_call_logs_when_list_cdr_without_count_then_no_count(self):
+        result = self.call_logd.cdr.list(count=False, limit=1)
+
+        assert_that(result, has_entries(filtered=None, total=None, items=contains(has_key('id'))))
+
+    @call_logs([
+        {'date': '2017-04-10'},
+        {'date': '2017-04-11'},
+    ])
+    def test_given_call_logs_when_list_cdr_past_the_last_page_then_counts(self):
+        result = self.call_logd.cdr.list(limit=1, offset=5)
+
+        assert_that(result, has_entries(filtered=2, total=2, items=empty()))
+
+    @call_logs([
+        {'date': '2017-04-10'},
+    ])
+    def test_given_wrong_cursor_when_list_cdr_then_400(self):
+        assert_that(
+            calling(self.call_logd.cdr.list).with_args(cursor='wrong'),
+            raises(CallLogdError).matching(has_properties(status_code=400,
+                                                          details=has_key('cursor'))))
+
+        page = self.call_logd.cdr.list(order='start', limit=1)
+        assert_that(
+            calling(self.call_logd.cdr.list).with_args(order='id', limit=1, cursor=page['next']),
+            raises(CallLogdError).matching(has_properties(status_code=400,
+                                                          details=has_key('cursor'))))
+
     @call_logs([
         {'date': '2016-04-10'},
         {'date': '2017-04-10'},
@@ -441,7 +547,7 @@ class TestListCDR(IntegrationTest):
     def test_given_call_logs_when_list_cdr_with_user_uuid_then_list_matching_cdr(self):
         result = self.call_logd.cdr.list(user_uuid=USER_3_UUID)
         assert_that(result, has_entries(filtered=2,
-                                        total=6,
+                                        total=2,
                                         items=contains_inanyorder(
                                             has_entries(start='2017-04-12T00:00:00+00:00'),
                                             has_entries(start='2017-04-14T00:00:00+00:00'),
@@ -449,7 +555,7 @@ class TestListCDR(IntegrationTest):
 
         result = self.call_logd.cdr.list(user_uuid='{},{}'.format(USER_2_UUID, USER_3_UUID))
         assert_that(result, has_entries(filtered=4,
-                                        total=6,
+                                        total=4,
                                         items=contains_inanyorder(
                                             has_entries(start='2017-04-12T00:00:00+00:00'),
                                             has_entries(start='2017-04-13T00:00:00+00:00'),
@@ -479,7 +585,7 @@ class TestListCDR(IntegrationTest):
         result = self.call_logd.cdr.list_for_user(USER_1_UUID, limit=2, offset=1, order='start', direction='desc')
 
         assert_that(result, has_entries(filtered=4,
-                                        total=6,
+                                        total=4,
                                         items=contains(
                                             has_entries(start='2017-04-13T00:00:00+00:00'),
                                             has_entries(start='2017-04-12T00:00:00+00:00'),
@@ -550,7 +656,7 @@ class TestListCDR(IntegrationTest):
         self.call_logd.set_token(VALID_TOKEN)
 
         assert_that(result, has_entries(filtered=4,
-                                        total=6,
+                                        total=4,
                                         items=contains_inanyorder(
                                             has_entries(start='2017-04-13T00:00:00+00:00'),
                                             has_entries(start='2017-04-12T00:00:00+00:00'),
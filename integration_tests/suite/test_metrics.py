@@ -0,0 +1,30 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import requests
+
+from hamcrest import assert_that
+from hamcrest import contains_string
+from hamcrest import equal_to
+
+from .test_api.base import IntegrationTest
+from .test_api.constants import VALID_TOKEN
+
+
+class TestMetrics(IntegrationTest):
+
+    asset = 'base'
+
+    def url(self):
+        return 'https://localhost:{port}/1.0/metrics'.format(port=self.service_port(9298, 'call-logd'))
+
+    def test_given_no_token_when_get_metrics_then_401(self):
+        response = requests.get(self.url(), verify=False)
+
+        assert_that(response.status_code, equal_to(401))
+
+    def test_given_token_when_get_metrics_then_prometheus_text(self):
+        response = requests.get(self.url(), headers={'X-Auth-Token': VALID_TOKEN}, verify=False)
+
+        assert_that(response.status_code, equal_to(200))
+        assert_that(response.text, contains_string('call_logd_cel_events_total'))
@@ -16,13 +16,15 @@ setup(
     license='GPLv3',
     packages=find_packages(),
     package_data={
+        'wazo_call_logd': ['migrations/env.py', 'migrations/script.py.mako', 'migrations/versions/*.py'],
         'wazo_call_logd.plugins': ['*/api.yml'],
     },
-    scripts=['bin/wazo-call-logs', 'bin/wazo-call-logd'],
+    scripts=['bin/wazo-call-logs', 'bin/wazo-call-logd', 'bin/wazo-call-logd-upgrade-db'],
     entry_points={
         'wazo_call_logd.plugins': [
             'api = wazo_call_logd.plugins.api.plugin:Plugin',
             'cdr = wazo_call_logd.plugins.cdr.plugin:Plugin',
+            'metrics = wazo_call_logd.plugins.metrics.plugin:Plugin',
         ]
     }
 )
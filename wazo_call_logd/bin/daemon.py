@@ -11,6 +11,7 @@ from xivo.config_helper import set_xivo_uuid
 from xivo.daemonize import pidfile_context
 from xivo.user_rights import change_user
 from xivo.xivo_logging import setup_logging
+from wazo_call_logd import migration
 from wazo_call_logd.config import load as load_config
 from wazo_call_logd.controller import Controller
 
@@ -25,6 +26,8 @@ def main(argv):
         change_user(user)
 
     setup_logging(config['logfile'], config['foreground'], config['debug'], config['log_level'])
+    # an outdated schema stops the daemon before it starts
+    migration.check_schema(config['db_uri'])
     xivo_dao.init_db_from_config(config)
 
     set_xivo_uuid(config, logger)
@@ -5,6 +5,8 @@ import argparse
 import logging
 import sys
 
+from threading import Thread
+
 from xivo.chain_map import ChainMap
 from xivo.config_helper import parse_config_file
 from xivo.daemonize import pidfile_context
@@ -15,7 +17,10 @@ from xivo_auth_client import Client as AuthClient
 from xivo_confd_client import Client as ConfdClient
 from xivo_dao import init_db_from_config, default_config
 
+from wazo_call_logd import metrics
+from wazo_call_logd import migration
 from wazo_call_logd.bus_publisher import BusPublisher
+from wazo_call_logd.call_log_count import CallLogCountCompactor
 from wazo_call_logd.cel_fetcher import CELFetcher
 from wazo_call_logd.cel_interpretor import DispatchCELInterpretor
 from wazo_call_logd.cel_interpretor import CallerCELInterpretor
@@ -23,7 +28,9 @@ from wazo_call_logd.cel_interpretor import CalleeCELInterpretor
 from wazo_call_logd.cel_interpretor import LocalOriginateCELInterpretor
 from wazo_call_logd.generator import CallLogsGenerator
 from wazo_call_logd.manager import CallLogsManager
-from wazo_call_logd.writer import CallLogsWriter
+from wazo_call_logd.manager import ParallelCallLogsManager
+from wazo_call_logd.participant_lookup import new_participant_lookup
+from wazo_call_logd.writer import new_call_logs_writer
 
 DEFAULT_CEL_COUNT = 20000
 PIDFILENAME = '/var/run/wazo-call-logs.pid'
@@ -53,6 +60,13 @@ DEFAULT_CONFIG = {
         'port': 9486,
         'verify_certificate': _CERT_FILE,
     },
+    'participant_lookup': 'confd',
+    'participant_cache': {
+        'max_size': 2048,
+        'ttl': 300,
+        'negative_ttl': 60,
+    },
+    'call_logs_writer': 'bulk',
 }
 
 
@@ -60,7 +74,9 @@ def main():
     _print_deprecation_notice()
     setup_logging('/dev/null', foreground=True, debug=False)
     silence_loggers(['urllib3.connectionpool'], level=logging.WARNING)
-    init_db_from_config(default_config())
+    db_config = default_config()
+    migration.check_schema(db_config['db_uri'])
+    init_db_from_config(db_config)
     with pidfile_context(PIDFILENAME, foreground=True):
         _generate_call_logs()
 
@@ -81,28 +97,53 @@ def _generate_call_logs():
     token_renewer = TokenRenewer(auth_client)
     token_renewer.subscribe_to_token_change(confd_client.set_token)
 
+    participant_lookup = new_participant_lookup(config, confd_client)
     cel_fetcher = CELFetcher()
     generator = CallLogsGenerator([
-        LocalOriginateCELInterpretor(confd_client),
-        DispatchCELInterpretor(CallerCELInterpretor(confd_client),
-                               CalleeCELInterpretor(confd_client))
-    ])
-    writer = CallLogsWriter()
+        LocalOriginateCELInterpretor(participant_lookup),
+        DispatchCELInterpretor(CallerCELInterpretor(participant_lookup),
+                               CalleeCELInterpretor(participant_lookup))
+    ], participant_lookup)
+    writer = new_call_logs_writer(config)
     publisher = BusPublisher(config)
-    manager = CallLogsManager(cel_fetcher, generator, writer, publisher)
-
     options = vars(options)
-    with token_renewer:
-        if options.get('action') == 'delete':
-            if options.get('all'):
-                manager.delete_all()
-            elif options.get('days'):
-                manager.delete_from_days(options['days'])
-        else:
-            if options.get('days'):
-                manager.generate_from_days(days=options['days'])
-            else:
-                manager.generate_from_count(cel_count=options['cel_count'])
+    # the cron only publishes a summary of the call logs, unless asked for the event of each call log
+    backfill = not options['publish_call_logs']
+    if options['jobs'] > 1:
+        manager = ParallelCallLogsManager(cel_fetcher, generator, writer, publisher,
+                                          jobs=options['jobs'], set_token=confd_client.set_token,
+                                          backfill=backfill)
+        token_renewer.subscribe_to_token_change(manager.set_token)
+    else:
+        manager = CallLogsManager(cel_fetcher, generator, writer, publisher, backfill=backfill)
+
+    with manager:
+        # started after the jobs are forked
+        publisher_thread = Thread(target=publisher.run, name='bus_publisher_thread')
+        publisher_thread.start()
+        try:
+            with token_renewer:
+                if options.get('action') == 'delete':
+                    if options.get('all'):
+                        manager.delete_all()
+                    elif options.get('days'):
+                        manager.delete_from_days(options['days'])
+                else:
+                    if options.get('days'):
+                        manager.generate_from_days(days=options['days'])
+                    else:
+                        manager.generate_from_count(cel_count=options['cel_count'])
+                    participant_lookup.log_stats()
+        finally:
+            publisher.stop()
+            publisher_thread.join()
+
+    # the counts of the call logs written by the cron are summed now, not only by the daemon
+    CallLogCountCompactor().compact()
+
+    if options['jobs'] > 1:
+        manager.log_stats()
+    metrics.REGISTRY.log_summary()
 
 
 def parse_args(parser):
@@ -120,6 +161,13 @@ def parse_args(parser):
     group.add_argument('-d', '--days',
                        type=int,
                        help='Number of days to process')
+    parser.add_argument('-j', '--jobs',
+                        default=1,
+                        type=int,
+                        help='Number of processes generating call logs')
+    parser.add_argument('-p', '--publish-call-logs',
+                        action='store_true',
+                        help='Publish an event per call log instead of one summary event per chunk of call logs')
     return parser.parse_args()
 
 
@@ -0,0 +1,18 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import argparse
+
+from xivo.xivo_logging import setup_logging
+
+from wazo_call_logd import migration
+from wazo_call_logd.config import load_db_uri
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or upgrade the tables of wazo-call-logd')
+    parser.add_argument('-c', '--config-file', help='The path of the wazo-call-logd config file')
+    options = parser.parse_args()
+
+    setup_logging('/dev/null', foreground=True, debug=False)
+    migration.upgrade(load_db_uri(options.config_file))
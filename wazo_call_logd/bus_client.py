@@ -2,48 +2,281 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 import logging
+import queue
+import time
 
-from kombu import Exchange, Connection, Queue
+from threading import Thread
+
+from kombu import binding, Exchange, Connection, Queue
 from kombu.mixins import ConsumerMixin
 
+from wazo_call_logd import metrics
+from wazo_call_logd.live_cels import cel_from_event
+from wazo_call_logd.live_cels import LiveCELs
+
 logger = logging.getLogger(__name__)
 
+CEL_EVENTS = metrics.counter('call_logd_cel_events_total', 'CEL events received from the bus')
+
 
 class _CELConsumer(ConsumerMixin):
 
-    def __init__(self, queue):
+    # LINKEDID_END are processed by batches of at most batch_size calls, or
+    # batch_timeout seconds after the first call of the batch was received
+    batch_size = 200
+    batch_timeout = 0.25
+
+    def __init__(self, queue, config_queue=None, cache_invalidator=None, workers=None, prefetch_count=None,
+                 live_cels=None):
         self._queue = queue
+        self._config_queue = config_queue
+        self._cache_invalidator = cache_invalidator
+        self._workers = workers or _GenerationWorkers(1)
+        self._prefetch_count = prefetch_count
+        self._live_cels = live_cels
+        self._linked_ids = []
+        self._messages = []
+        self._cels_by_linked_id = {}
+        self._batch_start = None
+        # messages can only be acked on the connection they were received from
+        self._connection_count = 0
+
+    def consume(self, *args, **kwargs):
+        # on_iteration is called at least every safety_interval seconds
+        kwargs.setdefault('safety_interval', self.batch_timeout)
+        return super(_CELConsumer, self).consume(*args, **kwargs)
 
     def get_consumers(self, Consumer, channel):
-        return [
-            Consumer(self._queue, callbacks=[self.on_message]),
+        consumers = [
+            Consumer(self._queue, callbacks=[self.on_message], prefetch_count=self._prefetch_count),
         ]
+        if self._cache_invalidator:
+            consumers.append(Consumer(self._config_queue, callbacks=[self._cache_invalidator.on_message]))
+        return consumers
 
     def on_message(self, body, message):
-        if body['data']['EventName'] == 'LINKEDID_END':
-            linked_id = body['data']['LinkedID']
-            logger.debug('Received LINKEDID_END: %s', linked_id)
-            self._call_logs_manager.generate_from_linked_id(linked_id)
+        CEL_EVENTS.inc()
+        if self._live_cels is not None:
+            self._live_cels.add(cel_from_event(body['data']))
 
-        message.ack()
+        if body['data']['EventName'] != 'LINKEDID_END':
+            message.ack()
+            return
+
+        linked_id = body['data']['LinkedID']
+        logger.debug('Received LINKEDID_END: %s', linked_id)
+        if not self._messages:
+            self._batch_start = time.monotonic()
+        self._linked_ids.append(linked_id)
+        self._messages.append((self._connection_count, message))
+        if self._live_cels is not None:
+            cels = self._live_cels.pop(linked_id)
+            if cels:
+                self._cels_by_linked_id[linked_id] = cels
+
+        if len(self._messages) >= self.batch_size:
+            self._generate_batch()
+
+    def on_iteration(self):
+        if self._messages and time.monotonic() - self._batch_start >= self.batch_timeout:
+            self._generate_batch()
+        if self._live_cels is not None:
+            self._live_cels.evict_expired()
+        self._ack_generated()
+
+    def on_connection_revived(self):
+        self._connection_count += 1
+        if self._live_cels is not None:
+            # the CEL published while disconnected are lost
+            self._live_cels.clear()
+        if self._messages:
+            # the messages of the lost connection will not be acked
+            self._generate_batch()
+
+    def on_consume_end(self, connection, channel):
+        if self._messages:
+            self._generate_batch()
+        self._workers.wait()
+        self._ack_generated()
 
     def run(self, connection, call_logs_manager):
         self.connection = connection
+
+        self._workers.start(call_logs_manager)
+        try:
+            super(_CELConsumer, self).run()
+        finally:
+            self._workers.stop()
+
+    def _generate_batch(self):
+        linked_ids, messages, cels_by_linked_id = self._linked_ids, self._messages, self._cels_by_linked_id
+        self._linked_ids, self._messages, self._cels_by_linked_id = [], [], {}
+
+        logger.debug('Generating call logs for a batch of %s LINKEDID_END', len(linked_ids))
+        self._workers.submit(linked_ids, messages, cels_by_linked_id)
+
+    def _ack_generated(self):
+        for messages, generated in self._workers.pop_generated():
+            for connection_count, message in messages:
+                if connection_count != self._connection_count:
+                    continue
+                if generated:
+                    message.ack()
+                else:
+                    message.reject(requeue=False)
+
+
+class _GenerationWorkers(object):
+
+    def __init__(self, count):
+        self._tasks = [queue.Queue() for _ in range(count)]
+        self._generated = queue.Queue()
+        self._threads = []
+        self._call_logs_manager = None
+
+    def start(self, call_logs_manager):
         self._call_logs_manager = call_logs_manager
+        for index, tasks in enumerate(self._tasks):
+            thread = Thread(target=self._run, args=[tasks], name='generation_worker_{}'.format(index))
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for tasks in self._tasks:
+            tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, linked_ids, messages, cels_by_linked_id=None):
+        cels_by_linked_id = cels_by_linked_id or {}
+        # the calls of a linkedid are always generated by the same worker, in order
+        shards = [([], [], {}) for _ in self._tasks]
+        for linked_id, message in zip(linked_ids, messages):
+            shard_linked_ids, shard_messages, shard_cels = shards[hash(linked_id) % len(shards)]
+            shard_linked_ids.append(linked_id)
+            shard_messages.append(message)
+            if linked_id in cels_by_linked_id:
+                shard_cels[linked_id] = cels_by_linked_id[linked_id]
+
+        for tasks, shard in zip(self._tasks, shards):
+            if shard[0]:
+                tasks.put(shard)
+
+    def wait(self):
+        for tasks in self._tasks:
+            tasks.join()
+
+    def pop_generated(self):
+        while True:
+            try:
+                yield self._generated.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self, tasks):
+        while True:
+            task = tasks.get()
+            try:
+                if task is None:
+                    return
+                self._generate(*task)
+            finally:
+                tasks.task_done()
+
+    def _generate(self, linked_ids, messages, cels_by_linked_id):
+        try:
+            self._call_logs_manager.generate_from_linked_ids(linked_ids, cels_by_linked_id)
+        except Exception:
+            if len(linked_ids) == 1:
+                logger.exception('Failed to generate the call logs of %s', linked_ids)
+                self._generated.put((messages, False))
+                return
+            # the batch was rolled back, only the linkedids that fail on their own are rejected
+            logger.exception('Failed to generate a batch of %s linkedids, retrying them one by one', len(linked_ids))
+            for linked_id, message in zip(linked_ids, messages):
+                cels = {linked_id: cels_by_linked_id[linked_id]} if linked_id in cels_by_linked_id else {}
+                self._generate([linked_id], [message], cels)
+        else:
+            self._generated.put((messages, True))
+
+
+class _ParticipantCacheInvalidator(object):
+
+    def __init__(self, participant_lookup):
+        self._participant_lookup = participant_lookup
+        self._handlers = {
+            'user_edited': self._on_user_event,
+            'user_deleted': self._on_user_event,
+            'line_created': self._on_line_created,
+            'line_edited': self._on_line_event,
+            'line_deleted': self._on_line_event,
+            'line_associated': self._on_user_line_event,
+            'line_dissociated': self._on_user_line_event,
+        }
+
+    def on_message(self, body, message):
+        handler = self._handlers.get(body.get('name'))
+        if handler:
+            logger.debug('Received %s: %s', body['name'], body['data'])
+            handler(body['data'])
+
+        message.ack()
+
+    def _on_user_event(self, data):
+        self._participant_lookup.evict_user(data['uuid'])
+
+    def _on_line_created(self, data):
+        if data.get('name'):
+            self._participant_lookup.evict_line_name(data['name'])
+
+    def _on_line_event(self, data):
+        self._participant_lookup.evict_line(data['id'])
+        if data.get('name'):
+            self._participant_lookup.evict_line_name(data['name'])
 
-        super(_CELConsumer, self).run()
+    def _on_user_line_event(self, data):
+        self._participant_lookup.evict_line(data['line_id'])
 
 
 class BusClient(object):
 
     _KEY = 'ami.CEL'
+    _CONFIG_KEYS = [
+        'config.user.edited',
+        'config.user.deleted',
+        'config.line.created',
+        'config.line.edited',
+        'config.line.deleted',
+        'config.user_line_association.created',
+        'config.user_line_association.deleted',
+    ]
 
-    def __init__(self, config):
+    def __init__(self, config, participant_lookup=None):
         self.bus_url = 'amqp://{username}:{password}@{host}:{port}//'.format(**config['bus'])
         exchange = Exchange(config['bus']['exchange_name'],
                             type=config['bus']['exchange_type'])
-        self.queue = Queue(exchange=exchange, routing_key=self._KEY, exclusive=True)
-        self._consumer = _CELConsumer(self.queue)
+        queue_name = config['bus_consumer']['queue_name']
+        live_cels_config = config['bus_consumer']['live_cels']
+        if queue_name and live_cels_config['enabled']:
+            # each instance would only receive some of the CEL of each call
+            raise ValueError('bus_consumer live_cels cannot be enabled with a shared queue_name')
+        if queue_name:
+            # shared by every instance consuming the CEL, the events are split between them
+            self.queue = Queue(queue_name, exchange=exchange, routing_key=self._KEY, durable=True)
+        else:
+            self.queue = Queue(exchange=exchange, routing_key=self._KEY, exclusive=True)
+        self.config_queue = Queue(bindings=[binding(exchange, routing_key=key) for key in self._CONFIG_KEYS],
+                                  exclusive=True)
+        cache_invalidator = _ParticipantCacheInvalidator(participant_lookup) if participant_lookup else None
+        workers = _GenerationWorkers(config['bus_consumer']['workers'])
+        live_cels = None
+        if live_cels_config['enabled']:
+            live_cels = LiveCELs(live_cels_config['max_calls'],
+                                 live_cels_config['max_cels_per_call'],
+                                 live_cels_config['ttl'])
+        self._consumer = _CELConsumer(self.queue, self.config_queue, cache_invalidator,
+                                      workers, config['bus_consumer']['prefetch_count'], live_cels)
 
     def run(self, call_logs_manager):
         with Connection(self.bus_url) as conn:
@@ -2,15 +2,37 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 import logging
+import threading
 from functools import partial
 
 import kombu
 import xivo_bus
 from xivo_bus.resources.call_logs.events import CallLogCreatedEvent, CallLogUserCreatedEvent
+from wazo_call_logd import metrics
 from wazo_call_logd.plugins.cdr.schema import CDRSchema
 
 logger = logging.getLogger(__name__)
 
+CALL_LOG_DELAY_SECONDS = metrics.histogram('call_logd_linkedid_end_to_call_log_published_seconds',
+                                           'Delays from LINKEDID_END to the call log publication',
+                                           buckets=metrics.DELAY_BUCKETS)
+USER_CALL_LOG_DELAY_SECONDS = metrics.histogram('call_logd_linkedid_end_to_user_call_log_published_seconds',
+                                                'Delays from LINKEDID_END to the user call log publication',
+                                                buckets=metrics.DELAY_BUCKETS)
+
+
+class CallLogsBackfilledEvent(object):
+
+    name = 'call_logs_backfilled'
+    routing_key = 'call_log.backfilled'
+    required_acl = 'events.call_log.backfilled'
+
+    def __init__(self, data):
+        self._data = data
+
+    def marshal(self):
+        return self._data
+
 
 class BusPublisher(object):
 
@@ -21,21 +43,52 @@ class BusPublisher(object):
         exchange_type = config['bus']['exchange_type']
         publisher_fcty = partial(self._new_publisher, uuid, bus_url, exchange_name, exchange_type)
         self._publisher = xivo_bus.PublishingQueue(publisher_fcty)
+        # dump creates its own marshaller, the schema can be shared by the generation workers
+        self._cdr_schema = CDRSchema()
+        self._collected = None
+        self._queued = 0
+        self._queued_lock = threading.Lock()
 
     def publish_all(self, call_logs):
-        for call_log in call_logs:
-            self.publish(call_log)
+        self.send_events([event for call_log in call_logs for event in self._events(call_log)])
 
     def publish(self, call_log):
-        payload = CDRSchema().dump(call_log).data
-        logger.debug('publishing new call log: %s', payload)
-        event = CallLogCreatedEvent(payload)
-        self.send_event(event)
+        self.publish_all([call_log])
 
-        payload = CDRSchema(exclude=['tags']).dump(call_log).data
-        for participant in call_log.participants:
-            event = CallLogUserCreatedEvent(participant.user_uuid, payload)
-            self.send_event(event)
+    def publish_summary(self, call_logs):
+        # one event for a chunk of backfilled call logs, instead of an event per call log
+        if not call_logs:
+            return
+
+        dates = [call_log.date for call_log in call_logs]
+        user_uuids = {participant.user_uuid
+                      for call_log in call_logs
+                      for participant in call_log.participants
+                      if participant.user_uuid}
+        summary = {
+            'first_id': min(call_log.id for call_log in call_logs),
+            'last_id': max(call_log.id for call_log in call_logs),
+            'first_start': min(dates).isoformat(),
+            'last_start': max(dates).isoformat(),
+            'call_log_count': len(call_logs),
+            'user_call_log_count': sum(len(call_log.participants) for call_log in call_logs),
+            'user_uuids': sorted(user_uuids),
+        }
+        logger.debug('publishing backfilled call logs: %s', summary)
+        self.send_events([(CallLogsBackfilledEvent(summary), None)])
+
+    def collect_events(self):
+        # the generation jobs have no publishing thread, their events are sent by the parent process
+        self._collected = []
+
+    def pop_collected_events(self):
+        collected, self._collected = self._collected or [], []
+        return collected
+
+    def queue_size(self):
+        # batches of events waiting to be sent by the publishing thread
+        with self._queued_lock:
+            return self._queued
 
     def run(self):
         logger.info('status publisher starting')
@@ -50,7 +103,67 @@ class BusPublisher(object):
         bus_exchange = kombu.Exchange(exchange_name, type=exchange_type)
         bus_producer = kombu.Producer(bus_connection, exchange=bus_exchange, auto_declare=True)
         bus_marshaler = xivo_bus.Marshaler(uuid)
-        return xivo_bus.Publisher(bus_producer, bus_marshaler)
+        return _BatchPublisher(xivo_bus.Publisher(bus_producer, bus_marshaler), self._on_batch_sent)
+
+    def send_event(self, event, linkedid_end_time=None):
+        self.send_events([(event, linkedid_end_time)])
+
+    def send_events(self, events):
+        # events are (event, linkedid_end_time) pairs, the delay headers are computed when published
+        if not events:
+            return
+
+        if self._collected is not None:
+            self._collected.extend(events)
+        else:
+            with self._queued_lock:
+                self._queued += 1
+            self._publisher.publish(events)
+
+    def _on_batch_sent(self):
+        with self._queued_lock:
+            self._queued -= 1
+
+    def _events(self, call_log):
+        payload = self._cdr_schema.dump(call_log).data
+        logger.debug('publishing new call log: %s', payload)
+        yield CallLogCreatedEvent(payload), call_log.linkedid_end_time
+
+        user_payload = {key: value for key, value in payload.items() if key != 'tags'}
+        for participant in call_log.participants:
+            yield CallLogUserCreatedEvent(participant.user_uuid, user_payload), call_log.linkedid_end_time
+
+
+class _BatchPublisher(object):
+
+    # the summaries of backfilled call logs have no linkedid_end_time and are not observed
+    _delay_histograms = {
+        CallLogCreatedEvent.name: CALL_LOG_DELAY_SECONDS,
+        CallLogUserCreatedEvent.name: USER_CALL_LOG_DELAY_SECONDS,
+    }
+
+    # sends every event of a batch from a single item of the publishing queue
+    def __init__(self, publisher, on_batch_sent):
+        self._publisher = publisher
+        self._on_batch_sent = on_batch_sent
+
+    def publish(self, events):
+        try:
+            for event, linkedid_end_time in events:
+                self._publish(event, linkedid_end_time)
+        finally:
+            self._on_batch_sent()
+
+    def _publish(self, event, linkedid_end_time):
+        if not linkedid_end_time:
+            self._publisher.publish(event, headers=None)
+            return
+
+        # lets the consumers of the events measure their own delay
+        headers = {'linkedid_end_time': linkedid_end_time.isoformat(),
+                   'linkedid_end_delay': metrics.seconds_since(linkedid_end_time)}
+        self._publisher.publish(event, headers=headers)
 
-    def send_event(self, event):
-        self._publisher.publish(event)
+        delay_histogram = self._delay_histograms.get(event.name)
+        if delay_histogram:
+            delay_histogram.observe(metrics.seconds_since(linkedid_end_time))
@@ -0,0 +1,77 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class TTLCache(object):
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            try:
+                expiration, _ = self._entries[key]
+            except KeyError:
+                return False
+            return expiration > self._clock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expiration, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                raise
+
+            if expiration <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                raise KeyError(key)
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self._max_size <= 0:
+            return
+
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + ttl, value)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def pop_if(self, predicate):
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)}
@@ -0,0 +1,80 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import logging
+import threading
+
+from sqlalchemy import Boolean
+from sqlalchemy import Column
+from sqlalchemy import Date
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy import sql
+from sqlalchemy.ext.declarative import declarative_base
+from xivo_dao.helpers.db_manager import Session
+from xivo_dao.helpers.db_utils import session_scope
+
+logger = logging.getLogger(__name__)
+
+Base = declarative_base()
+
+# the counts of all the call logs, whatever their participants
+ALL_USERS = ''
+
+
+class CallLogCount(Base):
+
+    __tablename__ = 'call_logd_call_log_count'
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    user_uuid = Column(String(38), nullable=False)
+    count = Column(Integer, nullable=False)
+    # the triggers of the call_log tables add a row per change, summed by day and user when compacted
+    compacted = Column(Boolean, nullable=False, server_default='false')
+
+
+_COMPACT = sql.text(
+    'WITH deleted AS ('
+    '  DELETE FROM call_logd_call_log_count WHERE (user_uuid, day) IN ('
+    '    SELECT user_uuid, day FROM call_logd_call_log_count WHERE NOT compacted'
+    '  ) RETURNING day, user_uuid, count'
+    ') '
+    'INSERT INTO call_logd_call_log_count (day, user_uuid, count, compacted) '
+    'SELECT day, user_uuid, sum(count), true FROM deleted GROUP BY day, user_uuid HAVING sum(count) <> 0'
+)
+
+
+class CallLogCountDAO(object):
+
+    def compact(self):
+        # the concurrent compactions would wait for each other to sum the same rows
+        locked = Session.execute(sql.select([sql.func.pg_try_advisory_xact_lock(
+            sql.func.hashtext(CallLogCount.__tablename__))])).scalar()
+        if locked:
+            Session.execute(_COMPACT)
+
+
+class CallLogCountCompactor(object):
+
+    # the rows added by the triggers are summed every compact_interval seconds
+    compact_interval = 60
+
+    def __init__(self, call_log_counts=None):
+        self._call_log_counts = call_log_counts or CallLogCountDAO()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.compact_interval):
+            self.compact()
+
+    def stop(self):
+        self._stopped.set()
+
+    def compact(self):
+        try:
+            with session_scope():
+                self._call_log_counts.compact()
+        except Exception:
+            # the counts stay exact, only their rows are not summed yet
+            logger.exception('Failed to compact the call log counts')
@@ -1,13 +1,174 @@
 # Copyright 2013-2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+from collections import namedtuple
+
+from sqlalchemy import sql
+from xivo_dao.alchemy.cel import CEL
+from xivo_dao.helpers.db_manager import Session
 from xivo_dao.resources.cel import dao as cel_dao
 
+from wazo_call_logd.cel_watermark import CELWatermarkDAO
+
+CEL_COLUMNS = (
+    'id',
+    'eventtype',
+    'eventtime',
+    'uniqueid',
+    'linkedid',
+    'channame',
+    'cid_name',
+    'cid_num',
+    'exten',
+    'userfield',
+    'call_log_id',
+)
+
+CELRow = namedtuple('CELRow', CEL_COLUMNS)
+
+# locked in the order of their hash, so that instances waiting for each other cannot deadlock
+_LOCK_LINKED_IDS = sql.text(
+    'SELECT linkedid, '
+    'CASE WHEN pg_try_advisory_xact_lock(hash) THEN false ELSE pg_advisory_xact_lock(hash) IS NOT NULL END AS waited '
+    'FROM (SELECT linkedid, hashtext(linkedid) AS hash '
+    'FROM unnest(CAST(:linked_ids AS varchar[])) AS linkedid ORDER BY hash) AS linked_ids'
+)
+
 
 class CELFetcher(object):
 
+    chunk_size = 5000
+
+    def __init__(self, watermark=None):
+        self._watermark = watermark or CELWatermarkDAO()
+
     def fetch_last_unprocessed(self, cel_count=None, older=None):
         return cel_dao.find_last_unprocessed(cel_count, older)
 
+    def fetch_last_unprocessed_linked_ids_in_chunks(self, cel_count=None, older=None):
+        # CEL up to the watermark have already been processed by a previous run, only
+        # new CEL are searched. CEL of calls still in progress are processed again with
+        # the whole call when its next CEL are beyond the watermark.
+        last = self._find_last()
+        max_id = last.id if last else 0
+        watermark = self._find_watermark(max_id)
+        after_id = self._find_id_before_unprocessed(cel_count, older, watermark, max_id)
+        # the last CEL id of the fetched calls, forgotten once the chunks are past it: their
+        # CEL left unlinked, e.g. of an invalid call, must not be fetched again
+        fetched_last_ids = {}
+
+        while after_id < max_id:
+            rows = self._find_unprocessed(after_id, max_id, self.chunk_size)
+            if not rows:
+                break
+            after_id = rows[-1].id
+
+            linked_ids = set(row.linkedid for row in rows if row.linkedid not in fetched_last_ids)
+            fetched_last_ids = {linked_id: last_id for linked_id, last_id in fetched_last_ids.items()
+                                if last_id > after_id}
+            if not linked_ids:
+                continue
+            fetched_last_ids.update((linked_id, last_id)
+                                    for linked_id, last_id in self._find_last_ids(linked_ids, max_id).items()
+                                    if last_id > after_id)
+
+            yield linked_ids
+            self._watermark.set(after_id, rows[-1].linkedid)
+
+        if last:
+            self._watermark.set(last.id, last.linkedid)
+
+    def rewind_watermark(self, older=None):
+        if not older:
+            self._watermark.reset()
+            return
+
+        first_id = Session.query(sql.func.min(CEL.id)).filter(CEL.eventtime >= older).scalar()
+        if first_id:
+            self._watermark.lower(first_id - 1)
+
     def fetch_from_linked_id(self, linked_id):
-        return cel_dao.find_from_linked_id(linked_id)
+        return self._find_from_linked_ids([linked_id])
+
+    def fetch_from_linked_ids(self, linked_ids):
+        return self._find_from_linked_ids(linked_ids)
+
+    def count_unlinked(self, linked_ids):
+        # the number of CEL of the calls whose CEL are not linked to a call log yet
+        rows = (Session.query(CEL.linkedid, sql.func.count(CEL.id), sql.func.count(CEL.call_log_id))
+                .filter(CEL.linkedid.in_(linked_ids))
+                .group_by(CEL.linkedid)
+                .all())
+        return {linked_id: count for linked_id, count, linked_count in rows if not linked_count}
+
+    def find_generated(self, linked_ids):
+        # the calls whose CEL are all linked to a call log
+        rows = (Session.query(CEL.linkedid)
+                .filter(CEL.linkedid.in_(linked_ids))
+                .group_by(CEL.linkedid)
+                .having(sql.func.count(CEL.id) == sql.func.count(CEL.call_log_id))
+                .all())
+        return set(row.linkedid for row in rows)
+
+    def lock_linked_ids(self, linked_ids):
+        # the locks are released at the end of the transaction. Returns the linked ids
+        # that were being generated by another instance, only locked once it committed
+        rows = Session.execute(_LOCK_LINKED_IDS, {'linked_ids': list(linked_ids)})
+        return set(row.linkedid for row in rows if row.waited)
+
+    def _find_id_before_unprocessed(self, cel_count, older, watermark, max_id):
+        if cel_count:
+            first_id = (Session.query(CEL.id)
+                        .filter(CEL.id > watermark)
+                        .filter(CEL.call_log_id == None)  # noqa
+                        .order_by(CEL.id.desc())
+                        .offset(cel_count - 1)
+                        .limit(1)
+                        .scalar())
+            return first_id - 1 if first_id else watermark
+        elif older:
+            first_id = (Session.query(sql.func.min(CEL.id))
+                        .filter(CEL.id > watermark)
+                        .filter(CEL.eventtime >= older)
+                        .scalar())
+            return first_id - 1 if first_id else max_id
+        return watermark
+
+    def _find_watermark(self, max_id):
+        cel_id, linkedid = self._watermark.get()
+        if cel_id > max_id:
+            # the CEL table was emptied or recreated since the last run
+            return 0
+        if linkedid and self._find_linked_id(cel_id) not in (None, linkedid):
+            # the CEL ids were reused: the watermark does not match the CEL anymore
+            return 0
+        return cel_id
+
+    def _find_last(self):
+        return Session.query(CEL.id, CEL.linkedid).order_by(CEL.id.desc()).first()
+
+    def _find_linked_id(self, cel_id):
+        return Session.query(CEL.linkedid).filter(CEL.id == cel_id).scalar()
+
+    def _find_unprocessed(self, after_id, max_id, limit):
+        return (Session.query(CEL.id, CEL.linkedid)
+                .filter(CEL.id > after_id)
+                .filter(CEL.id <= max_id)
+                .filter(CEL.call_log_id == None)  # noqa
+                .order_by(CEL.id)
+                .limit(limit)
+                .all())
+
+    def _find_last_ids(self, linked_ids, max_id):
+        rows = (Session.query(CEL.linkedid, sql.func.max(CEL.id))
+                .filter(CEL.linkedid.in_(linked_ids))
+                .filter(CEL.id <= max_id)
+                .group_by(CEL.linkedid)
+                .all())
+        return dict(rows)
+
+    def _find_from_linked_ids(self, linked_ids):
+        query = (Session.query(*[getattr(CEL, column) for column in CEL_COLUMNS])
+                 .filter(CEL.linkedid.in_(linked_ids))
+                 .order_by(CEL.eventtime, CEL.id))
+        return [CELRow._make(row) for row in Session.execute(query.statement)]
@@ -0,0 +1,56 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from collections import OrderedDict
+
+
+class IndexedCELs(list):
+
+    def __init__(self, cels):
+        super(IndexedCELs, self).__init__(cels)
+        by_uniqueid = self._by_uniqueid = OrderedDict()
+        by_eventtype = self._by_eventtype = {}
+        self._first_last = {}
+
+        for cel in self:
+            try:
+                by_uniqueid[cel.uniqueid].append(cel)
+            except KeyError:
+                by_uniqueid[cel.uniqueid] = [cel]
+            try:
+                by_eventtype[cel.eventtype].append(cel)
+            except KeyError:
+                by_eventtype[cel.eventtype] = [cel]
+
+    @classmethod
+    def of(cls, cels):
+        return cels if isinstance(cels, cls) else cls(cels)
+
+    @property
+    def uniqueids(self):
+        return list(self._by_uniqueid)
+
+    def by_uniqueid(self, uniqueid):
+        return self._by_uniqueid.get(uniqueid, [])
+
+    def by_eventtype(self, eventtype):
+        return self._by_eventtype.get(eventtype, [])
+
+    def first(self, uniqueid, eventtype):
+        first_last = self._get_first_last(uniqueid, eventtype)
+        return first_last and first_last[0]
+
+    def last(self, uniqueid, eventtype):
+        first_last = self._get_first_last(uniqueid, eventtype)
+        return first_last and first_last[1]
+
+    def _get_first_last(self, uniqueid, eventtype):
+        key = (uniqueid, eventtype)
+        try:
+            return self._first_last[key]
+        except KeyError:
+            pass
+
+        cels = [cel for cel in self.by_uniqueid(uniqueid) if cel.eventtype == eventtype]
+        first_last = self._first_last[key] = (cels[0], cels[-1]) if cels else None
+        return first_last
@@ -9,23 +9,24 @@ from xivo.asterisk.protocol_interface import InvalidChannelError
 from xivo_dao.resources.cel.event_type import CELEventType
 from xivo_dao.alchemy.call_log_participant import CallLogParticipant
 
+from wazo_call_logd.cel_index import IndexedCELs
+
 logger = logging.getLogger(__name__)
 
 
-def find_participant(confd, channame, role):
+def find_participant(participant_lookup, channame, role):
     try:
         protocol, line_name = protocol_interface_from_channel(channame)
     except InvalidChannelError:
         return None
 
     logger.debug('Looking up participant with protocol %s and line name "%s"', protocol, line_name)
-    lines = confd.lines.list(name=line_name)['items']
-    if lines:
-        line = lines[0]
+    line = participant_lookup.get_line(line_name)
+    if line:
         logger.debug('Found participant line id %s', line['id'])
         users = line['users']
         if users:
-            user = confd.users.get(users[0]['uuid'])
+            user = participant_lookup.get_user(users[0]['uuid'])
             tags = [tag.strip() for tag in user['userfield'].split(',')] if user['userfield'] else []
             logger.debug('Found participant user uuid %s', user['uuid'])
             participant = CallLogParticipant(role=role,
@@ -36,6 +37,19 @@ def find_participant(confd, channame, role):
     return None
 
 
+def list_line_names(cels):
+    line_names = set()
+    for cel in cels:
+        if cel.eventtype != CELEventType.chan_start:
+            continue
+        try:
+            _, line_name = protocol_interface_from_channel(cel.channame)
+        except InvalidChannelError:
+            continue
+        line_names.add(line_name)
+    return line_names
+
+
 class DispatchCELInterpretor(object):
 
     def __init__(self, caller_cel_interpretor, callee_cel_interpretor):
@@ -49,12 +63,13 @@ class DispatchCELInterpretor(object):
         return call_log
 
     def split_caller_callee_cels(self, cels):
-        uniqueids = [cel.uniqueid for cel in cels if cel.eventtype == CELEventType.chan_start]
+        cels = IndexedCELs.of(cels)
+        uniqueids = [cel.uniqueid for cel in cels.by_eventtype(CELEventType.chan_start)]
         caller_uniqueid = uniqueids[0] if len(uniqueids) > 0 else None
         callee_uniqueid = uniqueids[1] if len(uniqueids) > 1 else None
 
-        caller_cels = [cel for cel in cels if cel.uniqueid == caller_uniqueid]
-        callee_cels = [cel for cel in cels if cel.uniqueid == callee_uniqueid]
+        caller_cels = list(cels.by_uniqueid(caller_uniqueid))
+        callee_cels = list(cels.by_uniqueid(callee_uniqueid))
 
         return (caller_cels, callee_cels)
 
@@ -83,7 +98,7 @@ class AbstractCELInterpretor(object):
 
 class CallerCELInterpretor(AbstractCELInterpretor):
 
-    def __init__(self, confd):
+    def __init__(self, participant_lookup):
         self.eventtype_map = {
             CELEventType.chan_start: self.interpret_chan_start,
             CELEventType.chan_end: self.interpret_chan_end,
@@ -95,7 +110,7 @@ class CallerCELInterpretor(AbstractCELInterpretor):
             CELEventType.xivo_incall: self.interpret_xivo_incall,
             CELEventType.xivo_outcall: self.interpret_xivo_outcall,
         }
-        self._confd = confd
+        self._participant_lookup = participant_lookup
 
     def interpret_chan_start(self, cel, call):
         call.date = cel.eventtime
@@ -103,7 +118,7 @@ class CallerCELInterpretor(AbstractCELInterpretor):
         call.source_exten = cel.cid_num
         call.destination_exten = cel.exten if cel.exten != 's' else ''
         call.source_line_identity = identity_from_channel(cel.channame)
-        participant = find_participant(self._confd, cel.channame, role='source')
+        participant = find_participant(self._participant_lookup, cel.channame, role='source')
         if participant:
             call.participants.append(participant)
 
@@ -154,15 +169,15 @@ class CallerCELInterpretor(AbstractCELInterpretor):
 
 
 class CalleeCELInterpretor(AbstractCELInterpretor):
-    def __init__(self, confd):
+    def __init__(self, participant_lookup):
         self.eventtype_map = {
             CELEventType.chan_start: self.interpret_chan_start,
         }
-        self._confd = confd
+        self._participant_lookup = participant_lookup
 
     def interpret_chan_start(self, cel, call):
         call.destination_line_identity = identity_from_channel(cel.channame)
-        participant = find_participant(self._confd, cel.channame, role='destination')
+        participant = find_participant(self._participant_lookup, cel.channame, role='destination')
         if participant:
             call.participants.append(participant)
 
@@ -170,22 +185,22 @@ class CalleeCELInterpretor(AbstractCELInterpretor):
 
 
 class LocalOriginateCELInterpretor(object):
-    def __init__(self, confd):
-        self._confd = confd
+    def __init__(self, participant_lookup):
+        self._participant_lookup = participant_lookup
 
     def interpret_cels(self, cels, call):
-        uniqueids = [cel.uniqueid for cel in cels if cel.eventtype == 'CHAN_START']
+        cels = IndexedCELs.of(cels)
+        uniqueids = [cel.uniqueid for cel in cels.by_eventtype('CHAN_START')]
         try:
             local_channel1, local_channel2, source_channel = starting_channels = uniqueids[:3]
         except ValueError:  # in case a CHAN_START is missing...
             return call
 
-        try:
-            local_channel1_start = next(cel for cel in cels if cel.uniqueid == local_channel1 and cel.eventtype == 'CHAN_START')
-            source_channel_answer = next(cel for cel in cels if cel.uniqueid == source_channel and cel.eventtype == 'ANSWER')
-            source_channel_end = next(cel for cel in cels if cel.uniqueid == source_channel and cel.eventtype == 'CHAN_END')
-            local_channel2_answer = next(cel for cel in cels if cel.uniqueid == local_channel2 and cel.eventtype == 'ANSWER')
-        except StopIteration:
+        local_channel1_start = cels.first(local_channel1, 'CHAN_START')
+        source_channel_answer = cels.first(source_channel, 'ANSWER')
+        source_channel_end = cels.first(source_channel, 'CHAN_END')
+        local_channel2_answer = cels.first(local_channel2, 'ANSWER')
+        if not (local_channel1_start and source_channel_answer and source_channel_end and local_channel2_answer):
             return call
 
         call.date = local_channel1_start.eventtime
@@ -193,39 +208,38 @@ class LocalOriginateCELInterpretor(object):
         call.source_name = source_channel_answer.cid_name
         call.source_exten = source_channel_answer.cid_num
         call.source_line_identity = identity_from_channel(source_channel_answer.channame)
-        participant = find_participant(self._confd, source_channel_answer.channame, role='source')
+        participant = find_participant(self._participant_lookup, source_channel_answer.channame, role='source')
         if participant:
             call.participants.append(participant)
         call.destination_exten = local_channel2_answer.cid_num
 
-        local_channel1_app_start = next((cel for cel in cels if cel.uniqueid == local_channel1 and cel.eventtype == 'APP_START'), None)
+        local_channel1_app_start = cels.first(local_channel1, 'APP_START')
         if local_channel1_app_start:
             call.user_field = local_channel1_app_start.userfield
 
-        other_channels_start = [cel for cel in cels if cel.uniqueid not in starting_channels and cel.eventtype == 'CHAN_START']
-        non_local_other_channels = [cel.uniqueid for cel in other_channels_start if not cel.channame.lower().startswith('local/')]
-        other_channels_bridge_enter = [cel for cel in cels if cel.uniqueid in non_local_other_channels and cel.eventtype == 'BRIDGE_ENTER']
+        other_channels_start = [cel for cel in cels.by_eventtype('CHAN_START') if cel.uniqueid not in starting_channels]
+        non_local_other_channels = set(cel.uniqueid for cel in other_channels_start if not cel.channame.lower().startswith('local/'))
+        other_channels_bridge_enter = [cel for cel in cels.by_eventtype('BRIDGE_ENTER') if cel.uniqueid in non_local_other_channels]
         destination_channel = other_channels_bridge_enter[-1].uniqueid if other_channels_bridge_enter else None
 
         if destination_channel:
-            try:
-                # in outgoing calls, destination ANSWER event has more callerid information than START event
-                destination_channel_answer = next(cel for cel in cels if cel.uniqueid == destination_channel and cel.eventtype == 'ANSWER')
-                # take the last bridge enter/exit to skip local channel optimization
-                destination_channel_bridge_enter = next(reversed([cel for cel in cels if cel.uniqueid == destination_channel and cel.eventtype == 'BRIDGE_ENTER']))
-            except StopIteration:
+            # in outgoing calls, destination ANSWER event has more callerid information than START event
+            destination_channel_answer = cels.first(destination_channel, 'ANSWER')
+            # take the last bridge enter/exit to skip local channel optimization
+            destination_channel_bridge_enter = cels.last(destination_channel, 'BRIDGE_ENTER')
+            if not destination_channel_answer:
                 return call
 
             call.destination_name = destination_channel_answer.cid_name
             call.destination_exten = destination_channel_answer.cid_num
             call.destination_line_identity = identity_from_channel(destination_channel_answer.channame)
-            participant = find_participant(self._confd, destination_channel_answer.channame, role='destination')
+            participant = find_participant(self._participant_lookup, destination_channel_answer.channame, role='destination')
             if participant:
                 call.participants.append(participant)
             call.date_answer = destination_channel_bridge_enter.eventtime
 
-        is_incall = any([True for cel in cels if cel.eventtype == 'XIVO_INCALL'])
-        is_outcall = any([True for cel in cels if cel.eventtype == 'XIVO_OUTCALL'])
+        is_incall = bool(cels.by_eventtype('XIVO_INCALL'))
+        is_outcall = bool(cels.by_eventtype('XIVO_OUTCALL'))
         if is_incall:
             call.direction = 'inbound'
         if is_outcall:
@@ -235,25 +249,28 @@ class LocalOriginateCELInterpretor(object):
 
     @classmethod
     def can_interpret(cls, cels):
+        cels = IndexedCELs.of(cels)
         return (cls.three_channels_minimum(cels) and
                 cls.first_two_channels_are_local(cels) and
                 cls.first_channel_is_answered_before_any_other_operation(cels))
 
     @classmethod
     def three_channels_minimum(cls, cels):
-        channels = set(cel.uniqueid for cel in cels)
-        return len(channels) >= 3
+        cels = IndexedCELs.of(cels)
+        return len(cels.uniqueids) >= 3
 
     @classmethod
     def first_two_channels_are_local(cls, cels):
-        names = [cel.channame for cel in cels if cel.eventtype == 'CHAN_START']
+        cels = IndexedCELs.of(cels)
+        names = [cel.channame for cel in cels.by_eventtype('CHAN_START')]
         return (len(names) >= 2 and
                 names[0].lower().startswith('local/') and
                 names[1].lower().startswith('local/'))
 
     @classmethod
     def first_channel_is_answered_before_any_other_operation(cls, cels):
-        first_channel_cels = [cel for cel in cels if cel.uniqueid == cels[0].uniqueid]
+        cels = IndexedCELs.of(cels)
+        first_channel_cels = cels.by_uniqueid(cels[0].uniqueid)
         return (len(first_channel_cels) >= 2 and
                 first_channel_cels[0].eventtype == 'CHAN_START' and
                 first_channel_cels[1].eventtype == 'ANSWER')
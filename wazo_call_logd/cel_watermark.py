@@ -0,0 +1,43 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from sqlalchemy import Column
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy.ext.declarative import declarative_base
+from xivo_dao.helpers.db_manager import Session
+
+Base = declarative_base()
+
+
+class CELWatermark(Base):
+
+    __tablename__ = 'call_logd_cel_watermark'
+
+    id = Column(Integer, primary_key=True)
+    cel_id = Column(Integer, nullable=False)
+    # linkedid of the CEL cel_id, to notice when the CEL ids are reused
+    linkedid = Column(String(150))
+
+
+class CELWatermarkDAO(object):
+
+    def get(self):
+        row = Session.query(CELWatermark.cel_id, CELWatermark.linkedid).first()
+        return (row.cel_id, row.linkedid) if row else (0, None)
+
+    def set(self, cel_id, linkedid):
+        values = {'cel_id': cel_id, 'linkedid': linkedid}
+        updated = Session.query(CELWatermark).update(values, synchronize_session=False)
+        if not updated:
+            Session.add(CELWatermark(**values))
+            Session.flush()
+
+    def lower(self, cel_id):
+        # the linkedid of the new cel_id is not known
+        (Session.query(CELWatermark)
+         .filter(CELWatermark.cel_id > cel_id)
+         .update({'cel_id': cel_id, 'linkedid': None}, synchronize_session=False))
+
+    def reset(self):
+        Session.query(CELWatermark).delete(synchronize_session=False)
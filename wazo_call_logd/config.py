@@ -50,9 +50,28 @@ _DEFAULT_CONFIG = {
         'port': 9486,
         'verify_certificate': _CERT_FILE,
     },
+    'participant_lookup': 'confd',
+    'participant_cache': {
+        'max_size': 2048,
+        'ttl': 14400,
+        'negative_ttl': 60,
+    },
+    'call_logs_writer': 'dao',
+    'bus_consumer': {
+        'workers': 1,
+        'prefetch_count': 1000,
+        'queue_name': None,
+        'live_cels': {
+            'enabled': False,
+            'max_calls': 10000,
+            'max_cels_per_call': 1000,
+            'ttl': 3600,
+        },
+    },
     'enabled_plugins': {
         'api': True,
         'cdr': True,
+        'metrics': True,
     }
 }
 
@@ -65,6 +84,12 @@ def load(argv):
     return ChainMap(reinterpreted_config, cli_config, service_key, file_config, _DEFAULT_CONFIG)
 
 
+def load_db_uri(config_file=None):
+    cli_config = {'config_file': config_file} if config_file else {}
+    file_config = read_config_file_hierarchy(ChainMap(cli_config, _DEFAULT_CONFIG))
+    return ChainMap(file_config, _DEFAULT_CONFIG)['db_uri']
+
+
 def _parse_cli_args(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('-c',
@@ -7,8 +7,11 @@ from threading import Thread
 from xivo.token_renewer import TokenRenewer
 from xivo_auth_client import Client as AuthClient
 from xivo_confd_client import Client as ConfdClient
+from xivo_dao.helpers.db_manager import Session
 
+from wazo_call_logd import metrics
 from wazo_call_logd.bus_client import BusClient
+from wazo_call_logd.call_log_count import CallLogCountCompactor
 from wazo_call_logd.cel_fetcher import CELFetcher
 from wazo_call_logd.cel_interpretor import DispatchCELInterpretor
 from wazo_call_logd.cel_interpretor import CallerCELInterpretor
@@ -18,7 +21,8 @@ from wazo_call_logd.core import plugin_manager
 from wazo_call_logd.core.rest_api import api, CoreRestApi
 from wazo_call_logd.generator import CallLogsGenerator
 from wazo_call_logd.manager import CallLogsManager
-from wazo_call_logd.writer import CallLogsWriter
+from wazo_call_logd.participant_lookup import new_participant_lookup
+from wazo_call_logd.writer import new_call_logs_writer
 from .bus_publisher import BusPublisher
 
 logger = logging.getLogger(__name__)
@@ -32,15 +36,20 @@ class Controller(object):
         auth_client = AuthClient(**auth_config)
         cel_fetcher = CELFetcher()
         confd_client = ConfdClient(**config['confd'])
+        self.participant_lookup = new_participant_lookup(config, confd_client)
         generator = CallLogsGenerator([
-            LocalOriginateCELInterpretor(confd_client),
-            DispatchCELInterpretor(CallerCELInterpretor(confd_client),
-                                   CalleeCELInterpretor(confd_client))
-        ])
-        writer = CallLogsWriter()
+            LocalOriginateCELInterpretor(self.participant_lookup),
+            DispatchCELInterpretor(CallerCELInterpretor(self.participant_lookup),
+                                   CalleeCELInterpretor(self.participant_lookup))
+        ], self.participant_lookup)
+        writer = new_call_logs_writer(config)
         self._publisher = BusPublisher(config)
+        metrics.gauge('call_logd_bus_publish_queue_size', 'Batches of events waiting to be published on the bus',
+                      self._publisher.queue_size)
+        metrics.register_db_pool('generation', lambda: Session.session_factory.kw['bind'].pool)
         self.manager = CallLogsManager(cel_fetcher, generator, writer, self._publisher)
-        self.bus_client = BusClient(config)
+        self._call_log_count_compactor = CallLogCountCompactor()
+        self.bus_client = BusClient(config, self.participant_lookup)
         self.rest_api = CoreRestApi(config)
         self.token_renewer = TokenRenewer(auth_client)
         self.token_renewer.subscribe_to_token_change(confd_client.set_token)
@@ -52,6 +61,8 @@ class Controller(object):
         bus_publisher_thread.start()
         bus_consumer_thread = Thread(target=self.bus_client.run, args=[self.manager], name='bus_consumer_thread')
         bus_consumer_thread.start()
+        compactor_thread = Thread(target=self._call_log_count_compactor.run, name='call_log_count_compactor_thread')
+        compactor_thread.start()
 
         try:
             with self.token_renewer:
@@ -60,8 +71,12 @@ class Controller(object):
             logger.info('Stopping wazo-call-logd')
             self.bus_client.stop()
             self._publisher.stop()
+            self._call_log_count_compactor.stop()
             bus_consumer_thread.join()
             bus_publisher_thread.join()
+            compactor_thread.join()
+            self.participant_lookup.log_stats()
+            metrics.REGISTRY.log_summary()
 
     def stop(self, reason):
         logger.warning('Stopping wazo-call-logd: %s', reason)
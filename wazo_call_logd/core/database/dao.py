@@ -1,6 +1,8 @@
 # Copyright 2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+import itertools
+
 from contextlib import contextmanager
 
 import sqlalchemy as sa
@@ -10,6 +12,7 @@ from sqlalchemy import event
 from sqlalchemy import exc
 from sqlalchemy import sql
 from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
@@ -19,6 +22,8 @@ from sqlalchemy.pool import Pool
 from xivo_dao.alchemy.call_log import CallLog as CallLogSchema
 from xivo_dao.alchemy.call_log_participant import CallLogParticipant
 
+from wazo_call_logd.call_log_count import ALL_USERS
+from wazo_call_logd.call_log_count import CallLogCount
 from wazo_call_logd.core.exceptions import DatabaseServiceUnavailable
 
 
@@ -54,6 +59,8 @@ class CallLogDAO(object):
         CallLogSchema.destination_exten,
     )
 
+    stream_chunk_size = 1000
+
     def __init__(self, Session):
         self._Session = Session
 
@@ -74,100 +81,177 @@ class CallLogDAO(object):
 
     def find_all_in_period(self, params):
         with self.new_session() as session:
-            query = session.query(CallLogSchema)
-            query = query.options(joinedload('participants'))
-
-            if params.get('start'):
-                query = query.filter(CallLogSchema.date >= params['start'])
-            if params.get('end'):
-                query = query.filter(CallLogSchema.date < params['end'])
-
-            if params.get('search'):
-                filters = (sql.cast(column, sa.String).ilike('%%%s%%' % params['search'])
-                           for column in self.searched_columns)
-                query = query.filter(sql.or_(*filters))
-
-            if params.get('user_uuids'):
-                filters = (CallLogSchema.participant_user_uuids.contains(str(user_uuid))
-                           for user_uuid in params['user_uuids'])
-                query = query.filter(sql.or_(*filters))
-
-            if params.get('call_direction'):
-                query = query.filter(CallLogSchema.direction == params['call_direction'])
-
-            if params.get('number'):
-                sql_regex = params['number'].replace('_', '%')
-                filters = (sql.cast(column, sa.String).like('%s' % sql_regex)
-                           for column in [CallLogSchema.source_exten, CallLogSchema.destination_exten])
-                query = query.filter(sql.or_(*filters))
-
-            for tag in params.get('tags', []):
-                query = query.filter(CallLogSchema.participants.any(
-                    CallLogParticipant.tags.contains(sql.cast([tag], ARRAY(sa.String)))
-                ))
-
-            order_field = None
-            if params.get('order'):
-                if params['order'] == 'marshmallow_duration':
-                    order_field = CallLogSchema.date_end-CallLogSchema.date_answer
-                elif params['order'] == 'marshmallow_answered':
-                    order_field = CallLogSchema.date_answer
-                else:
-                    order_field = getattr(CallLogSchema, params['order'])
-            if params.get('direction') == 'desc':
-                order_field = order_field.desc()
-            if order_field is not None:
-                query = query.order_by(order_field)
-
-            if params.get('limit'):
-                query = query.limit(params['limit'])
-            if params.get('offset'):
-                query = query.offset(params['offset'])
-
-            call_log_rows = query.all()
-
-            if not call_log_rows:
-                return []
-            for call_log in call_log_rows:
-                make_transient(call_log)
-                for participant in call_log.participants:
-                    make_transient(participant)
-
-            return call_log_rows
+            query = self._filter(session.query(CallLogSchema), params)
+            query = query.options(joinedload(CallLogSchema.participants))
+            call_log_rows = self._page(query, CallLogSchema, params).all()
+            return self._make_transient(call_log_rows)
+
+    def stream_in_period(self, params):
+        rows = self._stream_in_period(params)
+        # the query is started now, its errors are not sent in the middle of a streamed response
+        first_rows = list(itertools.islice(rows, 1))
+        return itertools.chain(first_rows, rows)
+
+    def find_all_and_count_in_period(self, params):
+        # the page and its counts from a single statement: the filtered count is a window over the
+        # filtered rows, computed before the cursor, the order and the limit of the page
+        with self.new_session() as session:
+            filtered_query = session.query(CallLogSchema, sql.func.count().over().label('filtered'))
+            filtered = self._filter(filtered_query, params).subquery()
+            call_log = aliased(CallLogSchema, filtered)
+            total = self._total_query(session, params).as_scalar()
+            query = session.query(call_log, filtered.c.filtered, total.label('total'))
+            query = query.options(joinedload(call_log.participants))
+            rows = self._page(query, call_log, params).all()
+            call_logs = self._make_transient([row[0] for row in rows])
+
+        if not rows:
+            # the counts are not known when the page is empty
+            return call_logs, self.count_in_period(params)
+        return call_logs, {'total': rows[0].total, 'filtered': rows[0].filtered}
 
     def count_in_period(self, params):
         with self.new_session() as session:
-            query = session.query(CallLogSchema)
-
-            total = query.count()
-
-            if params.get('start'):
-                query = query.filter(CallLogSchema.date >= params['start'])
-            if params.get('end'):
-                query = query.filter(CallLogSchema.date < params['end'])
-
-            if params.get('call_direction'):
-                query = query.filter(CallLogSchema.direction == params['call_direction'])
-
-            if params.get('search'):
-                filters = (sql.cast(column, sa.String).ilike('%%%s%%' % params['search'])
-                           for column in self.searched_columns)
-                query = query.filter(sql.or_(*filters))
-            if params.get('number'):
-                sql_regex = params['number'].replace('_', '%')
-                filters = (sql.cast(column, sa.String).like('%s' % sql_regex)
-                           for column in [CallLogSchema.source_exten, CallLogSchema.destination_exten])
-                query = query.filter(sql.or_(*filters))
-
-            for tag in params.get('tags', []):
-                query = query.filter(CallLogSchema.participants.any(
-                    CallLogParticipant.tags.contains(sql.cast([tag], ARRAY(sa.String)))
-                ))
-            if params.get('user_uuids'):
-                filters = (CallLogSchema.participant_user_uuids.contains(str(user_uuid))
-                           for user_uuid in params['user_uuids'])
-                query = query.filter(sql.or_(*filters))
-
-            filtered = query.count()
+            total = self._total_query(session, params).scalar()
+            filtered = self._filter(session.query(CallLogSchema), params).count()
 
         return {'total': total, 'filtered': filtered}
+
+    @staticmethod
+    def order_value(call_log, order):
+        if not order:
+            return None
+        elif order == 'marshmallow_duration':
+            if call_log.date_answer and call_log.date_end:
+                return call_log.date_end - call_log.date_answer
+            return None
+        elif order == 'marshmallow_answered':
+            return call_log.date_answer
+        return getattr(call_log, order)
+
+    def _total_query(self, session, params):
+        # the call logs of the listed users, or every call log
+        user_uuids = params.get('user_uuids')
+        if user_uuids and len(user_uuids) > 1:
+            # the call logs shared by the users are only counted once
+            return self._filter(session.query(sql.func.count(CallLogSchema.id)), {'user_uuids': user_uuids})
+
+        # maintained by the triggers of the call log tables, instead of counting every call log
+        user_uuid = str(user_uuids[0]) if user_uuids else ALL_USERS
+        total = sql.cast(sql.func.coalesce(sql.func.sum(CallLogCount.count), 0), sa.Integer)
+        return session.query(total).filter(CallLogCount.user_uuid == user_uuid)
+
+    def _stream_in_period(self, params):
+        # rows of columns named like the attributes of the call logs dumped by the CDRSchema,
+        # fetched by chunks from a server side cursor. The tags are aggregated by a subquery
+        # correlated to each streamed call log, from the participants of that call log only.
+        tag = sql.column('tag')
+        tags = (sql.select([sql.func.array_agg(sql.distinct(tag))])
+                .select_from(CallLogParticipant.__table__)
+                .select_from(sql.func.unnest(CallLogParticipant.tags).alias('tag'))
+                .where(CallLogParticipant.call_log_id == CallLogSchema.id)
+                .as_scalar())
+        columns = [
+            CallLogSchema.id,
+            CallLogSchema.date,
+            CallLogSchema.date_answer,
+            CallLogSchema.date_end,
+            CallLogSchema.source_name,
+            CallLogSchema.source_exten,
+            CallLogSchema.direction,
+            CallLogSchema.destination_name,
+            CallLogSchema.destination_exten,
+            (CallLogSchema.date_end - CallLogSchema.date_answer).label('marshmallow_duration'),
+            CallLogSchema.date_answer.isnot(None).label('marshmallow_answered'),
+            sql.func.coalesce(tags, sql.cast([], ARRAY(sa.String))).label('marshmallow_tags'),
+        ]
+        with self.new_session() as session:
+            query = session.query(*columns).select_from(CallLogSchema)
+            query = self._page(self._filter(query, params), CallLogSchema, params)
+            for row in query.yield_per(self.stream_chunk_size):
+                yield row
+
+    def _filter(self, query, params):
+        if params.get('start'):
+            query = query.filter(CallLogSchema.date >= params['start'])
+        if params.get('end'):
+            query = query.filter(CallLogSchema.date < params['end'])
+
+        if params.get('search'):
+            filters = (sql.cast(column, sa.String).ilike('%%%s%%' % params['search'])
+                       for column in self.searched_columns)
+            query = query.filter(sql.or_(*filters))
+
+        if params.get('user_uuids'):
+            filters = (CallLogSchema.participant_user_uuids.contains(str(user_uuid))
+                       for user_uuid in params['user_uuids'])
+            query = query.filter(sql.or_(*filters))
+
+        if params.get('call_direction'):
+            query = query.filter(CallLogSchema.direction == params['call_direction'])
+
+        if params.get('number'):
+            sql_regex = params['number'].replace('_', '%')
+            filters = (sql.cast(column, sa.String).like('%s' % sql_regex)
+                       for column in [CallLogSchema.source_exten, CallLogSchema.destination_exten])
+            query = query.filter(sql.or_(*filters))
+
+        for tag in params.get('tags', []):
+            query = query.filter(CallLogSchema.participants.any(
+                CallLogParticipant.tags.contains(sql.cast([tag], ARRAY(sa.String)))
+            ))
+
+        return query
+
+    def _page(self, query, call_log, params):
+        order_field = self._order_field(call_log, params.get('order'))
+        descending = params.get('direction') == 'desc'
+        if params.get('cursor'):
+            query = query.filter(self._after_cursor(call_log, order_field, descending, params['cursor']))
+
+        # the id makes the order stable between pages
+        order_fields = [call_log.id] if order_field is None else [order_field, call_log.id]
+        if descending:
+            order_fields = [field.desc() for field in order_fields]
+        query = query.order_by(*order_fields)
+
+        if params.get('limit'):
+            query = query.limit(params['limit'])
+        if params.get('offset'):
+            query = query.offset(params['offset'])
+
+        return query
+
+    def _make_transient(self, call_logs):
+        for call_log in call_logs:
+            make_transient(call_log)
+            for participant in call_log.participants:
+                make_transient(participant)
+        return call_logs
+
+    def _order_field(self, call_log, order):
+        if not order:
+            return None
+        elif order == 'marshmallow_duration':
+            return call_log.date_end-call_log.date_answer
+        elif order == 'marshmallow_answered':
+            return call_log.date_answer
+        return getattr(call_log, order)
+
+    def _after_cursor(self, call_log, order_field, descending, cursor):
+        # keyset pagination: the rows sorted after the last row of the previous page
+        id_after = call_log.id < cursor['id'] if descending else call_log.id > cursor['id']
+        if order_field is None:
+            return id_after
+
+        # NULL values are sorted last in ascending order and first in descending order
+        if cursor['value'] is None:
+            if descending:
+                return sql.or_(order_field.isnot(None), sql.and_(order_field.is_(None), id_after))
+            return sql.and_(order_field.is_(None), id_after)
+
+        key, cursor_key = sql.tuple_(order_field, call_log.id), sql.tuple_(cursor['value'], cursor['id'])
+        after = key < cursor_key if descending else key > cursor_key
+        if descending or not getattr(order_field.expression, 'nullable', True):
+            return after
+        return sql.or_(after, order_field.is_(None))
@@ -4,3 +4,10 @@
 
 class InvalidCallLogException(ValueError):
     pass
+
+
+class OutdatedSchemaException(RuntimeError):
+
+    def __init__(self, current, head):
+        message = 'Database schema at version {} instead of {}: run wazo-call-logd-upgrade-db'.format(current, head)
+        super(OutdatedSchemaException, self).__init__(message)
@@ -4,49 +4,92 @@
 import logging
 
 from collections import namedtuple
-from itertools import groupby
-from operator import attrgetter
+from collections import OrderedDict
+from xivo_dao.resources.cel.event_type import CELEventType
+from wazo_call_logd.cel_index import IndexedCELs
+from wazo_call_logd.cel_interpretor import list_line_names
 from wazo_call_logd.exceptions import InvalidCallLogException
+from wazo_call_logd import metrics
 from wazo_call_logd import raw_call_log
 
 
 logger = logging.getLogger(__name__)
+GENERATED = metrics.counter('call_logd_call_logs_generated_total', 'Call logs generated')
+REJECTED = metrics.counter('call_logd_call_logs_rejected_total', 'Invalid call logs rejected')
 CallLogsCreation = namedtuple('CallLogsCreation', ('new_call_logs', 'call_logs_to_delete'))
 
 
 class CallLogsGenerator(object):
 
-    def __init__(self, cel_interpretors):
+    def __init__(self, cel_interpretors, participant_lookup=None):
         self._cel_interpretors = cel_interpretors
+        self._participant_lookup = participant_lookup
 
     def from_cel(self, cels):
         call_logs_to_delete = self.list_call_log_ids(cels)
-        new_call_logs = self.call_logs_from_cel(cels)
+        new_call_logs = list(self.call_logs_from_cel(cels))
         return CallLogsCreation(new_call_logs=new_call_logs, call_logs_to_delete=call_logs_to_delete)
 
+    def from_cel_in_chunks(self, cels, chunk_size):
+        call_logs_to_delete = self.list_call_log_ids(cels)
+        new_call_logs = []
+        for call_log in self.call_logs_from_cel(cels):
+            new_call_logs.append(call_log)
+            if len(new_call_logs) >= chunk_size:
+                yield CallLogsCreation(new_call_logs=new_call_logs, call_logs_to_delete=call_logs_to_delete)
+                new_call_logs, call_logs_to_delete = [], set()
+
+        if new_call_logs or call_logs_to_delete:
+            yield CallLogsCreation(new_call_logs=new_call_logs, call_logs_to_delete=call_logs_to_delete)
+
     def call_logs_from_cel(self, cels):
-        result = []
-        for _, cels_by_call_iter in self._group_cels_by_linkedid(cels):
-            cels_by_call = list(cels_by_call_iter)
+        if self._participant_lookup:
+            self._participant_lookup.prefetch(list_line_names(cels))
+
+        for cels_by_call in self._group_cels_by_linkedid(cels):
+            cels_by_call = IndexedCELs(cels_by_call)
 
             call_log = raw_call_log.RawCallLog()
-            call_log.cel_ids = [cel.id for cel in cels_by_call]
+            call_log.linked_id = cels_by_call[0].linkedid
+            linkedid_ends = cels_by_call.by_eventtype(CELEventType.linkedid_end)
+            call_log.linkedid_end_time = linkedid_ends[-1].eventtime if linkedid_ends else None
+            # the CEL received from the bus are not identified yet
+            call_log.cel_ids = [cel.id for cel in cels_by_call if cel.id is not None]
 
             interpretor = self._get_interpretor(cels_by_call)
             call_log = interpretor.interpret_cels(cels_by_call, call_log)
             try:
-                result.append(call_log.to_call_log())
+                call_log = call_log.to_call_log()
             except InvalidCallLogException as e:
                 logger.debug('Invalid call log detected: %s', e)
-
-        return result
+                REJECTED.inc()
+            else:
+                GENERATED.inc()
+                yield call_log
 
     def list_call_log_ids(self, cels):
         return set(cel.call_log_id for cel in cels if cel.call_log_id)
 
     def _group_cels_by_linkedid(self, cels):
-        cels = sorted(cels, key=attrgetter('linkedid'))
-        return groupby(cels, key=attrgetter('linkedid'))
+        groups = OrderedDict()
+        # LINKEDID_END is the last event of a call, but other CEL of the same call
+        # may share its eventtime: wait for a later CEL before yielding the group
+        ended_groups = OrderedDict()
+
+        for cel in cels:
+            while ended_groups:
+                linkedid, end_time = next(iter(ended_groups.items()))
+                if not end_time < cel.eventtime:
+                    break
+                del ended_groups[linkedid]
+                yield groups.pop(linkedid)
+
+            groups.setdefault(cel.linkedid, []).append(cel)
+            if cel.eventtype == CELEventType.linkedid_end:
+                ended_groups[cel.linkedid] = cel.eventtime
+
+        for group in groups.values():
+            yield group
 
     def _get_interpretor(self, cels):
         for interpretor in self._cel_interpretors:
@@ -0,0 +1,97 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import logging
+import time
+
+from collections import OrderedDict
+from datetime import datetime
+from xivo_dao.resources.cel.event_type import CELEventType
+
+from wazo_call_logd.cel_fetcher import CELRow
+
+logger = logging.getLogger(__name__)
+
+_EVENT_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def cel_from_event(data):
+    return CELRow(
+        id=None,
+        eventtype=data['EventName'],
+        eventtime=_parse_event_time(data['EventTime']),
+        uniqueid=data['UniqueID'],
+        linkedid=data['LinkedID'],
+        channame=data['Channel'],
+        cid_name=data['CallerIDname'],
+        cid_num=data['CallerIDnum'],
+        exten=data['Exten'],
+        userfield=data['Userfield'],
+        call_log_id=None,
+    )
+
+
+def _parse_event_time(event_time):
+    # the manager CEL backend sends a timestamp, unless a dateformat is configured
+    try:
+        return datetime.fromtimestamp(float(event_time))
+    except ValueError:
+        pass
+
+    for event_time_format in _EVENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(event_time, event_time_format)
+        except ValueError:
+            pass
+
+    raise ValueError('Unknown CEL event time format: {}'.format(event_time))
+
+
+class LiveCELs(object):
+
+    def __init__(self, max_calls, max_cels_per_call, ttl, clock=time.monotonic):
+        self._max_calls = max_calls
+        self._max_cels_per_call = max_cels_per_call
+        self._ttl = ttl
+        self._clock = clock
+        # linkedid: [last update, CEL], the least recently updated call first
+        self._calls = OrderedDict()
+
+    def add(self, cel):
+        call = self._calls.get(cel.linkedid)
+        if call is None:
+            # only the calls seen from their first CEL are complete, the other
+            # ones will be generated from the database
+            if not self._is_first_cel(cel):
+                return
+            call = self._calls[cel.linkedid] = [None, []]
+            if len(self._calls) > self._max_calls:
+                linked_id, _ = self._calls.popitem(last=False)
+                logger.debug('Too many calls in progress, evicting %s', linked_id)
+        else:
+            self._calls.move_to_end(cel.linkedid)
+
+        call[0] = self._clock()
+        call[1].append(cel)
+        if len(call[1]) > self._max_cels_per_call:
+            logger.debug('Too many CEL for %s, evicting', cel.linkedid)
+            del self._calls[cel.linkedid]
+
+    def pop(self, linked_id):
+        call = self._calls.pop(linked_id, None)
+        return call[1] if call else None
+
+    def clear(self):
+        self._calls.clear()
+
+    def evict_expired(self):
+        expired = self._clock() - self._ttl
+        while self._calls:
+            linked_id, (updated, _) = next(iter(self._calls.items()))
+            if updated > expired:
+                return
+            logger.debug('No CEL received for %s since %s seconds, evicting', linked_id, self._ttl)
+            del self._calls[linked_id]
+
+    def _is_first_cel(self, cel):
+        return cel.eventtype == CELEventType.chan_start and cel.uniqueid == cel.linkedid
@@ -2,51 +2,226 @@
 # SPDX-License-Identifier: GPL-3.0+
 
 import logging
+import multiprocessing
+import time
 from datetime import datetime, timedelta
 
 from xivo_dao.helpers.db_utils import session_scope
 from xivo_dao.resources.call_log import dao as call_log_dao
 
+from wazo_call_logd import metrics
+
 logger = logging.getLogger(__name__)
 
+FETCH_SECONDS = metrics.histogram('call_logd_fetch_seconds', 'CEL fetches')
+GENERATE_SECONDS = metrics.histogram('call_logd_generate_seconds', 'Call logs generations')
+WRITE_SECONDS = metrics.histogram('call_logd_write_seconds', 'Call logs writes')
+PUBLISH_SECONDS = metrics.histogram('call_logd_publish_seconds', 'Call logs publications')
+COMMIT_DELAY_SECONDS = metrics.histogram('call_logd_linkedid_end_to_commit_seconds',
+                                         'Delays from LINKEDID_END to the call log commit',
+                                         buckets=metrics.DELAY_BUCKETS)
+
 
 class CallLogsManager(object):
 
-    def __init__(self, cel_fetcher, generator, writer, publisher):
+    write_chunk_size = 500
+
+    def __init__(self, cel_fetcher, generator, writer, publisher, backfill=False):
         self.cel_fetcher = cel_fetcher
         self.generator = generator
         self.writer = writer
         self.publisher = publisher
+        # publish a summary of each chunk instead of the events of each call log
+        self.backfill = backfill
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
 
     def delete_all(self):
         with session_scope():
             call_log_dao.delete()
+            self.cel_fetcher.rewind_watermark()
 
     def delete_from_days(self, days):
         older = datetime.now() - timedelta(days=days)
         with session_scope():
             call_log_dao.delete(older=older)
+            self.cel_fetcher.rewind_watermark(older=older)
 
     def generate_from_days(self, days):
         older_cel = datetime.now() - timedelta(days=days)
-        with session_scope():
-            cels = self.cel_fetcher.fetch_last_unprocessed(older=older_cel)
-            self._generate_from_cels(cels)
+        logger.debug('Generating call logs from the CEL of the last %s days', days)
+        self._generate_from_unprocessed(older=older_cel)
 
     def generate_from_count(self, cel_count):
-        with session_scope():
-            cels = self.cel_fetcher.fetch_last_unprocessed(cel_count)
-            logger.debug('Generating call logs from the last %s CEL (found %s)', cel_count, len(cels))
-            self._generate_from_cels(cels)
+        logger.debug('Generating call logs from the last %s CEL', cel_count)
+        self._generate_from_unprocessed(cel_count=cel_count)
 
     def generate_from_linked_id(self, linked_id):
+        self.generate_from_linked_ids([linked_id])
+
+    def generate_from_linked_ids(self, linked_ids, cels_by_linked_id=None):
+        # cels_by_linked_id holds the CEL of the calls received whole from the bus,
+        # the CEL of the other calls are fetched from the database
+        cels_by_linked_id = cels_by_linked_id or {}
         with session_scope():
-            cels = self.cel_fetcher.fetch_from_linked_id(linked_id)
-            logger.debug('Generating call log for linked_id %s from %s CEL', linked_id, len(cels))
-            self._generate_from_cels(cels)
+            waited_linked_ids = self.cel_fetcher.lock_linked_ids(linked_ids)
+            if waited_linked_ids:
+                # generated meanwhile by another instance, its call logs are not generated again
+                generated = self.cel_fetcher.find_generated(waited_linked_ids)
+                logger.debug('Skipping %s linked_ids generated by another instance', len(generated))
+                linked_ids = [linked_id for linked_id in linked_ids if linked_id not in generated]
+
+            # the CEL received from the bus are only used when the CEL table holds the same
+            # number of CEL: the table may be missing some not yet inserted, the bus may
+            # have lost some, or the call may have been generated already
+            live_linked_ids = [linked_id for linked_id in linked_ids if linked_id in cels_by_linked_id]
+            cel_counts = self.cel_fetcher.count_unlinked(live_linked_ids) if live_linked_ids else {}
+
+            cels = []
+            unknown_linked_ids = []
+            for linked_id in sorted(set(linked_ids)):
+                live_cels = cels_by_linked_id.get(linked_id)
+                if live_cels and cel_counts.get(linked_id) == len(live_cels):
+                    cels.extend(live_cels)
+                else:
+                    unknown_linked_ids.append(linked_id)
+            if unknown_linked_ids:
+                with FETCH_SECONDS.time():
+                    cels.extend(self.cel_fetcher.fetch_from_linked_ids(unknown_linked_ids))
+
+            logger.debug('Generating call logs for %s linked_ids (%s fetched from the database) from %s CEL',
+                         len(set(linked_ids)), len(unknown_linked_ids), len(cels))
+            call_logs = self._generate_from_cels(cels)
+        self._observe_commit_delays(call_logs)
+        return len(call_logs)
+
+    def _generate_from_unprocessed(self, cel_count=None, older=None):
+        linked_ids_chunks = self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks(cel_count=cel_count,
+                                                                                         older=older)
+        while True:
+            with session_scope(), FETCH_SECONDS.time():
+                linked_ids = next(linked_ids_chunks, None)
+            if linked_ids is None:
+                break
+
+            logger.debug('Generating call logs for a chunk of %s linked_ids', len(linked_ids))
+            self.generate_from_linked_ids(linked_ids)
 
     def _generate_from_cels(self, cels):
-        call_logs = self.generator.from_cel(cels)
-        logger.debug('Generated %s call logs', len(call_logs.new_call_logs))
-        self.writer.write(call_logs)
-        self.publisher.publish_all(call_logs.new_call_logs)
+        generated = []
+        call_logs_chunks = iter(self.generator.from_cel_in_chunks(cels, self.write_chunk_size))
+        while True:
+            with GENERATE_SECONDS.time():
+                call_logs = next(call_logs_chunks, None)
+            if call_logs is None:
+                break
+
+            generated.extend(call_logs.new_call_logs)
+            with WRITE_SECONDS.time():
+                self.writer.write(call_logs)
+            with PUBLISH_SECONDS.time():
+                if self.backfill:
+                    self.publisher.publish_summary(call_logs.new_call_logs)
+                else:
+                    self.publisher.publish_all(call_logs.new_call_logs)
+        logger.debug('Generated %s call logs', len(generated))
+        return generated
+
+    def _observe_commit_delays(self, call_logs):
+        if self.backfill:
+            # the delays of old calls would swamp the delays of the live calls
+            return
+
+        for call_log in call_logs:
+            if call_log.linkedid_end_time:
+                COMMIT_DELAY_SECONDS.observe(metrics.seconds_since(call_log.linkedid_end_time))
+
+
+class ParallelCallLogsManager(CallLogsManager):
+
+    def __init__(self, cel_fetcher, generator, writer, publisher, jobs, set_token=None, backfill=False):
+        super(ParallelCallLogsManager, self).__init__(cel_fetcher, generator, writer, publisher, backfill)
+        self._jobs = jobs
+        self._set_token = set_token
+        self._token = None
+        self._generated = 0
+        self._fetch_time = 0.0
+        self._job_time = 0.0
+        self._elapsed_time = 0.0
+        self._pool = None
+
+    def __enter__(self):
+        # the workers must be forked before any thread or database connection is started
+        self._pool = multiprocessing.get_context('fork').Pool(self._jobs, initializer=_init_job, initargs=(self,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def set_token(self, token):
+        self._token = token
+
+    def log_stats(self):
+        # the serial path would fetch the chunks and run each job one after the other
+        serial_time = self._fetch_time + self._job_time
+        speedup = serial_time / self._elapsed_time if self._elapsed_time else 0.0
+        logger.info('Generated %s call logs with %s jobs in %.2fs, estimated %.2fs without jobs: '
+                    'estimated speedup of %.1fx', self._generated, self._jobs, self._elapsed_time, serial_time,
+                    speedup)
+
+    def _generate_from_unprocessed(self, cel_count=None, older=None):
+        linked_ids_chunks = self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks(cel_count=cel_count,
+                                                                                         older=older)
+        start = time.time()
+        while True:
+            fetch_start = time.time()
+            with session_scope(), FETCH_SECONDS.time():
+                linked_ids = next(linked_ids_chunks, None)
+            self._fetch_time += time.time() - fetch_start
+            if linked_ids is None:
+                break
+
+            logger.debug('Generating call logs for a chunk of %s linked_ids', len(linked_ids))
+            linked_ids = sorted(linked_ids)
+            tasks = [(self._token, linked_ids[job::self._jobs]) for job in range(self._jobs)]
+            for generated, job_time, metrics_snapshot, events in self._pool.map(_generate_from_linked_ids, tasks):
+                self._generated += generated
+                self._job_time += job_time
+                metrics.REGISTRY.merge(metrics_snapshot)
+                self.publisher.send_events(events)
+        self._elapsed_time += time.time() - start
+
+
+_manager = None
+
+
+def _init_job(manager):
+    global _manager
+    _manager = manager
+
+
+def _generate_from_linked_ids(task):
+    token, linked_ids = task
+    if not linked_ids:
+        return 0, 0.0, {}, []
+
+    if token and _manager._set_token:
+        _manager._set_token(token)
+
+    # the metrics and the events of the job are sent to the parent process
+    metrics.REGISTRY.reset()
+    _manager.publisher.collect_events()
+    # wall time, including the database round trips the serial path would also wait for
+    start = time.time()
+    generated = _manager.generate_from_linked_ids(linked_ids)
+    job_time = time.time() - start
+    return generated, job_time, metrics.REGISTRY.snapshot(), _manager.publisher.pop_collected_events()
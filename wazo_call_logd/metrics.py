@@ -0,0 +1,280 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import bisect
+import logging
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+DELAY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 21600.0, 86400.0, float('inf'))
+
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self._lock = Lock()
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {'counts': list(self._counts), 'sum': self._sum}
+
+    def merge(self, snapshot):
+        with self._lock:
+            self._counts = [count + other for count, other in zip(self._counts, snapshot['counts'])]
+            self._sum += snapshot['sum']
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self.buckets)
+            self._sum = 0.0
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def cumulative_counts(self):
+        with self._lock:
+            counts = list(self._counts)
+
+        result, total = [], 0
+        for bucket, count in zip(self.buckets, counts):
+            total += count
+            result.append((bucket, total))
+        return result
+
+    def percentile(self, percent):
+        # upper bound of the bucket holding the percentile
+        cumulative_counts = self.cumulative_counts()
+        rank = cumulative_counts[-1][1] * percent / 100.0
+        for bucket, count in cumulative_counts:
+            if count and count >= rank:
+                return bucket
+        return None
+
+    def samples(self):
+        cumulative_counts = self.cumulative_counts()
+        for bucket, count in cumulative_counts:
+            yield '_bucket', dict(self.labels, le=_format_value(bucket)), count
+        yield '_sum', self.labels, self._sum
+        yield '_count', self.labels, cumulative_counts[-1][1]
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, description, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._lock = Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return {'value': self._value}
+
+    def merge(self, snapshot):
+        self.inc(snapshot['value'])
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+    def samples(self):
+        yield '', self.labels, self._value
+
+
+class Gauge(object):
+
+    type = 'gauge'
+
+    def __init__(self, name, description, function, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._function = function
+
+    @property
+    def value(self):
+        return self._function()
+
+    def snapshot(self):
+        return None
+
+    def merge(self, snapshot):
+        pass
+
+    def reset(self):
+        pass
+
+    def samples(self):
+        try:
+            value = self.value
+        except Exception:
+            logger.debug('Could not read the gauge %s', self.name, exc_info=True)
+            return
+        yield '', self.labels, value
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = Lock()
+        self._metrics = OrderedDict()
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS, labels=None):
+        return self._get_or_create(Histogram, name, labels, description, buckets=buckets)
+
+    def counter(self, name, description, labels=None):
+        return self._get_or_create(Counter, name, labels, description)
+
+    def gauge(self, name, description, function, labels=None):
+        with self._lock:
+            gauge = self._metrics[_key(name, labels)] = Gauge(name, description, function, labels)
+            return gauge
+
+    def histograms(self):
+        return [metric for metric in self.metrics() if isinstance(metric, Histogram)]
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        return {_key(metric.name, metric.labels): metric.snapshot() for metric in self.metrics()}
+
+    def merge(self, snapshot):
+        for metric in self.metrics():
+            key = _key(metric.name, metric.labels)
+            if key in snapshot:
+                metric.merge(snapshot[key])
+
+    def reset(self):
+        for metric in self.metrics():
+            metric.reset()
+
+    def log_summary(self):
+        for histogram in self.histograms():
+            count = histogram.count
+            if not count:
+                continue
+            logger.info('%s%s: %s in %.2fs, mean %.1fms, p50 <= %ss, p99 <= %ss',
+                        histogram.description, _format_labels(histogram.labels), count, histogram.sum,
+                        histogram.sum / count * 1000, histogram.percentile(50), histogram.percentile(99))
+
+    def _get_or_create(self, class_, name, labels, description, **kwargs):
+        key = _key(name, labels)
+        with self._lock:
+            if key not in self._metrics:
+                self._metrics[key] = class_(name, description, labels=labels, **kwargs)
+            return self._metrics[key]
+
+
+def seconds_since(moment):
+    # CEL event times are local times
+    return max((datetime.now() - moment).total_seconds(), 0.0)
+
+
+def register_db_pool(name, get_pool, registry=None):
+    registry = registry or REGISTRY
+    labels = {'pool': name}
+    registry.gauge('call_logd_db_pool_size', 'Connections kept in the database pool',
+                   lambda: get_pool().size(), labels)
+    registry.gauge('call_logd_db_pool_checked_out', 'Database connections in use',
+                   lambda: get_pool().checkedout(), labels)
+    registry.gauge('call_logd_db_pool_overflow', 'Database connections opened beyond the pool size',
+                   lambda: get_pool().overflow(), labels)
+
+
+def render_prometheus_text(registry):
+    lines = []
+    described = set()
+    for metric in sorted(registry.metrics(), key=lambda metric: metric.name):
+        if metric.name not in described:
+            described.add(metric.name)
+            lines.append('# HELP {} {}'.format(metric.name, _escape_help(metric.description)))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+        for suffix, labels, value in metric.samples():
+            lines.append('{}{}{} {}'.format(metric.name, suffix, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name, _escape_label_value(value))
+                                    for name, value in sorted(labels.items())))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS, labels=None):
+    return REGISTRY.histogram(name, description, buckets, labels)
+
+
+def counter(name, description, labels=None):
+    return REGISTRY.counter(name, description, labels)
+
+
+def gauge(name, description, function, labels=None):
+    return REGISTRY.gauge(name, description, function, labels)
@@ -0,0 +1,47 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import os
+
+from alembic import command
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine
+
+from wazo_call_logd.exceptions import OutdatedSchemaException
+
+# the asterisk database is shared, its own alembic version table belongs to xivo-manage-db
+VERSION_TABLE = 'alembic_version_call_logd'
+SCRIPT_LOCATION = os.path.join(os.path.dirname(__file__), 'migrations')
+
+
+def upgrade(db_uri):
+    engine = create_engine(db_uri)
+    try:
+        with engine.begin() as connection:
+            command.upgrade(_config(connection), 'head')
+    finally:
+        engine.dispose()
+
+
+def check_schema(db_uri):
+    # with its own connection, not to share the pool of the processes forked afterwards
+    engine = create_engine(db_uri)
+    try:
+        with engine.connect() as connection:
+            context = MigrationContext.configure(connection, opts={'version_table': VERSION_TABLE})
+            current = context.get_current_revision()
+    finally:
+        engine.dispose()
+
+    head = ScriptDirectory.from_config(_config()).get_current_head()
+    if current != head:
+        raise OutdatedSchemaException(current, head)
+
+
+def _config(connection=None):
+    config = Config()
+    config.set_main_option('script_location', SCRIPT_LOCATION)
+    config.attributes['connection'] = connection
+    return config
@@ -0,0 +1,17 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from alembic import context
+
+from wazo_call_logd.migration import VERSION_TABLE
+
+
+def run_migrations_online():
+    connection = context.config.attributes['connection']
+    context.configure(connection=connection, version_table=VERSION_TABLE)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+run_migrations_online()
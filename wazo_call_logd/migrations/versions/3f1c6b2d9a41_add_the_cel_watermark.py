@@ -0,0 +1,27 @@
+"""add the CEL watermark
+
+Revision ID: 3f1c6b2d9a41
+Revises: None
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c6b2d9a41'
+down_revision = None
+
+
+def upgrade():
+    op.create_table(
+        'call_logd_cel_watermark',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('cel_id', sa.Integer, nullable=False),
+        sa.Column('linkedid', sa.String(150)),
+    )
+
+
+def downgrade():
+    op.drop_table('call_logd_cel_watermark')
@@ -0,0 +1,129 @@
+"""add the call log counts
+
+Revision ID: 5a6e9d0c3b27
+Revises: 3f1c6b2d9a41
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a6e9d0c3b27'
+down_revision = '3f1c6b2d9a41'
+
+# each change of the call logs inserts a row with its count delta, the rows are summed by
+# day and user when compacted: PostgreSQL 9.4 has no upsert, and updating a single row per
+# key would serialize the transactions writing call logs of the same day
+COUNT_CALL_LOG = """
+CREATE OR REPLACE FUNCTION call_logd_count_call_log() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- before the delete, the participants are only deleted afterwards by the cascade
+        INSERT INTO call_logd_call_log_count (day, user_uuid, count)
+        SELECT CAST(OLD.date AS date), '', -1
+        UNION ALL
+        SELECT DISTINCT CAST(OLD.date AS date), user_uuid, -1
+        FROM call_log_participant
+        WHERE call_log_id = OLD.id AND user_uuid IS NOT NULL;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        -- the participants are inserted afterwards and counted by their own trigger
+        INSERT INTO call_logd_call_log_count (day, user_uuid, count)
+        SELECT CAST(NEW.date AS date), '', 1
+        UNION ALL
+        SELECT DISTINCT CAST(NEW.date AS date), user_uuid, 1
+        FROM call_log_participant
+        WHERE call_log_id = NEW.id AND user_uuid IS NOT NULL;
+        RETURN NEW;
+    END IF;
+
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# BEFORE triggers see the participants of the same statement already inserted or deleted:
+# a call log is counted once per user, by its first participant inserted and its last
+# participant deleted. Participants deleted with their call log are counted by its trigger.
+COUNT_CALL_LOG_PARTICIPANT = """
+CREATE OR REPLACE FUNCTION call_logd_count_call_log_participant() RETURNS trigger AS $$
+DECLARE
+    participant call_log_participant;
+    delta integer;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        participant := NEW;
+        delta := 1;
+    ELSE
+        participant := OLD;
+        delta := -1;
+    END IF;
+
+    IF participant.user_uuid IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM call_log_participant
+        WHERE call_log_id = participant.call_log_id
+        AND user_uuid = participant.user_uuid
+        AND uuid <> participant.uuid
+    ) THEN
+        INSERT INTO call_logd_call_log_count (day, user_uuid, count)
+        SELECT CAST(date AS date), participant.user_uuid, delta FROM call_log WHERE id = participant.call_log_id;
+    END IF;
+
+    RETURN participant;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+COUNT_EXISTING_CALL_LOGS = """
+INSERT INTO call_logd_call_log_count (day, user_uuid, count, compacted)
+SELECT CAST(date AS date), '', count(*), true
+FROM call_log
+GROUP BY CAST(date AS date)
+UNION ALL
+SELECT CAST(call_log.date AS date), call_log_participant.user_uuid, count(DISTINCT call_log.id), true
+FROM call_log JOIN call_log_participant ON call_log_participant.call_log_id = call_log.id
+WHERE call_log_participant.user_uuid IS NOT NULL
+GROUP BY CAST(call_log.date AS date), call_log_participant.user_uuid
+"""
+
+
+def upgrade():
+    op.create_table(
+        'call_logd_call_log_count',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('day', sa.Date, nullable=False),
+        sa.Column('user_uuid', sa.String(38), nullable=False),
+        sa.Column('count', sa.Integer, nullable=False),
+        sa.Column('compacted', sa.Boolean, nullable=False, server_default='false'),
+    )
+    op.create_index('call_logd_call_log_count__idx__user_uuid_day', 'call_logd_call_log_count', ['user_uuid', 'day'])
+    op.create_index('call_logd_call_log_count__idx__not_compacted', 'call_logd_call_log_count', ['user_uuid', 'day'],
+                    postgresql_where=sa.text('NOT compacted'))
+
+    # the call logs are locked until the end of the upgrade, none is missed by the count
+    op.execute('LOCK TABLE call_log, call_log_participant IN SHARE MODE')
+    op.execute(COUNT_CALL_LOG)
+    op.execute(COUNT_CALL_LOG_PARTICIPANT)
+    op.execute('CREATE TRIGGER call_logd_call_log_count_insert AFTER INSERT ON call_log '
+               'FOR EACH ROW EXECUTE PROCEDURE call_logd_count_call_log()')
+    op.execute('CREATE TRIGGER call_logd_call_log_count_update AFTER UPDATE OF date ON call_log '
+               'FOR EACH ROW WHEN (CAST(OLD.date AS date) <> CAST(NEW.date AS date)) '
+               'EXECUTE PROCEDURE call_logd_count_call_log()')
+    op.execute('CREATE TRIGGER call_logd_call_log_count_delete BEFORE DELETE ON call_log '
+               'FOR EACH ROW EXECUTE PROCEDURE call_logd_count_call_log()')
+    op.execute('CREATE TRIGGER call_logd_call_log_count BEFORE INSERT OR DELETE ON call_log_participant '
+               'FOR EACH ROW EXECUTE PROCEDURE call_logd_count_call_log_participant()')
+    op.execute(COUNT_EXISTING_CALL_LOGS)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER call_logd_call_log_count ON call_log_participant')
+    op.execute('DROP TRIGGER call_logd_call_log_count_delete ON call_log')
+    op.execute('DROP TRIGGER call_logd_call_log_count_update ON call_log')
+    op.execute('DROP TRIGGER call_logd_call_log_count_insert ON call_log')
+    op.execute('DROP FUNCTION call_logd_count_call_log_participant()')
+    op.execute('DROP FUNCTION call_logd_count_call_log()')
+    op.drop_table('call_logd_call_log_count')
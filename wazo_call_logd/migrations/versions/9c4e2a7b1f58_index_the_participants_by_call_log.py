@@ -0,0 +1,35 @@
+"""index the participants by call log
+
+Revision ID: 9c4e2a7b1f58
+Revises: 5a6e9d0c3b27
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2a7b1f58'
+down_revision = '5a6e9d0c3b27'
+
+# the tags of the streamed call logs and the count triggers look up the participants of a call log
+INDEX_NAME = 'call_logd_call_log_participant__idx__call_log_id'
+
+
+def upgrade():
+    # the call_log_participant table belongs to xivo-manage-db, which may index it already
+    if _find_call_log_id_indexes():
+        return
+
+    op.create_index(INDEX_NAME, 'call_log_participant', ['call_log_id'])
+
+
+def downgrade():
+    if INDEX_NAME in _find_call_log_id_indexes():
+        op.drop_index(INDEX_NAME, 'call_log_participant')
+
+
+def _find_call_log_id_indexes():
+    indexes = sa.inspect(op.get_bind()).get_indexes('call_log_participant')
+    return [index['name'] for index in indexes if index['column_names'][:1] == ['call_log_id']]
@@ -0,0 +1,205 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+import logging
+
+from requests import HTTPError
+from sqlalchemy import sql
+from xivo_dao.alchemy.linefeatures import LineFeatures
+from xivo_dao.alchemy.user_line import UserLine
+from xivo_dao.alchemy.userfeatures import UserFeatures
+from xivo_dao.helpers.db_manager import Session
+
+from wazo_call_logd import metrics
+from wazo_call_logd.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONFD_REQUEST_SECONDS = metrics.histogram('call_logd_confd_request_seconds', 'xivo-confd requests')
+
+
+class ConfdLookup(object):
+
+    # below this number of lines, searching lines one by one is cheaper than listing them
+    bulk_lines_threshold = 20
+    lines_page_size = 500
+
+    def __init__(self, confd):
+        self._confd = confd
+
+    def get_line(self, line_name):
+        with CONFD_REQUEST_SECONDS.time():
+            lines = self._confd.lines.list(name=line_name)['items']
+        return lines[0] if lines else None
+
+    def get_user(self, user_uuid):
+        with CONFD_REQUEST_SECONDS.time():
+            return self._confd.users.get(user_uuid)
+
+    def find_lines(self, line_names):
+        if len(line_names) < self.bulk_lines_threshold:
+            lines = (self.get_line(line_name) for line_name in line_names)
+            return {line['name']: line for line in lines if line}
+
+        return self._find_lines_by_page(line_names)
+
+    def _find_lines_by_page(self, line_names):
+        found = {}
+        offset = 0
+        while len(found) < len(line_names):
+            with CONFD_REQUEST_SECONDS.time():
+                page = self._confd.lines.list(order='name', limit=self.lines_page_size, offset=offset)
+            lines = page['items']
+            found.update((line['name'], line) for line in lines if line['name'] in line_names)
+            if len(lines) < self.lines_page_size:
+                break
+            offset += self.lines_page_size
+
+            # a name never found would page through every line: when fewer requests are
+            # needed, the names still missing are searched one by one instead
+            missing_names = [line_name for line_name in line_names if line_name not in found]
+            remaining_pages = -(-(page['total'] - offset) // self.lines_page_size)
+            if remaining_pages > len(missing_names):
+                lines = (self.get_line(line_name) for line_name in missing_names)
+                found.update((line['name'], line) for line in lines if line)
+                break
+        return found
+
+    def find_users(self, user_uuids):
+        # fetched one by one with the same request as get_user, the list is not filtered by uuids
+        users = {}
+        for user_uuid in user_uuids:
+            try:
+                users[user_uuid] = self.get_user(user_uuid)
+            except HTTPError as e:
+                logger.warning('HTTP error from xivo-confd while getting user %s: %s', user_uuid, e)
+        return users
+
+
+class DatabaseLookup(object):
+
+    def get_line(self, line_name):
+        row = self._query_lines().filter(LineFeatures.name == line_name).first()
+        return _line_from_row(row) if row else None
+
+    def get_user(self, user_uuid):
+        row = self._query_users().filter(UserFeatures.uuid == user_uuid).first()
+        return _user_from_row(row) if row else None
+
+    def find_lines(self, line_names):
+        rows = self._query_lines().filter(LineFeatures.name.in_(line_names)).all()
+        return {row.name: _line_from_row(row) for row in rows}
+
+    def find_users(self, user_uuids):
+        rows = self._query_users().filter(UserFeatures.uuid.in_(user_uuids)).all()
+        return {row.uuid: _user_from_row(row) for row in rows}
+
+    def _query_lines(self):
+        return (Session.query(LineFeatures.id, LineFeatures.name, UserFeatures.uuid.label('user_uuid'))
+                .outerjoin(UserLine, sql.and_(UserLine.line_id == LineFeatures.id,
+                                              UserLine.main_user == sql.true()))
+                .outerjoin(UserFeatures, UserFeatures.id == UserLine.user_id))
+
+    def _query_users(self):
+        return Session.query(UserFeatures.uuid, UserFeatures.userfield)
+
+
+class CachedLookup(object):
+
+    def __init__(self, lookup, max_size, ttl, negative_ttl):
+        self._lookup = lookup
+        self._negative_ttl = negative_ttl
+        self._lines = TTLCache(max_size, ttl)
+        self._users = TTLCache(max_size, ttl)
+
+    def get_line(self, line_name):
+        try:
+            return self._lines.get(line_name)
+        except KeyError:
+            pass
+
+        line = self._lookup.get_line(line_name)
+        self._set_line(line_name, line)
+        return line
+
+    def get_user(self, user_uuid):
+        try:
+            return self._users.get(user_uuid)
+        except KeyError:
+            pass
+
+        user = self._lookup.get_user(user_uuid)
+        self._users.set(user_uuid, user)
+        return user
+
+    def prefetch(self, line_names):
+        line_names = set(name for name in line_names if name not in self._lines)
+        if not line_names:
+            return
+
+        logger.debug('Prefetching %s participant lines', len(line_names))
+        lines = self._lookup.find_lines(line_names)
+        for line_name in line_names:
+            self._set_line(line_name, lines.get(line_name))
+
+        user_uuids = set(line['users'][0]['uuid'] for line in lines.values() if line['users'])
+        user_uuids = set(uuid for uuid in user_uuids if uuid not in self._users)
+        if not user_uuids:
+            return
+
+        logger.debug('Prefetching %s participant users', len(user_uuids))
+        users = self._lookup.find_users(user_uuids)
+        for user_uuid, user in users.items():
+            self._users.set(user_uuid, user)
+
+    def evict_line(self, line_id):
+        logger.debug('Evicting line %s from participant cache', line_id)
+        self._lines.pop_if(lambda line: line is not None and line['id'] == line_id)
+
+    def evict_line_name(self, line_name):
+        logger.debug('Evicting line name %s from participant cache', line_name)
+        self._lines.pop(line_name)
+
+    def evict_user(self, user_uuid):
+        logger.debug('Evicting user %s from participant cache', user_uuid)
+        self._users.pop(user_uuid)
+        self._lines.pop_if(lambda line: line is not None and _has_user(line, user_uuid))
+
+    def _set_line(self, line_name, line):
+        # unknown names are only cached briefly: the line may be created any time
+        ttl = self._negative_ttl if line is None else None
+        self._lines.set(line_name, line, ttl=ttl)
+
+    def stats(self):
+        return {'lines': self._lines.stats(),
+                'users': self._users.stats()}
+
+    def log_stats(self):
+        for name, stats in sorted(self.stats().items()):
+            logger.info('Participant cache (%s): %s hits, %s misses, %s entries',
+                        name, stats['hits'], stats['misses'], stats['size'])
+
+
+def new_participant_lookup(config, confd_client):
+    backend = config['participant_lookup']
+    if backend == 'confd':
+        lookup = ConfdLookup(confd_client)
+    elif backend == 'database':
+        lookup = DatabaseLookup()
+    else:
+        raise ValueError('Unknown participant lookup: {}'.format(backend))
+
+    return CachedLookup(lookup, **config['participant_cache'])
+
+
+def _line_from_row(row):
+    users = [{'uuid': row.user_uuid}] if row.user_uuid else []
+    return {'id': row.id, 'name': row.name, 'users': users}
+
+
+def _user_from_row(row):
+    return {'uuid': row.uuid, 'userfield': row.userfield}
+
+
+def _has_user(line, user_uuid):
+    return any(user['uuid'] == user_uuid for user in line['users'])
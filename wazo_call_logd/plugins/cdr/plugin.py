@@ -3,6 +3,7 @@
 
 from xivo_auth_client import Client as AuthClient
 
+from wazo_call_logd import metrics
 from wazo_call_logd.core.database.dao import new_db_session
 from wazo_call_logd.core.database.dao import CallLogDAO
 
@@ -19,7 +20,9 @@ class Plugin(object):
         config = dependencies['config']
 
         auth_client = AuthClient(**config['auth'])
-        dao = CallLogDAO(new_db_session(config['db_uri']))
+        Session = new_db_session(config['db_uri'])
+        metrics.register_db_pool('cdr', lambda: Session.session_factory.kw['bind'].pool)
+        dao = CallLogDAO(Session)
         service = CDRService(dao)
 
         api.add_resource(CDRResource, '/cdr', resource_class_args=[service])
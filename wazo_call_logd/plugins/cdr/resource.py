@@ -1,21 +1,27 @@
 # Copyright 2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+import json
 import logging
 
+from collections import OrderedDict
+
 from flask import jsonify
-from flask import make_response
 from flask import request
+from flask import Response
 from io import StringIO
 from xivo.auth_verifier import required_acl
 from xivo.unicode_csv import UnicodeDictWriter
 from wazo_call_logd.core.auth import get_token_user_uuid_from_request
 from wazo_call_logd.core.rest_api import AuthResource
 
+from .schema import CDRSchema
 from .schema import CDRSchemaList
 from .schema import CDRListRequestSchema
 
 logger = logging.getLogger(__name__)
+CSV_CHUNK_SIZE = 1000
+NDJSON_CHUNK_SIZE = 1000
 CSV_HEADERS = ['id',
                'answered',
                'start',
@@ -38,31 +44,76 @@ def _is_cdr_list(data):
     return 'items' in data
 
 
+def _is_streamed(representations):
+    # the response will be written by one of the representations instead of the default JSON
+    return request.accept_mimetypes.best_match(representations, default=None) in representations
+
+
+def _csv_chunks(cdrs):
+    csv_text = StringIO()
+    writer = UnicodeDictWriter(csv_text, CSV_HEADERS)
+
+    writer.writeheader()
+    for count, cdr in enumerate(cdrs, 1):
+        if 'tags' in cdr:
+            cdr['tags'] = ';'.join(cdr['tags'])
+        writer.writerow(cdr)
+
+        if count % CSV_CHUNK_SIZE == 0:
+            yield csv_text.getvalue()
+            csv_text.seek(0)
+            csv_text.truncate()
+
+    yield csv_text.getvalue()
+
+
+def _ndjson_chunks(cdrs):
+    lines = []
+    for cdr in cdrs:
+        lines.append(json.dumps(cdr) + '\n')
+
+        if len(lines) == NDJSON_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+
+    yield ''.join(lines)
+
+
 def _output_csv(data, code, http_headers=None):
     if _is_error(data):
         response = jsonify(data)
     elif _is_cdr_list(data):
-        csv_text = StringIO()
-        writer = UnicodeDictWriter(csv_text, CSV_HEADERS)
+        response = Response(_csv_chunks(data['items']))
+    else:
+        raise NotImplementedError('No known CSV representation')
+
+    response.status_code = code
+    response.headers.extend(http_headers or {})
+    return response
 
-        writer.writeheader()
-        for cdr in data['items']:
-            if 'tags' in cdr:
-                cdr['tags'] = ';'.join(cdr['tags'])
-            writer.writerow(cdr)
 
-        response = make_response(csv_text.getvalue())
+def _output_ndjson(data, code, http_headers=None):
+    if _is_error(data):
+        response = jsonify(data)
+    elif _is_cdr_list(data):
+        # one CDR per line
+        response = Response(_ndjson_chunks(data['items']))
     else:
-        raise NotImplementedError('No known CSV representation')
+        raise NotImplementedError('No known NDJSON representation')
 
     response.status_code = code
     response.headers.extend(http_headers or {})
     return response
 
 
+# CSV stays the representation of the requests accepting any type
+REPRESENTATIONS = OrderedDict([('text/csv; charset=utf-8', _output_csv),
+                               ('application/x-ndjson', _output_ndjson)])
+
+
 class CDRResource(AuthResource):
 
-    representations = {'text/csv; charset=utf-8': _output_csv}
+    representations = REPRESENTATIONS
 
     def __init__(self, cdr_service):
         self.cdr_service = cdr_service
@@ -70,13 +121,15 @@ class CDRResource(AuthResource):
     @required_acl('call-logd.cdr.read')
     def get(self):
         args = CDRListRequestSchema().load(request.args).data
+        if _is_streamed(self.representations):
+            return {'items': CDRSchema().dump_rows(self.cdr_service.stream(args))}
         cdrs = self.cdr_service.list(args)
         return CDRSchemaList().dump(cdrs).data
 
 
 class CDRUserResource(AuthResource):
 
-    representations = {'text/csv; charset=utf-8': _output_csv}
+    representations = REPRESENTATIONS
 
     def __init__(self, cdr_service):
         self.cdr_service = cdr_service
@@ -85,13 +138,15 @@ class CDRUserResource(AuthResource):
     def get(self, user_uuid):
         args = CDRListRequestSchema(exclude=['user_uuid']).load(request.args).data
         args['user_uuids'] = [user_uuid]
+        if _is_streamed(self.representations):
+            return {'items': CDRSchema().dump_rows(self.cdr_service.stream(args))}
         cdrs = self.cdr_service.list(args)
         return CDRSchemaList().dump(cdrs).data
 
 
 class CDRUserMeResource(AuthResource):
 
-    representations = {'text/csv; charset=utf-8': _output_csv}
+    representations = REPRESENTATIONS
 
     def __init__(self, auth_client, cdr_service):
         self.auth_client = auth_client
@@ -102,5 +157,7 @@ class CDRUserMeResource(AuthResource):
         args = CDRListRequestSchema(exclude=['user_uuid']).load(request.args).data
         user_uuid = get_token_user_uuid_from_request(self.auth_client)
         args['user_uuids'] = [user_uuid]
+        if _is_streamed(self.representations):
+            return {'items': CDRSchema(exclude=['tags']).dump_rows(self.cdr_service.stream(args))}
         cdrs = self.cdr_service.list(args)
         return CDRSchemaList(exclude=['items.tags']).dump(cdrs).data
@@ -1,15 +1,74 @@
 # Copyright 2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+import base64
+import json
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from marshmallow import fields
 from marshmallow import post_load
 from marshmallow import Schema
+from marshmallow import ValidationError
 from marshmallow import pre_dump, pre_load, post_dump
 from marshmallow.validate import OneOf
 from marshmallow.validate import Range
 from marshmallow.validate import Regexp
 
 NUMBER_REGEX = r'^_?[0-9]+_?$'
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+CURSOR_DATETIME_ORDERS = ('date', 'date_answer', 'marshmallow_answered')
+CURSOR_TIMEDELTA_ORDERS = ('marshmallow_duration',)
+
+
+class Cursor(fields.Field):
+
+    # opaque to the clients: the order, direction and sort key of the last CDR of a page
+    default_error_messages = {'invalid': 'Not a valid cursor.'}
+
+    def _serialize(self, value, attr, obj):
+        if value is None:
+            return None
+        cursor = [value['order'], value['direction'], _encode_cursor_value(value['value']), value['id']]
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+
+    def _deserialize(self, value, attr, data):
+        try:
+            cursor = base64.urlsafe_b64decode(value.encode('ascii')).decode('utf-8')
+            order, direction, sort_value, id_ = json.loads(cursor)
+            return {'order': order,
+                    'direction': direction,
+                    'value': _decode_cursor_value(order, sort_value),
+                    'id': int(id_)}
+        except (AttributeError, TypeError, ValueError):
+            self.fail('invalid')
+
+
+def _encode_cursor_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo:
+            return value.astimezone(timezone.utc).strftime(CURSOR_DATETIME_FORMAT) + 'Z'
+        return value.strftime(CURSOR_DATETIME_FORMAT)
+    if isinstance(value, timedelta):
+        return value // timedelta(microseconds=1)
+    return value
+
+
+def _decode_cursor_value(order, value):
+    if value is None:
+        return None
+    if order in CURSOR_DATETIME_ORDERS:
+        if value.endswith('Z'):
+            return datetime.strptime(value[:-1], CURSOR_DATETIME_FORMAT).replace(tzinfo=timezone.utc)
+        return datetime.strptime(value, CURSOR_DATETIME_FORMAT)
+    if order in CURSOR_TIMEDELTA_ORDERS:
+        return timedelta(microseconds=int(value))
+    if order == 'id':
+        return int(value)
+    if not isinstance(value, str):
+        raise ValueError(value)
+    return value
 
 
 class CDRSchema(Schema):
@@ -39,6 +98,13 @@ class CDRSchema(Schema):
             data['duration'] = max(data['duration'], 0)
         return data
 
+    def dump_rows(self, rows):
+        # rows holding the computed attributes, dumped without building the call logs nor running the hooks
+        fields_ = [(name, field.attribute or name, field) for name, field in self.fields.items()]
+        for row in rows:
+            cdr = {name: field.serialize(attribute, row) for name, attribute, field in fields_}
+            yield self.fix_negative_duration(cdr)
+
     @pre_dump
     def _populate_tags_field(self, data):
         data.marshmallow_tags = set()
@@ -54,6 +120,8 @@ class CDRListRequestSchema(Schema):
     order = fields.String(validate=OneOf(set(CDRSchema().fields) - {'end', 'tags'}), missing='start')
     limit = fields.Integer(validate=Range(min=0), missing=None)
     offset = fields.Integer(validate=Range(min=0), missing=None)
+    cursor = Cursor(missing=None)
+    count = fields.Boolean(missing=None)
     search = fields.String(missing=None)
     call_direction = fields.String(validate=OneOf(['internal', 'inbound', 'outbound']), missing=None)
     number = fields.String(validate=Regexp(NUMBER_REGEX), missing=None)
@@ -77,9 +145,24 @@ class CDRListRequestSchema(Schema):
         mapped_order = CDRSchema().fields[in_data['order']].attribute
         if mapped_order:
             in_data['order'] = mapped_order
+        # the cursor holds the mapped order
+        self._validate_cursor(in_data)
+        if in_data['count'] is None:
+            # the next pages do not count the filtered call logs again, unless asked
+            in_data['count'] = in_data['cursor'] is None
+
+    def _validate_cursor(self, in_data):
+        cursor = in_data['cursor']
+        if cursor is None:
+            return
+        if in_data['offset'] is not None:
+            raise ValidationError('A cursor cannot be used with an offset', 'cursor')
+        if (cursor['order'], cursor['direction']) != (in_data['order'], in_data['direction']):
+            raise ValidationError('The cursor was given with another order or direction', 'cursor')
 
 
 class CDRSchemaList(Schema):
     items = fields.Nested(CDRSchema, many=True)
     total = fields.Integer()
     filtered = fields.Integer()
+    next = Cursor()
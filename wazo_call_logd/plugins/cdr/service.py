@@ -1,14 +1,42 @@
 # Copyright 2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+from wazo_call_logd import metrics
+
+FILTERS = ('start', 'end', 'search', 'call_direction', 'number', 'tags', 'user_uuids')
+
 
 class CDRService(object):
     def __init__(self, dao):
         self._dao = dao
 
     def list(self, search_params):
-        call_logs = self._dao.find_all_in_period(search_params)
-        count = self._dao.count_in_period(search_params)
+        with self._request_seconds(search_params).time():
+            if search_params.get('count', True):
+                call_logs, count = self._dao.find_all_and_count_in_period(search_params)
+            else:
+                call_logs, count = self._dao.find_all_in_period(search_params), {'filtered': None, 'total': None}
         return {'items': call_logs,
                 'filtered': count['filtered'],
-                'total': count['total']}
+                'total': count['total'],
+                'next': self._next_cursor(search_params, call_logs)}
+
+    def stream(self, search_params):
+        return self._dao.stream_in_period(search_params)
+
+    def _next_cursor(self, search_params, call_logs):
+        limit = search_params.get('limit')
+        if not limit or len(call_logs) < limit:
+            return None
+
+        last_call_log = call_logs[-1]
+        return {'order': search_params.get('order'),
+                'direction': search_params.get('direction'),
+                'value': self._dao.order_value(last_call_log, search_params.get('order')),
+                'id': last_call_log.id}
+
+    def _request_seconds(self, search_params):
+        # requests are timed by the filters used, not by their values
+        filters = ','.join(name for name in FILTERS if search_params.get(name)) or 'none'
+        labels = {'filters': filters, 'order': search_params.get('order') or 'none'}
+        return metrics.histogram('call_logd_cdr_request_seconds', 'CDR requests', labels=labels)
@@ -0,0 +1,11 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from .resource import MetricsResource
+
+
+class Plugin(object):
+
+    def load(self, dependencies):
+        api = dependencies['api']
+        api.add_resource(MetricsResource, '/metrics')
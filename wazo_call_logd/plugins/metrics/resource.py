@@ -0,0 +1,17 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from flask import make_response
+from xivo.auth_verifier import required_acl
+
+from wazo_call_logd import metrics
+from wazo_call_logd.core.rest_api import AuthResource
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsResource(AuthResource):
+
+    @required_acl('call-logd.metrics.read')
+    def get(self):
+        return make_response(metrics.render_prometheus_text(metrics.REGISTRY), 200, {'Content-Type': CONTENT_TYPE})
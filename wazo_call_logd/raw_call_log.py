@@ -21,6 +21,8 @@ class RawCallLog(object):
         self.destination_line_identity = None
         self.direction = 'internal'
         self.participants = []
+        self.linked_id = None
+        self.linkedid_end_time = None
         self.cel_ids = []
 
     def to_call_log(self):
@@ -43,6 +45,8 @@ class RawCallLog(object):
             direction=self.direction,
         )
         result.participants = self.participants
+        result.linked_id = self.linked_id
+        result.linkedid_end_time = self.linkedid_end_time
         result.cel_ids = self.cel_ids
 
         return result
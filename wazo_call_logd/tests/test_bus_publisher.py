@@ -0,0 +1,178 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from datetime import datetime
+from datetime import timedelta
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import close_to
+from hamcrest import contains
+from hamcrest import equal_to
+from hamcrest import has_entries
+from hamcrest import has_key
+from hamcrest import is_not
+from hamcrest import raises
+from mock import Mock
+from mock import patch
+
+from xivo_bus.resources.call_logs.events import CallLogCreatedEvent
+from xivo_bus.resources.call_logs.events import CallLogUserCreatedEvent
+
+from wazo_call_logd.bus_publisher import BusPublisher
+from wazo_call_logd.bus_publisher import CALL_LOG_DELAY_SECONDS
+from wazo_call_logd.bus_publisher import USER_CALL_LOG_DELAY_SECONDS
+from wazo_call_logd.bus_publisher import _BatchPublisher
+
+
+class TestBusPublisher(TestCase):
+
+    def setUp(self):
+        config = {'bus': {'username': 'u', 'password': 'p', 'host': 'localhost', 'port': 5672,
+                          'exchange_name': 'xivo', 'exchange_type': 'topic'}}
+        with patch('xivo_bus.PublishingQueue') as PublishingQueue, \
+                patch('wazo_call_logd.bus_publisher.CDRSchema') as CDRSchema:
+            self.publishing_queue = PublishingQueue.return_value
+            self.schema = CDRSchema.return_value
+            self.publisher = BusPublisher(config)
+        self.schema.dump.return_value.data = {'id': 42, 'tags': ['tag']}
+
+    def published_events(self):
+        return [event for call in self.publishing_queue.publish.call_args_list for event in call[0][0]]
+
+    def test_that_the_linkedid_end_time_is_queued_with_the_events(self):
+        linkedid_end_time = datetime.now() - timedelta(seconds=30)
+        call_log = Mock(participants=[Mock(user_uuid='user-uuid')], linkedid_end_time=linkedid_end_time)
+
+        self.publisher.publish(call_log)
+
+        events = self.published_events()
+        assert_that([end_time for _, end_time in events], equal_to([linkedid_end_time, linkedid_end_time]))
+
+    def test_that_the_events_of_a_batch_are_queued_together(self):
+        call_logs = [Mock(participants=[Mock(user_uuid='user-1'), Mock(user_uuid='user-2')], linkedid_end_time=None),
+                     Mock(participants=[], linkedid_end_time=None)]
+
+        self.publisher.publish_all(call_logs)
+
+        assert_that(self.publishing_queue.publish.call_count, equal_to(1))
+        assert_that(len(self.published_events()), equal_to(4))
+
+    def test_that_each_call_log_is_serialized_once(self):
+        call_log = Mock(participants=[Mock(user_uuid='user-1'), Mock(user_uuid='user-2')], linkedid_end_time=None)
+
+        self.publisher.publish(call_log)
+
+        self.schema.dump.assert_called_once_with(call_log)
+        call_log_event, user_event, _ = [event for event, _ in self.published_events()]
+        assert_that(call_log_event.marshal(), has_key('tags'))
+        assert_that(user_event.marshal(), is_not(has_key('tags')))
+
+    def test_that_a_summary_is_published_for_backfilled_call_logs(self):
+        call_logs = [Mock(id=12, date=datetime(2017, 4, 1, 10), participants=[Mock(user_uuid='user-1')]),
+                     Mock(id=10, date=datetime(2017, 4, 1, 9), participants=[Mock(user_uuid='user-2'),
+                                                                             Mock(user_uuid='user-1')])]
+
+        self.publisher.publish_summary(call_logs)
+
+        (event, headers), = self.published_events()
+        assert_that(event.name, equal_to('call_logs_backfilled'))
+        assert_that(event.marshal(), equal_to({'first_id': 10,
+                                               'last_id': 12,
+                                               'first_start': '2017-04-01T09:00:00',
+                                               'last_start': '2017-04-01T10:00:00',
+                                               'call_log_count': 2,
+                                               'user_call_log_count': 3,
+                                               'user_uuids': ['user-1', 'user-2']}))
+        self.schema.dump.assert_not_called()
+
+    def test_that_no_summary_is_published_without_call_logs(self):
+        self.publisher.publish_summary([])
+
+        assert_that(self.publishing_queue.publish.called, equal_to(False))
+
+    def test_that_collected_events_are_not_queued(self):
+        call_log = Mock(participants=[Mock(user_uuid='user-1')], linkedid_end_time=None)
+        self.publisher.collect_events()
+
+        self.publisher.publish(call_log)
+
+        assert_that(self.publishing_queue.publish.called, equal_to(False))
+        assert_that(len(self.publisher.pop_collected_events()), equal_to(2))
+        assert_that(self.publisher.pop_collected_events(), equal_to([]))
+
+    def test_queue_size(self):
+        call_log = Mock(participants=[], linkedid_end_time=None)
+
+        self.publisher.publish(call_log)
+        self.publisher.publish(call_log)
+        self.publisher._on_batch_sent()
+
+        assert_that(self.publisher.queue_size(), equal_to(1))
+
+    def test_that_nothing_is_queued_without_call_logs(self):
+        self.publisher.publish_all([])
+
+        assert_that(self.publishing_queue.publish.called, equal_to(False))
+
+
+class TestBatchPublisher(TestCase):
+
+    def test_that_every_event_is_published(self):
+        publisher = Mock()
+        batch_publisher = _BatchPublisher(publisher, Mock())
+
+        batch_publisher.publish([('event-1', None), ('event-2', None)])
+
+        assert_that(publisher.publish.call_args_list, contains((('event-1',), {'headers': None}),
+                                                               (('event-2',), {'headers': None})))
+
+    def test_that_the_linkedid_end_delay_is_sent_in_the_headers(self):
+        publisher = Mock()
+        batch_publisher = _BatchPublisher(publisher, Mock())
+        linkedid_end_time = datetime.now() - timedelta(seconds=30)
+
+        batch_publisher.publish([(CallLogCreatedEvent({}), linkedid_end_time)])
+
+        headers = publisher.publish.call_args[1]['headers']
+        assert_that(headers, has_entries(linkedid_end_time=linkedid_end_time.isoformat(),
+                                         linkedid_end_delay=close_to(30, 1)))
+
+    def test_that_the_delays_are_observed_once_published(self):
+        publisher = Mock()
+        batch_publisher = _BatchPublisher(publisher, Mock())
+        linkedid_end_time = datetime.now() - timedelta(seconds=30)
+        events = [(CallLogCreatedEvent({}), linkedid_end_time),
+                  (CallLogUserCreatedEvent('user-uuid', {}), linkedid_end_time)]
+        call_log_count = CALL_LOG_DELAY_SECONDS.count
+        user_call_log_count = USER_CALL_LOG_DELAY_SECONDS.count
+        observed_on_publish = []
+        publisher.publish.side_effect = lambda *_, **__: observed_on_publish.append(CALL_LOG_DELAY_SECONDS.count)
+
+        batch_publisher.publish(events)
+
+        assert_that(observed_on_publish[0], equal_to(call_log_count))
+        assert_that(CALL_LOG_DELAY_SECONDS.count, equal_to(call_log_count + 1))
+        assert_that(USER_CALL_LOG_DELAY_SECONDS.count, equal_to(user_call_log_count + 1))
+
+    def test_that_the_delay_of_a_failed_event_is_not_observed(self):
+        publisher = Mock()
+        publisher.publish.side_effect = IOError
+        batch_publisher = _BatchPublisher(publisher, Mock())
+        events = [(CallLogCreatedEvent({}), datetime.now())]
+        call_log_count = CALL_LOG_DELAY_SECONDS.count
+
+        assert_that(calling(batch_publisher.publish).with_args(events), raises(IOError))
+
+        assert_that(CALL_LOG_DELAY_SECONDS.count, equal_to(call_log_count))
+
+    def test_that_a_failed_batch_is_no_longer_queued(self):
+        publisher = Mock()
+        publisher.publish.side_effect = IOError
+        on_batch_sent = Mock()
+        batch_publisher = _BatchPublisher(publisher, on_batch_sent)
+
+        assert_that(calling(batch_publisher.publish).with_args([('event-1', None)]), raises(IOError))
+
+        on_batch_sent.assert_called_once_with()
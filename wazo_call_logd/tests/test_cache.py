@@ -0,0 +1,102 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import equal_to
+from hamcrest import has_entries
+from hamcrest import raises
+
+from wazo_call_logd.cache import TTLCache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TTLCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_get_unknown_key(self):
+        assert_that(calling(self.cache.get).with_args('unknown'), raises(KeyError))
+
+    def test_get_known_key(self):
+        self.cache.set('key', 'value')
+
+        result = self.cache.get('key')
+
+        assert_that(result, equal_to('value'))
+
+    def test_get_none_value(self):
+        self.cache.set('key', None)
+
+        result = self.cache.get('key')
+
+        assert_that(result, equal_to(None))
+
+    def test_get_expired_key(self):
+        self.cache.set('key', 'value')
+        self.clock.now = 10
+
+        assert_that(calling(self.cache.get).with_args('key'), raises(KeyError))
+
+    def test_get_key_expired_with_its_own_ttl(self):
+        self.cache.set('key', 'value', ttl=2)
+        self.clock.now = 2
+
+        assert_that(calling(self.cache.get).with_args('key'), raises(KeyError))
+
+    def test_that_least_recently_used_entry_is_evicted(self):
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+        self.cache.get('first')
+
+        self.cache.set('third', 3)
+
+        assert_that(self.cache.get('first'), equal_to(1))
+        assert_that(self.cache.get('third'), equal_to(3))
+        assert_that(calling(self.cache.get).with_args('second'), raises(KeyError))
+
+    def test_that_zero_max_size_disables_the_cache(self):
+        cache = TTLCache(max_size=0, ttl=10)
+
+        cache.set('key', 'value')
+
+        assert_that(calling(cache.get).with_args('key'), raises(KeyError))
+
+    def test_pop(self):
+        self.cache.set('key', 'value')
+
+        self.cache.pop('key')
+        self.cache.pop('unknown')
+
+        assert_that(calling(self.cache.get).with_args('key'), raises(KeyError))
+
+    def test_pop_if(self):
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+
+        self.cache.pop_if(lambda value: value == 1)
+
+        assert_that(calling(self.cache.get).with_args('first'), raises(KeyError))
+        assert_that(self.cache.get('second'), equal_to(2))
+
+    def test_stats(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.get('key')
+        self.assertRaises(KeyError, self.cache.get, 'unknown')
+
+        result = self.cache.stats()
+
+        assert_that(result, has_entries(hits=2, misses=1, size=1))
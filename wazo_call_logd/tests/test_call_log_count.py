@@ -0,0 +1,58 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import equal_to
+from mock import MagicMock, Mock, patch
+
+from wazo_call_logd.call_log_count import CallLogCountCompactor
+from wazo_call_logd.call_log_count import CallLogCountDAO
+
+
+class TestCallLogCountDAO(TestCase):
+
+    def setUp(self):
+        self.dao = CallLogCountDAO()
+
+    @patch('wazo_call_logd.call_log_count.Session')
+    def test_compact(self, session):
+        session.execute.return_value.scalar.return_value = True
+
+        self.dao.compact()
+
+        assert_that(session.execute.call_count, equal_to(2))
+
+    @patch('wazo_call_logd.call_log_count.Session')
+    def test_compact_skipped_while_compacted_by_another_instance(self, session):
+        session.execute.return_value.scalar.return_value = False
+
+        self.dao.compact()
+
+        assert_that(session.execute.call_count, equal_to(1))
+
+
+@patch('wazo_call_logd.call_log_count.session_scope', MagicMock())
+class TestCallLogCountCompactor(TestCase):
+
+    def setUp(self):
+        self.call_log_counts = Mock(CallLogCountDAO)
+        self.compactor = CallLogCountCompactor(self.call_log_counts)
+
+    def test_compact(self):
+        self.compactor.compact()
+
+        self.call_log_counts.compact.assert_called_once_with()
+
+    def test_that_a_failed_compaction_is_not_raised(self):
+        self.call_log_counts.compact.side_effect = Exception
+
+        self.compactor.compact()
+
+    def test_that_a_stopped_compactor_does_not_compact(self):
+        self.compactor.stop()
+
+        self.compactor.run()
+
+        assert_that(self.call_log_counts.compact.called, equal_to(False))
@@ -1,17 +1,24 @@
 # Copyright 2013-2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+from collections import namedtuple
 from unittest import TestCase
 
-from hamcrest import assert_that, equal_to
-from mock import patch, Mock
+from hamcrest import assert_that, contains, contains_inanyorder, equal_to
+from mock import ANY, call, patch, Mock
 
 from wazo_call_logd.cel_fetcher import CELFetcher
 
 
+Row = namedtuple('Row', ['id', 'linkedid'])
+
+
 class TestCELFetcher(TestCase):
     def setUp(self):
-        self.cel_fetcher = CELFetcher()
+        self.watermark = Mock()
+        self.watermark.get.return_value = (0, None)
+        self.cel_fetcher = CELFetcher(self.watermark)
+        self.cel_fetcher._find_last_ids = Mock(return_value={})
 
     def tearDown(self):
         pass
@@ -26,12 +33,104 @@ class TestCELFetcher(TestCase):
         mock_cel_dao.assert_called_once_with(cel_count, None)
         assert_that(result, equal_to(cels))
 
-    @patch('xivo_dao.resources.cel.dao.find_from_linked_id')
-    def test_find_from_linked_id(self, mock_cel_dao):
+    def test_find_from_linked_id(self):
         linked_id = '666'
-        cels = mock_cel_dao.return_value = [Mock(), Mock(), Mock()]
+        self.cel_fetcher._find_from_linked_ids = Mock(return_value=[Mock(), Mock(), Mock()])
 
         result = self.cel_fetcher.fetch_from_linked_id(linked_id)
 
-        mock_cel_dao.assert_called_once_with(linked_id)
-        assert_that(result, equal_to(cels))
+        self.cel_fetcher._find_from_linked_ids.assert_called_once_with([linked_id])
+        assert_that(result, equal_to(self.cel_fetcher._find_from_linked_ids.return_value))
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks(self):
+        self.cel_fetcher.chunk_size = 2
+        self.cel_fetcher._find_last = Mock(return_value=Row(3, 'z'))
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=0)
+        self.cel_fetcher._find_unprocessed = Mock(side_effect=[
+            [Row(1, 'a'), Row(2, 'b')],
+            [Row(3, 'a')],
+        ])
+        self.cel_fetcher._find_last_ids.return_value = {'a': 3, 'b': 2}
+        self.cel_fetcher._find_from_linked_ids = Mock()
+
+        result = list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks(cel_count=3))
+
+        assert_that(result, contains(contains_inanyorder('a', 'b')))
+        assert_that(self.cel_fetcher._find_from_linked_ids.called, equal_to(False))
+        self.watermark.set.assert_has_calls([call(2, 'b'), call(3, 'z')])
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_forgets_the_calls_past_their_last_cel(self):
+        self.cel_fetcher.chunk_size = 2
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=0)
+        self.cel_fetcher._find_unprocessed = Mock(side_effect=[
+            [Row(1, 'a'), Row(2, 'b')],
+            [Row(3, 'c'), Row(4, 'b')],
+            [Row(5, 'a')],
+        ])
+        self.cel_fetcher._find_last_ids.side_effect = [{'a': 1, 'b': 4}, {'c': 3}, {'a': 5}]
+
+        result = list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks())
+
+        assert_that(result, contains(contains_inanyorder('a', 'b'), contains('c'), contains('a')))
+        self.cel_fetcher._find_last_ids.assert_has_calls([call({'a', 'b'}, 5), call({'c'}, 5), call({'a'}, 5)])
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_starts_after_the_watermark(self):
+        self.watermark.get.return_value = (4, None)
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=4)
+        self.cel_fetcher._find_unprocessed = Mock(return_value=[])
+
+        list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks())
+
+        self.cel_fetcher._find_id_before_unprocessed.assert_called_once_with(None, None, 4, 5)
+        self.cel_fetcher._find_unprocessed.assert_called_once_with(4, 5, ANY)
+        self.watermark.set.assert_called_once_with(5, 'z')
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_checks_the_linked_id_of_the_watermark(self):
+        self.watermark.get.return_value = (4, 'd')
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_linked_id = Mock(return_value='d')
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=4)
+        self.cel_fetcher._find_unprocessed = Mock(return_value=[])
+
+        list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks())
+
+        self.cel_fetcher._find_linked_id.assert_called_once_with(4)
+        self.cel_fetcher._find_id_before_unprocessed.assert_called_once_with(None, None, 4, 5)
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_ignores_the_watermark_of_reused_ids(self):
+        self.watermark.get.return_value = (4, 'd')
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_linked_id = Mock(return_value='other')
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=0)
+        self.cel_fetcher._find_unprocessed = Mock(return_value=[])
+
+        list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks())
+
+        self.cel_fetcher._find_id_before_unprocessed.assert_called_once_with(None, None, 0, 5)
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_ignores_a_watermark_after_the_last_cel(self):
+        self.watermark.get.return_value = (10, None)
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=0)
+        self.cel_fetcher._find_unprocessed = Mock(return_value=[])
+
+        list(self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks())
+
+        self.cel_fetcher._find_id_before_unprocessed.assert_called_once_with(None, None, 0, 5)
+
+    def test_fetch_last_unprocessed_linked_ids_in_chunks_is_not_marked_when_interrupted(self):
+        self.cel_fetcher._find_last = Mock(return_value=Row(5, 'z'))
+        self.cel_fetcher._find_id_before_unprocessed = Mock(return_value=0)
+        self.cel_fetcher._find_unprocessed = Mock(return_value=[Row(1, 'a')])
+
+        chunks = self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks()
+        next(chunks)
+
+        assert_that(self.watermark.set.called, equal_to(False))
+
+    def test_rewind_watermark(self):
+        self.cel_fetcher.rewind_watermark()
+
+        self.watermark.reset.assert_called_once_with()
@@ -0,0 +1,51 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import contains
+from hamcrest import empty
+from hamcrest import equal_to
+from hamcrest import none
+from hamcrest import same_instance
+from mock import Mock
+
+from wazo_call_logd.cel_index import IndexedCELs
+
+
+class TestIndexedCELs(TestCase):
+
+    def setUp(self):
+        self.cel_1 = Mock(uniqueid='1', eventtype='CHAN_START')
+        self.cel_2 = Mock(uniqueid='2', eventtype='CHAN_START')
+        self.cel_3 = Mock(uniqueid='1', eventtype='BRIDGE_ENTER')
+        self.cel_4 = Mock(uniqueid='1', eventtype='BRIDGE_ENTER')
+        self.cels = [self.cel_1, self.cel_2, self.cel_3, self.cel_4]
+        self.index = IndexedCELs(self.cels)
+
+    def test_that_index_is_a_list_of_the_cels(self):
+        assert_that(self.index, equal_to(self.cels))
+
+    def test_of(self):
+        assert_that(IndexedCELs.of(self.index), same_instance(self.index))
+        assert_that(IndexedCELs.of(self.cels), equal_to(self.index))
+
+    def test_uniqueids(self):
+        assert_that(self.index.uniqueids, contains('1', '2'))
+
+    def test_by_uniqueid(self):
+        assert_that(self.index.by_uniqueid('1'), contains(self.cel_1, self.cel_3, self.cel_4))
+        assert_that(self.index.by_uniqueid('unknown'), empty())
+
+    def test_by_eventtype(self):
+        assert_that(self.index.by_eventtype('CHAN_START'), contains(self.cel_1, self.cel_2))
+        assert_that(self.index.by_eventtype('ANSWER'), empty())
+
+    def test_first(self):
+        assert_that(self.index.first('1', 'BRIDGE_ENTER'), same_instance(self.cel_3))
+        assert_that(self.index.first('2', 'BRIDGE_ENTER'), none())
+
+    def test_last(self):
+        assert_that(self.index.last('1', 'BRIDGE_ENTER'), same_instance(self.cel_4))
+        assert_that(self.index.last('2', 'BRIDGE_ENTER'), none())
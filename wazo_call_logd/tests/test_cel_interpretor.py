@@ -22,51 +22,52 @@ from wazo_call_logd.cel_interpretor import CallerCELInterpretor
 from wazo_call_logd.cel_interpretor import CalleeCELInterpretor
 from wazo_call_logd.cel_interpretor import DispatchCELInterpretor
 from wazo_call_logd.cel_interpretor import find_participant
+from wazo_call_logd.participant_lookup import ConfdLookup
 from wazo_call_logd.raw_call_log import RawCallLog
 
 
-def confd_mock(lines=None):
+def confd_lookup(lines=None):
     lines = lines or []
     confd = Mock()
     confd.lines.list.return_value = {'items': lines}
     confd.users.get.return_value = lines[0]['users'][0] if lines and lines[0]['users'] else None
-    return confd
+    return ConfdLookup(confd)
 
 
 class TestFindParticipant(TestCase):
 
     def test_find_participants_when_channame_is_not_parsable(self):
-        confd = confd_mock()
+        lookup = confd_lookup()
         channame = 'something'
 
-        result = find_participant(confd, channame, role='source')
+        result = find_participant(lookup, channame, role='source')
 
         assert_that(result, none())
 
     def test_find_participants_when_no_lines(self):
-        confd = confd_mock()
+        lookup = confd_lookup()
         channame = 'sip/something-suffix'
 
-        result = find_participant(confd, channame, role='source')
+        result = find_participant(lookup, channame, role='source')
 
         assert_that(result, none())
 
     def test_find_participants_when_line_has_no_user(self):
         lines = [{'id': 12, 'users': []}]
-        confd = confd_mock(lines)
+        lookup = confd_lookup(lines)
         channame = 'sip/something-suffix'
 
-        result = find_participant(confd, channame, role='source')
+        result = find_participant(lookup, channame, role='source')
 
         assert_that(result, none())
 
     def test_find_participants_when_line_has_user(self):
         user = {'uuid': 'user_uuid', 'userfield': 'user_userfield, toto'}
         lines = [{'id': 12, 'users': [user]}]
-        confd = confd_mock(lines)
+        lookup = confd_lookup(lines)
         channame = 'sip/something-suffix'
 
-        result = find_participant(confd, channame, role='source')
+        result = find_participant(lookup, channame, role='source')
 
         assert_that(result, has_properties(role='source',
                                            user_uuid='user_uuid',
@@ -176,7 +177,7 @@ class TestAbstractCELInterpretor(TestCase):
 class TestCallerCELInterpretor(TestCase):
 
     def setUp(self):
-        self.caller_cel_interpretor = CallerCELInterpretor(confd_mock())
+        self.caller_cel_interpretor = CallerCELInterpretor(confd_lookup())
 
     def test_interpret_cel_unknown_or_ignored_event(self):
         cel = Mock(eventtype='unknown_or_ignored_eventtype')
@@ -346,7 +347,7 @@ class TestCallerCELInterpretor(TestCase):
 class TestCalleeCELInterpretor(TestCase):
 
     def setUp(self):
-        self.callee_cel_interpretor = CalleeCELInterpretor(confd_mock())
+        self.callee_cel_interpretor = CalleeCELInterpretor(confd_lookup())
 
     def test_interpret_chan_start(self):
         line_identity = 'sip/asldfj'
@@ -13,6 +13,7 @@ from hamcrest import has_property
 from hamcrest import is_
 from hamcrest import raises
 from mock import ANY
+from mock import call
 from mock import Mock
 from mock import patch
 
@@ -28,7 +29,8 @@ class TestCallLogsGenerator(TestCase):
     def test_from_cel(self):
         self.generator.call_logs_from_cel = Mock()
         self.generator.list_call_log_ids = Mock()
-        expected_calls = self.generator.call_logs_from_cel.return_value = Mock()
+        expected_calls = [Mock(), Mock()]
+        self.generator.call_logs_from_cel.return_value = iter(expected_calls)
         expected_to_delete = self.generator.list_call_log_ids.return_value = Mock()
         cels = Mock()
 
@@ -41,18 +43,18 @@ class TestCallLogsGenerator(TestCase):
     def test_call_logs_from_cel_no_cels(self):
         cels = []
 
-        result = self.generator.call_logs_from_cel(cels)
+        result = list(self.generator.call_logs_from_cel(cels))
 
         assert_that(result, equal_to([]))
 
     @patch('wazo_call_logd.raw_call_log.RawCallLog')
     def test_call_logs_from_cel_one_call(self, raw_call_log_constructor):
         linkedid = '9328742934'
-        cels = self._generate_cel_for_call([linkedid])
+        cels = self._generate_cel_for_call(linkedid)
         call = raw_call_log_constructor.return_value = self.interpretor.interpret_cels.return_value
         expected_call = call.to_call_log.return_value
 
-        result = self.generator.call_logs_from_cel(cels)
+        result = list(self.generator.call_logs_from_cel(cels))
 
         self.interpretor.interpret_cels.assert_called_once_with(cels, call)
         assert_that(result, contains(expected_call))
@@ -68,7 +70,7 @@ class TestCallLogsGenerator(TestCase):
         expected_call_1 = call_1.to_call_log.return_value
         expected_call_2 = call_2.to_call_log.return_value
 
-        result = self.generator.call_logs_from_cel(cels)
+        result = list(self.generator.call_logs_from_cel(cels))
 
         self.interpretor.interpret_cels.assert_any_call(cels_1, ANY)
         self.interpretor.interpret_cels.assert_any_call(cels_2, ANY)
@@ -85,12 +87,78 @@ class TestCallLogsGenerator(TestCase):
         expected_call_1 = call_1.to_call_log.return_value
         call_2.to_call_log.side_effect = InvalidCallLogException()
 
-        result = self.generator.call_logs_from_cel(cels)
+        result = list(self.generator.call_logs_from_cel(cels))
 
         self.interpretor.interpret_cels.assert_any_call(cels_1, ANY)
         self.interpretor.interpret_cels.assert_any_call(cels_2, ANY)
         assert_that(result, contains(expected_call_1))
 
+    def test_call_logs_from_cel_prefetches_participants(self):
+        participant_lookup = Mock()
+        generator = CallLogsGenerator([self.interpretor], participant_lookup)
+        cels = [
+            Mock(linkedid='1', eventtype='CHAN_START', channame='SIP/abcdef-00000001'),
+            Mock(linkedid='1', eventtype='ANSWER', channame='SIP/abcdef-00000001'),
+            Mock(linkedid='1', eventtype='CHAN_START', channame='SIP/ghijkl-00000002'),
+            Mock(linkedid='2', eventtype='CHAN_START', channame='SIP/abcdef-00000003'),
+        ]
+
+        list(generator.call_logs_from_cel(cels))
+
+        participant_lookup.prefetch.assert_called_once_with({'abcdef', 'ghijkl'})
+
+    def test_from_cel_in_chunks(self):
+        call_logs = [Mock(), Mock(), Mock()]
+        self.generator.call_logs_from_cel = Mock(return_value=iter(call_logs))
+        self.generator.list_call_log_ids = Mock(return_value={1, 2})
+        cels = Mock()
+
+        result = list(self.generator.from_cel_in_chunks(cels, chunk_size=2))
+
+        assert_that(result, contains(
+            all_of(has_property('new_call_logs', call_logs[:2]),
+                   has_property('call_logs_to_delete', {1, 2})),
+            all_of(has_property('new_call_logs', call_logs[2:]),
+                   has_property('call_logs_to_delete', set())),
+        ))
+
+    def test_from_cel_in_chunks_with_only_call_logs_to_delete(self):
+        self.generator.call_logs_from_cel = Mock(return_value=iter([]))
+        self.generator.list_call_log_ids = Mock(return_value={1})
+
+        result = list(self.generator.from_cel_in_chunks(Mock(), chunk_size=2))
+
+        assert_that(result, contains(all_of(has_property('new_call_logs', []),
+                                            has_property('call_logs_to_delete', {1}))))
+
+    @patch('wazo_call_logd.raw_call_log.RawCallLog')
+    def test_call_logs_from_cel_keeps_fetch_order(self, raw_call_log_constructor):
+        cels_1 = self._generate_cel_for_call('2')
+        cels_2 = self._generate_cel_for_call('1')
+        self.interpretor.interpret_cels.side_effect = lambda cels, call_log: call_log
+
+        list(self.generator.call_logs_from_cel(cels_1 + cels_2))
+
+        assert_that(self.interpretor.interpret_cels.call_args_list, contains(
+            call(cels_1, ANY),
+            call(cels_2, ANY),
+        ))
+
+    @patch('wazo_call_logd.raw_call_log.RawCallLog')
+    def test_that_call_is_interpreted_as_soon_as_it_ended(self, raw_call_log_constructor):
+        cels_1 = [Mock(linkedid='1', eventtype='CHAN_START', eventtime=1),
+                  Mock(linkedid='1', eventtype='LINKEDID_END', eventtime=2),
+                  Mock(linkedid='1', eventtype='CHAN_END', eventtime=2)]
+        cels_2 = [Mock(linkedid='2', eventtype='CHAN_START', eventtime=1),
+                  Mock(linkedid='2', eventtype='CHAN_END', eventtime=3)]
+        cels = [cels_1[0], cels_2[0], cels_1[1], cels_1[2], cels_2[1]]
+        self.interpretor.interpret_cels.side_effect = lambda cels, call_log: call_log
+
+        call_logs = self.generator.call_logs_from_cel(cels)
+        next(call_logs)
+
+        self.interpretor.interpret_cels.assert_called_once_with(cels_1, ANY)
+
     def test_list_call_log_ids(self):
         cel_1, cel_2 = Mock(call_log_id=1), Mock(call_log_id=1)
         cel_3, cel_4 = Mock(call_log_id=2), Mock(call_log_id=None)
@@ -106,9 +174,9 @@ class TestCallLogsGenerator(TestCase):
         interpretor_true_2.can_interpret.return_value = True
         interpretor_false.can_interpret.return_value = False
         generator = CallLogsGenerator([interpretor_false, interpretor_true_1, interpretor_true_2, interpretor_false])
-        cels = self._generate_cel_for_call(['545783248'])
+        cels = self._generate_cel_for_call('545783248')
 
-        generator.call_logs_from_cel(cels)
+        list(generator.call_logs_from_cel(cels))
 
         interpretor_true_1.interpret_cels.assert_called_once_with(cels, ANY)
         assert_that(interpretor_true_2.interpret_cels.called, is_(False))
@@ -118,9 +186,9 @@ class TestCallLogsGenerator(TestCase):
         interpretor = Mock()
         interpretor.can_interpret.return_value = False
         generator = CallLogsGenerator([interpretor])
-        cels = self._generate_cel_for_call(['545783248'])
+        cels = self._generate_cel_for_call('545783248')
 
-        assert_that(calling(generator.call_logs_from_cel).with_args(cels), raises(RuntimeError))
+        assert_that(calling(list).with_args(generator.call_logs_from_cel(cels)), raises(RuntimeError))
 
     def _generate_cel_for_call(self, linked_id, cel_count=3):
         result = []
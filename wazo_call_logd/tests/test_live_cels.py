@@ -0,0 +1,130 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from datetime import datetime
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import contains
+from hamcrest import equal_to
+from hamcrest import has_properties
+from hamcrest import raises
+
+from wazo_call_logd.cel_fetcher import CELRow
+from wazo_call_logd.live_cels import cel_from_event
+from wazo_call_logd.live_cels import LiveCELs
+
+
+def cel(eventtype, uniqueid, linkedid):
+    return CELRow(None, eventtype, datetime(2017, 1, 1), uniqueid, linkedid, 'SIP/abc-1', '', '', 's', '', None)
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCELFromEvent(TestCase):
+
+    def setUp(self):
+        self.data = {
+            'EventName': 'CHAN_START',
+            'EventTime': '2017-04-11 14:05:30.123456',
+            'UniqueID': '1491933930.12',
+            'LinkedID': '1491933930.10',
+            'Channel': 'SIP/abc-00000001',
+            'CallerIDname': 'Alice',
+            'CallerIDnum': '1001',
+            'Exten': '1002',
+            'Userfield': '',
+            'Context': 'default',
+        }
+
+    def test_cel_from_event(self):
+        result = cel_from_event(self.data)
+
+        assert_that(result, has_properties(id=None,
+                                           eventtype='CHAN_START',
+                                           eventtime=datetime(2017, 4, 11, 14, 5, 30, 123456),
+                                           uniqueid='1491933930.12',
+                                           linkedid='1491933930.10',
+                                           channame='SIP/abc-00000001',
+                                           cid_name='Alice',
+                                           cid_num='1001',
+                                           exten='1002',
+                                           userfield='',
+                                           call_log_id=None))
+
+    def test_cel_from_event_with_a_timestamp(self):
+        self.data['EventTime'] = '1491933930.123456'
+
+        result = cel_from_event(self.data)
+
+        assert_that(result.eventtime, equal_to(datetime.fromtimestamp(1491933930.123456)))
+
+    def test_cel_from_event_with_an_unknown_time_format(self):
+        self.data['EventTime'] = '11/04/2017'
+
+        assert_that(calling(cel_from_event).with_args(self.data), raises(ValueError))
+
+
+class TestLiveCELs(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.live_cels = LiveCELs(max_calls=2, max_cels_per_call=3, ttl=10, clock=self.clock)
+
+    def test_that_a_call_seen_from_its_first_cel_is_kept(self):
+        cels = [cel('CHAN_START', '1', '1'), cel('CHAN_START', '2', '1'), cel('LINKEDID_END', '1', '1')]
+        for cel_ in cels:
+            self.live_cels.add(cel_)
+
+        assert_that(self.live_cels.pop('1'), contains(*cels))
+        assert_that(self.live_cels.pop('1'), equal_to(None))
+
+    def test_that_a_call_not_seen_from_its_first_cel_is_not_kept(self):
+        self.live_cels.add(cel('CHAN_START', '2', '1'))
+        self.live_cels.add(cel('LINKEDID_END', '1', '1'))
+
+        assert_that(self.live_cels.pop('1'), equal_to(None))
+
+    def test_that_the_least_recently_updated_call_is_evicted(self):
+        self.live_cels.add(cel('CHAN_START', '1', '1'))
+        self.live_cels.add(cel('CHAN_START', '2', '2'))
+        self.live_cels.add(cel('ANSWER', '1', '1'))
+
+        self.live_cels.add(cel('CHAN_START', '3', '3'))
+
+        assert_that(self.live_cels.pop('2'), equal_to(None))
+        assert_that(self.live_cels.pop('1'), contains(has_properties(eventtype='CHAN_START'),
+                                                      has_properties(eventtype='ANSWER')))
+
+    def test_that_a_call_with_too_many_cels_is_evicted(self):
+        for eventtype in ('CHAN_START', 'ANSWER', 'HANGUP', 'CHAN_END'):
+            self.live_cels.add(cel(eventtype, '1', '1'))
+
+        assert_that(self.live_cels.pop('1'), equal_to(None))
+
+    def test_clear(self):
+        self.live_cels.add(cel('CHAN_START', '1', '1'))
+
+        self.live_cels.clear()
+        self.live_cels.add(cel('LINKEDID_END', '1', '1'))
+
+        assert_that(self.live_cels.pop('1'), equal_to(None))
+
+    def test_evict_expired(self):
+        self.live_cels.add(cel('CHAN_START', '1', '1'))
+        self.clock.now = 5
+        self.live_cels.add(cel('CHAN_START', '2', '2'))
+        self.clock.now = 10
+
+        self.live_cels.evict_expired()
+
+        assert_that(self.live_cels.pop('1'), equal_to(None))
+        assert_that(self.live_cels.pop('2'), contains(has_properties(uniqueid='2')))
@@ -1,11 +1,20 @@
 # Copyright 2015-2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+from datetime import datetime
+from datetime import timedelta
 from unittest import TestCase
 
+from hamcrest import assert_that
+from hamcrest import equal_to
+from hamcrest import greater_than_or_equal_to
+from mock import ANY
+from mock import call
 from mock import Mock
+from mock import patch
 
 from wazo_call_logd.manager import CallLogsManager
+from wazo_call_logd.manager import ParallelCallLogsManager
 from wazo_call_logd.cel_fetcher import CELFetcher
 from wazo_call_logd.generator import CallLogsGenerator
 from wazo_call_logd.writer import CallLogsWriter
@@ -15,6 +24,8 @@ from wazo_call_logd.bus_publisher import BusPublisher
 class TestCallLogsManager(TestCase):
     def setUp(self):
         self.cel_fetcher = Mock(CELFetcher)
+        self.cel_fetcher.lock_linked_ids.return_value = set()
+        self.cel_fetcher.find_generated.return_value = set()
         self.generator = Mock(CallLogsGenerator)
         self.writer = Mock(CallLogsWriter)
         self.publisher = Mock(BusPublisher)
@@ -23,24 +34,250 @@ class TestCallLogsManager(TestCase):
     def tearDown(self):
         pass
 
+    @patch('xivo_dao.resources.call_log.dao.delete')
+    def test_delete_all_rewinds_the_watermark(self, dao_delete):
+        self.manager.delete_all()
+
+        dao_delete.assert_called_once_with()
+        self.cel_fetcher.rewind_watermark.assert_called_once_with()
+
+    @patch('xivo_dao.resources.call_log.dao.delete')
+    def test_delete_from_days_rewinds_the_watermark(self, dao_delete):
+        self.manager.delete_from_days(days=3)
+
+        dao_delete.assert_called_once_with(older=ANY)
+        self.cel_fetcher.rewind_watermark.assert_called_once_with(older=dao_delete.call_args[1]['older'])
+
     def test_generate_from_count(self):
         cel_count = 132456
-        cels = self.cel_fetcher.fetch_last_unprocessed.return_value = [Mock(), Mock()]
-        call_logs = self.generator.from_cel.return_value = Mock(new_call_logs=[])
+        cels = self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock(), Mock()]
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'2', '1'}])
+        call_logs = Mock(new_call_logs=[])
+        self.generator.from_cel_in_chunks.return_value = [call_logs]
 
         self.manager.generate_from_count(cel_count=cel_count)
 
-        self.cel_fetcher.fetch_last_unprocessed.assert_called_once_with(cel_count)
-        self.generator.from_cel.assert_called_once_with(cels)
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.assert_called_once_with(cel_count=cel_count,
+                                                                                             older=None)
+        self.cel_fetcher.lock_linked_ids.assert_called_once_with({'1', '2'})
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(['1', '2'])
+        self.generator.from_cel_in_chunks.assert_called_once_with(cels, CallLogsManager.write_chunk_size)
         self.writer.write.assert_called_once_with(call_logs)
 
+    def test_generate_from_count_publishes_a_summary_when_backfilling(self):
+        self.manager.backfill = True
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'1'}])
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        call_logs = Mock(new_call_logs=[Mock(linkedid_end_time=None)])
+        self.generator.from_cel_in_chunks.return_value = [call_logs]
+
+        self.manager.generate_from_count(cel_count=10)
+
+        self.publisher.publish_summary.assert_called_once_with(call_logs.new_call_logs)
+        assert_that(self.publisher.publish_all.called, equal_to(False))
+
+    def test_generate_from_days_generates_each_cels_chunk(self):
+        cels_1, cels_2 = [Mock()], [Mock()]
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'1'}, {'2'}])
+        self.cel_fetcher.fetch_from_linked_ids.side_effect = [cels_1, cels_2]
+        self.generator.from_cel_in_chunks.return_value = []
+
+        self.manager.generate_from_days(days=30)
+
+        self.generator.from_cel_in_chunks.assert_has_calls([
+            call(cels_1, CallLogsManager.write_chunk_size),
+            call(cels_2, CallLogsManager.write_chunk_size),
+        ])
+
     def test_generate_from_linked_id(self):
         linked_id = '666'
-        cels = self.cel_fetcher.fetch_from_linked_id.return_value = [Mock()]
-        call_logs = self.generator.from_cel.return_value = Mock(new_call_logs=[])
+        cels = self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        call_logs = Mock(new_call_logs=[])
+        self.generator.from_cel_in_chunks.return_value = [call_logs]
 
         self.manager.generate_from_linked_id(linked_id=linked_id)
 
-        self.cel_fetcher.fetch_from_linked_id.assert_called_once_with(linked_id)
-        self.generator.from_cel.assert_called_once_with(cels)
+        self.cel_fetcher.lock_linked_ids.assert_called_once_with([linked_id])
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with([linked_id])
+        self.generator.from_cel_in_chunks.assert_called_once_with(cels, CallLogsManager.write_chunk_size)
+        self.writer.write.assert_called_once_with(call_logs)
+
+    def test_generate_from_linked_ids(self):
+        linked_ids = ['666', '777']
+        cels = self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        call_logs = Mock(new_call_logs=[Mock(linkedid_end_time=None), Mock(linkedid_end_time=None)])
+        self.generator.from_cel_in_chunks.return_value = [call_logs]
+
+        result = self.manager.generate_from_linked_ids(linked_ids)
+
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(linked_ids)
+        self.generator.from_cel_in_chunks.assert_called_once_with(cels, CallLogsManager.write_chunk_size)
         self.writer.write.assert_called_once_with(call_logs)
+        assert_that(result, equal_to(2))
+
+    @patch('wazo_call_logd.manager.COMMIT_DELAY_SECONDS')
+    def test_that_the_delay_from_linkedid_end_is_observed_after_commit(self, commit_delay):
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        call_log = Mock(linkedid_end_time=datetime.now() - timedelta(seconds=10))
+        self.generator.from_cel_in_chunks.return_value = [Mock(new_call_logs=[call_log])]
+
+        with patch('wazo_call_logd.manager.session_scope') as session_scope:
+            session_scope.return_value.__exit__.side_effect = lambda *_: commit_delay.observe.assert_not_called()
+            self.manager.generate_from_linked_ids(['666'])
+
+        delay = commit_delay.observe.call_args[0][0]
+        assert_that(delay, greater_than_or_equal_to(10))
+
+    @patch('wazo_call_logd.manager.COMMIT_DELAY_SECONDS')
+    def test_that_the_delays_of_backfilled_call_logs_are_not_observed(self, commit_delay):
+        self.manager.backfill = True
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        call_log = Mock(linkedid_end_time=datetime.now() - timedelta(days=10))
+        self.generator.from_cel_in_chunks.return_value = [Mock(new_call_logs=[call_log])]
+
+        with patch('wazo_call_logd.manager.session_scope'):
+            self.manager.generate_from_linked_ids(['666'])
+
+        assert_that(commit_delay.observe.called, equal_to(False))
+
+    def test_generate_from_linked_ids_with_the_cels_received_from_the_bus(self):
+        self.cel_fetcher.count_unlinked.return_value = {'666': 1, '777': 3}
+        live_cel, fetched_cel = Mock(), Mock()
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [fetched_cel]
+        self.generator.from_cel_in_chunks.return_value = []
+
+        self.manager.generate_from_linked_ids(['666', '777'], {'666': [live_cel]})
+
+        self.cel_fetcher.count_unlinked.assert_called_once_with(['666'])
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(['777'])
+        self.generator.from_cel_in_chunks.assert_called_once_with([live_cel, fetched_cel], ANY)
+
+    def test_generate_from_linked_ids_fetches_the_calls_not_matching_the_cel_table(self):
+        # 666: CEL lost by the bus, 777: CEL not inserted yet, 888: already generated
+        self.cel_fetcher.count_unlinked.return_value = {'666': 3, '777': 1}
+        live_cels = {'666': [Mock(), Mock()], '777': [Mock(), Mock()], '888': [Mock()]}
+        self.cel_fetcher.fetch_from_linked_ids.return_value = []
+        self.generator.from_cel_in_chunks.return_value = []
+
+        self.manager.generate_from_linked_ids(['666', '777', '888'], live_cels)
+
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(['666', '777', '888'])
+        self.generator.from_cel_in_chunks.assert_called_once_with([], ANY)
+
+    def test_generate_from_linked_ids_skips_the_linked_ids_generated_by_another_instance(self):
+        self.cel_fetcher.lock_linked_ids.return_value = {'666', '777'}
+        self.cel_fetcher.find_generated.return_value = {'666'}
+        self.cel_fetcher.fetch_from_linked_ids.return_value = []
+        self.generator.from_cel_in_chunks.return_value = []
+
+        self.manager.generate_from_linked_ids(['666', '777', '888'])
+
+        self.cel_fetcher.find_generated.assert_called_once_with({'666', '777'})
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(['777', '888'])
+
+    def test_generate_from_linked_ids_fetches_the_linked_ids_partly_generated_by_another_instance(self):
+        self.cel_fetcher.lock_linked_ids.return_value = {'666'}
+        self.cel_fetcher.find_generated.return_value = set()
+        # some CEL are linked to the call log of the other instance
+        self.cel_fetcher.count_unlinked.return_value = {}
+        live_cel, fetched_cel = Mock(), Mock()
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [fetched_cel]
+        self.generator.from_cel_in_chunks.return_value = []
+
+        self.manager.generate_from_linked_ids(['666'], {'666': [live_cel]})
+
+        self.cel_fetcher.lock_linked_ids.assert_called_once_with(['666'])
+        self.cel_fetcher.fetch_from_linked_ids.assert_called_once_with(['666'])
+        self.generator.from_cel_in_chunks.assert_called_once_with([fetched_cel], ANY)
+
+    def test_that_each_chunk_is_written_then_published(self):
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        chunk_1 = Mock(new_call_logs=[Mock(linkedid_end_time=None)])
+        chunk_2 = Mock(new_call_logs=[Mock(linkedid_end_time=None)])
+        self.generator.from_cel_in_chunks.return_value = [chunk_1, chunk_2]
+
+        self.manager.generate_from_linked_id(linked_id='666')
+
+        self.writer.write.assert_has_calls([call(chunk_1), call(chunk_2)])
+        self.publisher.publish_all.assert_has_calls([call(chunk_1.new_call_logs),
+                                                     call(chunk_2.new_call_logs)])
+
+
+class TestParallelCallLogsManager(TestCase):
+
+    def setUp(self):
+        get_context_patch = patch('multiprocessing.get_context')
+        self.pool = Mock()
+        self.pool.map.side_effect = lambda function, tasks: [function(task) for task in tasks]
+        self.Pool = get_context_patch.start().return_value.Pool
+        self.Pool.side_effect = lambda jobs, initializer, initargs: initializer(*initargs) or self.pool
+        self.addCleanup(get_context_patch.stop)
+
+        self.cel_fetcher = Mock(CELFetcher)
+        self.cel_fetcher.lock_linked_ids.return_value = set()
+        self.cel_fetcher.fetch_from_linked_ids.return_value = [Mock()]
+        self.generator = Mock(CallLogsGenerator)
+        self.generator.from_cel_in_chunks.return_value = [Mock(new_call_logs=[Mock(linkedid_end_time=None)])]
+        self.writer = Mock(CallLogsWriter)
+        self.publisher = Mock(BusPublisher)
+        self.set_token = Mock()
+        self.manager = ParallelCallLogsManager(self.cel_fetcher, self.generator, self.writer, self.publisher,
+                                               jobs=2, set_token=self.set_token)
+        self.manager.__enter__()
+
+    def test_generate_from_days_shares_each_chunk_between_the_jobs(self):
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'1', '2', '3'}, {'4'}])
+
+        self.manager.generate_from_days(days=30)
+
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.assert_called_once_with(cel_count=None,
+                                                                                             older=ANY)
+        self.pool.map.assert_has_calls([call(ANY, [(None, ['1', '3']), (None, ['2'])]),
+                                        call(ANY, [(None, ['4']), (None, [])])])
+        self.cel_fetcher.fetch_from_linked_ids.assert_has_calls([call(['1', '3']), call(['2']), call(['4'])])
+        assert_that(self.cel_fetcher.fetch_from_linked_ids.call_count, equal_to(3))
+
+    def test_that_the_token_is_given_to_the_jobs(self):
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'1'}])
+
+        self.manager.set_token('my-token')
+        self.manager.generate_from_count(cel_count=10)
+
+        self.set_token.assert_called_once_with('my-token')
+
+    def test_that_the_events_of_the_jobs_are_published_by_the_parent(self):
+        self.cel_fetcher.fetch_last_unprocessed_linked_ids_in_chunks.return_value = iter([{'1', '2'}])
+        self.publisher.pop_collected_events.side_effect = [['event-1'], ['event-2']]
+
+        self.manager.generate_from_count(cel_count=10)
+
+        assert_that(self.publisher.collect_events.call_count, equal_to(2))
+        self.publisher.send_events.assert_has_calls([call(['event-1']), call(['event-2'])])
+
+    @patch('wazo_call_logd.manager.logger')
+    def test_that_the_speedup_is_estimated_against_the_serial_path(self, logger):
+        self.manager._fetch_time, self.manager._job_time, self.manager._elapsed_time = 1.0, 5.0, 3.0
+
+        self.manager.log_stats()
+
+        serial_time, speedup = logger.info.call_args[0][4:]
+        assert_that(serial_time, equal_to(6.0))
+        assert_that(speedup, equal_to(2.0))
+
+    def test_that_the_jobs_are_forked_when_entering(self):
+        manager = ParallelCallLogsManager(self.cel_fetcher, self.generator, self.writer, self.publisher, jobs=3)
+
+        with manager:
+            self.Pool.assert_called_with(3, initializer=ANY, initargs=(manager,))
+
+    def test_exit(self):
+        self.manager.__exit__(None, None, None)
+
+        self.pool.close.assert_called_once_with()
+        self.pool.join.assert_called_once_with()
+
+    def test_exit_on_error_terminates_the_jobs(self):
+        self.manager.__exit__(RuntimeError, RuntimeError(), None)
+
+        self.pool.terminate.assert_called_once_with()
+        self.pool.join.assert_called_once_with()
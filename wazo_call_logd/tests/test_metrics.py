@@ -0,0 +1,159 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import contains
+from hamcrest import equal_to
+from hamcrest import raises
+from mock import Mock
+from mock import patch
+
+from wazo_call_logd.metrics import Histogram
+from wazo_call_logd.metrics import Registry
+from wazo_call_logd.metrics import register_db_pool
+from wazo_call_logd.metrics import render_prometheus_text
+
+
+class TestHistogram(TestCase):
+
+    def setUp(self):
+        self.histogram = Histogram('my_seconds', 'My operations', buckets=(0.1, 1, float('inf')))
+
+    def test_observe(self):
+        for value in (0.05, 0.1, 0.5, 2):
+            self.histogram.observe(value)
+
+        assert_that(self.histogram.count, equal_to(4))
+        assert_that(self.histogram.sum, equal_to(2.65))
+        assert_that(self.histogram.cumulative_counts(), contains((0.1, 2), (1, 3), (float('inf'), 4)))
+
+    @patch('wazo_call_logd.metrics.time')
+    def test_time(self, time):
+        time.monotonic.side_effect = [10, 10.5]
+
+        with self.histogram.time():
+            pass
+
+        assert_that(self.histogram.cumulative_counts(), contains((0.1, 0), (1, 1), (float('inf'), 1)))
+
+    @patch('wazo_call_logd.metrics.time')
+    def test_time_when_an_exception_is_raised(self, time):
+        time.monotonic.side_effect = [10, 10.5]
+
+        def fail():
+            with self.histogram.time():
+                raise RuntimeError()
+
+        assert_that(calling(fail), raises(RuntimeError))
+        assert_that(self.histogram.count, equal_to(1))
+
+    def test_percentile(self):
+        for value in [0.01] * 98 + [0.5, 5]:
+            self.histogram.observe(value)
+
+        assert_that(self.histogram.percentile(50), equal_to(0.1))
+        assert_that(self.histogram.percentile(99), equal_to(1))
+        assert_that(self.histogram.percentile(100), equal_to(float('inf')))
+
+    def test_percentile_without_observation(self):
+        assert_that(self.histogram.percentile(50), equal_to(None))
+
+    def test_merge(self):
+        other = Histogram('my_seconds', 'My operations', buckets=(0.1, 1, float('inf')))
+        other.observe(0.5)
+        self.histogram.observe(0.05)
+
+        self.histogram.merge(other.snapshot())
+
+        assert_that(self.histogram.count, equal_to(2))
+        assert_that(self.histogram.sum, equal_to(0.55))
+
+    def test_reset(self):
+        self.histogram.observe(0.5)
+
+        self.histogram.reset()
+
+        assert_that(self.histogram.count, equal_to(0))
+        assert_that(self.histogram.sum, equal_to(0))
+
+
+class TestRegistry(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_that_a_histogram_is_created_once(self):
+        histogram = self.registry.histogram('my_seconds', 'My operations')
+
+        assert_that(self.registry.histogram('my_seconds', 'My operations'), equal_to(histogram))
+        assert_that(self.registry.histograms(), contains(histogram))
+
+    def test_snapshot_and_merge(self):
+        self.registry.histogram('my_seconds', 'My operations').observe(0.5)
+        other = Registry()
+        other.histogram('my_seconds', 'My operations').observe(1)
+
+        self.registry.merge(other.snapshot())
+
+        assert_that(self.registry.histogram('my_seconds', 'My operations').count, equal_to(2))
+
+    def test_that_labeled_metrics_are_distinct(self):
+        first = self.registry.counter('my_total', 'My events', labels={'kind': 'first'})
+        second = self.registry.counter('my_total', 'My events', labels={'kind': 'second'})
+
+        first.inc()
+
+        assert_that(first.value, equal_to(1))
+        assert_that(second.value, equal_to(0))
+
+
+class TestRenderPrometheusText(TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        self.registry.counter('my_total', 'My events').inc(3)
+
+        result = render_prometheus_text(self.registry)
+
+        assert_that(result, equal_to('# HELP my_total My events\n'
+                                     '# TYPE my_total counter\n'
+                                     'my_total 3\n'))
+
+    def test_histogram_with_labels(self):
+        histogram = self.registry.histogram('my_seconds', 'My operations', buckets=(0.5, float('inf')),
+                                            labels={'kind': 'a "quoted" kind'})
+        histogram.observe(0.25)
+        histogram.observe(2)
+
+        result = render_prometheus_text(self.registry)
+
+        assert_that(result, equal_to('# HELP my_seconds My operations\n'
+                                     '# TYPE my_seconds histogram\n'
+                                     'my_seconds_bucket{kind="a \\"quoted\\" kind",le="0.5"} 1\n'
+                                     'my_seconds_bucket{kind="a \\"quoted\\" kind",le="+Inf"} 2\n'
+                                     'my_seconds_sum{kind="a \\"quoted\\" kind"} 2.25\n'
+                                     'my_seconds_count{kind="a \\"quoted\\" kind"} 2\n'))
+
+    def test_gauges(self):
+        pool = Mock()
+        pool.size.return_value = 5
+        pool.checkedout.return_value = 2
+        pool.overflow.side_effect = Exception('not available')
+
+        register_db_pool('generation', lambda: pool, self.registry)
+        result = render_prometheus_text(self.registry)
+
+        assert_that(result, equal_to('# HELP call_logd_db_pool_checked_out Database connections in use\n'
+                                     '# TYPE call_logd_db_pool_checked_out gauge\n'
+                                     'call_logd_db_pool_checked_out{pool="generation"} 2\n'
+                                     '# HELP call_logd_db_pool_overflow '
+                                     'Database connections opened beyond the pool size\n'
+                                     '# TYPE call_logd_db_pool_overflow gauge\n'
+                                     '# HELP call_logd_db_pool_size Connections kept in the database pool\n'
+                                     '# TYPE call_logd_db_pool_size gauge\n'
+                                     'call_logd_db_pool_size{pool="generation"} 5\n'))
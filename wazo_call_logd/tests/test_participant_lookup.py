@@ -0,0 +1,362 @@
+# Copyright 2017 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0+
+
+from collections import namedtuple
+from unittest import TestCase
+
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import equal_to
+from hamcrest import has_entries
+from hamcrest import instance_of
+from hamcrest import none
+from hamcrest import raises
+from mock import call
+from mock import Mock
+from mock import patch
+from mock import sentinel
+from requests import HTTPError
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from wazo_call_logd.bin.main import DEFAULT_CONFIG as CRON_DEFAULT_CONFIG
+from wazo_call_logd.participant_lookup import CachedLookup
+from wazo_call_logd.participant_lookup import ConfdLookup
+from wazo_call_logd.participant_lookup import DatabaseLookup
+from wazo_call_logd.participant_lookup import new_participant_lookup
+
+LineRow = namedtuple('LineRow', ['id', 'name', 'user_uuid'])
+UserRow = namedtuple('UserRow', ['uuid', 'userfield'])
+
+
+class TestConfdLookup(TestCase):
+
+    def setUp(self):
+        self.confd = Mock()
+        self.lookup = ConfdLookup(self.confd)
+
+    def test_get_line(self):
+        line = {'id': 12, 'name': 'abcdef', 'users': []}
+        self.confd.lines.list.return_value = {'items': [line]}
+
+        result = self.lookup.get_line('abcdef')
+
+        self.confd.lines.list.assert_called_once_with(name='abcdef')
+        assert_that(result, equal_to(line))
+
+    def test_get_line_when_no_lines(self):
+        self.confd.lines.list.return_value = {'items': []}
+
+        result = self.lookup.get_line('abcdef')
+
+        assert_that(result, none())
+
+    def test_get_user(self):
+        user = self.confd.users.get.return_value = {'uuid': 'user-uuid'}
+
+        result = self.lookup.get_user('user-uuid')
+
+        self.confd.users.get.assert_called_once_with('user-uuid')
+        assert_that(result, equal_to(user))
+
+    def test_find_lines_few_lines(self):
+        line = {'id': 12, 'name': 'abcdef', 'users': []}
+        self.confd.lines.list.side_effect = lambda name: {'items': [line] if name == 'abcdef' else []}
+
+        result = self.lookup.find_lines({'abcdef', 'trunk'})
+
+        assert_that(result, equal_to({'abcdef': line}))
+
+    def test_find_lines_many_lines(self):
+        line_names = set('line{}'.format(i) for i in range(ConfdLookup.bulk_lines_threshold))
+        line = {'id': 12, 'name': 'line0', 'users': []}
+        other_line = {'id': 13, 'name': 'other', 'users': []}
+        self.confd.lines.list.return_value = {'items': [line, other_line], 'total': 2}
+
+        result = self.lookup.find_lines(line_names)
+
+        self.confd.lines.list.assert_called_once_with(order='name', limit=ConfdLookup.lines_page_size, offset=0)
+        assert_that(result, equal_to({'line0': line}))
+
+    def test_find_lines_many_lines_by_page(self):
+        self.lookup.lines_page_size = 2
+        line_names = set('line{}'.format(i) for i in range(ConfdLookup.bulk_lines_threshold))
+        pages = [[{'id': 1, 'name': 'line0'}, {'id': 2, 'name': 'other'}],
+                 [{'id': 3, 'name': 'line1'}, {'id': 4, 'name': 'line2'}],
+                 [{'id': 5, 'name': 'line3'}]]
+        self.confd.lines.list.side_effect = [{'items': page, 'total': 5} for page in pages]
+
+        result = self.lookup.find_lines(line_names)
+
+        assert_that(self.confd.lines.list.call_count, equal_to(3))
+        self.confd.lines.list.assert_called_with(order='name', limit=2, offset=4)
+        assert_that(sorted(result), equal_to(['line0', 'line1', 'line2', 'line3']))
+
+    def test_find_lines_many_lines_stops_when_all_are_found(self):
+        self.lookup.lines_page_size = 2
+        self.lookup.bulk_lines_threshold = 2
+        self.confd.lines.list.return_value = {'items': [{'id': 1, 'name': 'line0'}, {'id': 2, 'name': 'line1'}],
+                                              'total': 1000}
+
+        result = self.lookup.find_lines({'line0', 'line1'})
+
+        self.confd.lines.list.assert_called_once_with(order='name', limit=2, offset=0)
+        assert_that(sorted(result), equal_to(['line0', 'line1']))
+
+    def test_find_lines_many_lines_searches_the_missing_names_instead_of_every_page(self):
+        self.lookup.lines_page_size = 2
+        self.lookup.bulk_lines_threshold = 3
+        pages = {None: {'items': [{'id': 1, 'name': 'line0'}, {'id': 2, 'name': 'line1'}], 'total': 1000},
+                 'unknown': {'items': [], 'total': 0}}
+        self.confd.lines.list.side_effect = lambda name=None, **kwargs: pages[name]
+
+        result = self.lookup.find_lines({'line0', 'line1', 'unknown'})
+
+        self.confd.lines.list.assert_has_calls([call(order='name', limit=2, offset=0), call(name='unknown')])
+        assert_that(self.confd.lines.list.call_count, equal_to(2))
+        assert_that(sorted(result), equal_to(['line0', 'line1']))
+
+    def test_find_users(self):
+        user = {'uuid': 'user-uuid'}
+        self.confd.users.get.return_value = user
+
+        result = self.lookup.find_users({'user-uuid'})
+
+        self.confd.users.get.assert_called_once_with('user-uuid')
+        assert_that(result, equal_to({'user-uuid': user}))
+
+    def test_find_users_skips_the_unknown_users(self):
+        user = {'uuid': 'user-uuid'}
+
+        def get(user_uuid):
+            if user_uuid != 'user-uuid':
+                raise HTTPError()
+            return user
+        self.confd.users.get.side_effect = get
+
+        result = self.lookup.find_users({'user-uuid', 'unknown-uuid'})
+
+        assert_that(result, equal_to({'user-uuid': user}))
+
+
+class TestDatabaseLookup(TestCase):
+
+    def setUp(self):
+        self.lookup = DatabaseLookup()
+        self.query_lines = self.lookup._query_lines = Mock()
+        self.query_users = self.lookup._query_users = Mock()
+
+    def test_get_line_with_user(self):
+        self.query_lines.return_value.filter.return_value.first.return_value = LineRow(12, 'abcdef', 'user-uuid')
+
+        result = self.lookup.get_line('abcdef')
+
+        assert_that(result, equal_to({'id': 12, 'name': 'abcdef', 'users': [{'uuid': 'user-uuid'}]}))
+
+    def test_get_line_without_user(self):
+        self.query_lines.return_value.filter.return_value.first.return_value = LineRow(12, 'abcdef', None)
+
+        result = self.lookup.get_line('abcdef')
+
+        assert_that(result, equal_to({'id': 12, 'name': 'abcdef', 'users': []}))
+
+    def test_get_line_when_no_lines(self):
+        self.query_lines.return_value.filter.return_value.first.return_value = None
+
+        result = self.lookup.get_line('abcdef')
+
+        assert_that(result, none())
+
+    def test_find_users(self):
+        self.query_users.return_value.filter.return_value.all.return_value = [UserRow('user-uuid', 'a, b')]
+
+        result = self.lookup.find_users({'user-uuid'})
+
+        assert_that(result, equal_to({'user-uuid': {'uuid': 'user-uuid', 'userfield': 'a, b'}}))
+
+
+class TestDatabaseLookupQueries(TestCase):
+
+    LINES_QUERY = ('SELECT linefeatures.id, linefeatures.name, userfeatures.uuid AS user_uuid '
+                   'FROM linefeatures '
+                   'LEFT OUTER JOIN user_line ON user_line.line_id = linefeatures.id AND user_line.main_user = true '
+                   'LEFT OUTER JOIN userfeatures ON userfeatures.id = user_line.user_id ')
+    USERS_QUERY = 'SELECT userfeatures.uuid, userfeatures.userfield FROM userfeatures '
+
+    def setUp(self):
+        self.lookup = DatabaseLookup()
+        session_patch = patch('wazo_call_logd.participant_lookup.Session')
+        session = session_patch.start()
+        self.addCleanup(session_patch.stop)
+        session.query.side_effect = lambda *entities: Query(entities)
+
+    @patch.object(Query, 'first', autospec=True, return_value=None)
+    def test_get_line(self, first):
+        self.lookup.get_line('abcdef')
+
+        assert_that(self._compile(first.call_args[0][0]),
+                    equal_to(self.LINES_QUERY + 'WHERE linefeatures.name = %(name_1)s'))
+
+    @patch.object(Query, 'all', autospec=True, return_value=[])
+    def test_find_lines(self, all_):
+        self.lookup.find_lines({'abcdef'})
+
+        assert_that(self._compile(all_.call_args[0][0]),
+                    equal_to(self.LINES_QUERY + 'WHERE linefeatures.name IN (%(name_1)s)'))
+
+    @patch.object(Query, 'first', autospec=True, return_value=None)
+    def test_get_user(self, first):
+        self.lookup.get_user('user-uuid')
+
+        assert_that(self._compile(first.call_args[0][0]),
+                    equal_to(self.USERS_QUERY + 'WHERE userfeatures.uuid = %(uuid_1)s'))
+
+    @patch.object(Query, 'all', autospec=True, return_value=[])
+    def test_find_users(self, all_):
+        self.lookup.find_users({'user-uuid'})
+
+        assert_that(self._compile(all_.call_args[0][0]),
+                    equal_to(self.USERS_QUERY + 'WHERE userfeatures.uuid IN (%(uuid_1)s)'))
+
+    def _compile(self, query):
+        statement = query.statement.compile(dialect=postgresql.dialect())
+        return ' '.join(str(statement).split())
+
+
+class TestNewParticipantLookup(TestCase):
+
+    def setUp(self):
+        self.config = {'participant_lookup': 'confd',
+                       'participant_cache': {'max_size': 10, 'ttl': 60, 'negative_ttl': 10}}
+
+    def test_confd(self):
+        result = new_participant_lookup(self.config, Mock())
+
+        assert_that(result, instance_of(CachedLookup))
+        assert_that(result._lookup, instance_of(ConfdLookup))
+
+    def test_database(self):
+        self.config['participant_lookup'] = 'database'
+
+        result = new_participant_lookup(self.config, Mock())
+
+        assert_that(result._lookup, instance_of(DatabaseLookup))
+
+    def test_unknown(self):
+        self.config['participant_lookup'] = 'unknown'
+
+        assert_that(calling(new_participant_lookup).with_args(self.config, Mock()), raises(ValueError))
+
+    def test_cron_default_config(self):
+        result = new_participant_lookup(CRON_DEFAULT_CONFIG, Mock())
+
+        assert_that(result, instance_of(CachedLookup))
+
+
+class TestCachedLookup(TestCase):
+
+    def setUp(self):
+        self.source = Mock()
+        self.lookup = CachedLookup(self.source, max_size=10, ttl=60, negative_ttl=10)
+
+    def test_get_line_is_fetched_once(self):
+        self.source.get_line.return_value = sentinel.line
+
+        self.lookup.get_line('abcdef')
+        result = self.lookup.get_line('abcdef')
+
+        self.source.get_line.assert_called_once_with('abcdef')
+        assert_that(result, equal_to(sentinel.line))
+
+    def test_get_line_unknown_line_is_fetched_once(self):
+        self.source.get_line.return_value = None
+
+        self.lookup.get_line('trunk')
+        result = self.lookup.get_line('trunk')
+
+        self.source.get_line.assert_called_once_with('trunk')
+        assert_that(result, none())
+
+    def test_get_line_unknown_line_expires_after_negative_ttl(self):
+        self.lookup = CachedLookup(self.source, max_size=10, ttl=60, negative_ttl=0)
+        self.source.get_line.side_effect = [None, sentinel.line]
+
+        self.lookup.get_line('abcdef')
+        result = self.lookup.get_line('abcdef')
+
+        assert_that(self.source.get_line.call_count, equal_to(2))
+        assert_that(result, equal_to(sentinel.line))
+
+    def test_get_user_is_fetched_once(self):
+        self.source.get_user.return_value = sentinel.user
+
+        self.lookup.get_user('user-uuid')
+        result = self.lookup.get_user('user-uuid')
+
+        self.source.get_user.assert_called_once_with('user-uuid')
+        assert_that(result, equal_to(sentinel.user))
+
+    def test_prefetch(self):
+        line = {'id': 12, 'name': 'abcdef', 'users': [{'uuid': 'user-uuid'}]}
+        user = {'uuid': 'user-uuid'}
+        self.source.find_lines.return_value = {'abcdef': line}
+        self.source.find_users.return_value = {'user-uuid': user}
+
+        self.lookup.prefetch({'abcdef', 'trunk'})
+
+        assert_that(self.lookup.get_line('abcdef'), equal_to(line))
+        assert_that(self.lookup.get_line('trunk'), none())
+        assert_that(self.lookup.get_user('user-uuid'), equal_to(user))
+        self.source.find_users.assert_called_once_with({'user-uuid'})
+        assert_that(self.source.get_line.called, equal_to(False))
+        assert_that(self.source.get_user.called, equal_to(False))
+
+    def test_prefetch_skips_cached_lines(self):
+        self.source.get_line.return_value = None
+        self.lookup.get_line('trunk')
+
+        self.lookup.prefetch({'trunk'})
+
+        assert_that(self.source.find_lines.called, equal_to(False))
+
+    def test_evict_line(self):
+        self.source.get_line.side_effect = lambda name: {'id': 12 if name == 'abcdef' else 13, 'users': []}
+        self.lookup.get_line('abcdef')
+        self.lookup.get_line('ghijkl')
+
+        self.lookup.evict_line(12)
+        self.lookup.get_line('abcdef')
+        self.lookup.get_line('ghijkl')
+
+        assert_that(self.source.get_line.call_count, equal_to(3))
+
+    def test_evict_line_name(self):
+        self.source.get_line.return_value = None
+        self.lookup.get_line('abcdef')
+
+        self.lookup.evict_line_name('abcdef')
+        self.lookup.get_line('abcdef')
+
+        assert_that(self.source.get_line.call_count, equal_to(2))
+
+    def test_evict_user_also_evicts_its_lines(self):
+        self.source.get_line.return_value = {'id': 12, 'users': [{'uuid': 'user-uuid'}]}
+        self.lookup.get_line('abcdef')
+        self.lookup.get_user('user-uuid')
+
+        self.lookup.evict_user('user-uuid')
+        self.lookup.get_line('abcdef')
+        self.lookup.get_user('user-uuid')
+
+        assert_that(self.source.get_line.call_count, equal_to(2))
+        assert_that(self.source.get_user.call_count, equal_to(2))
+
+    def test_stats(self):
+        self.lookup.get_line('abcdef')
+        self.lookup.get_line('abcdef')
+        self.lookup.get_user('user-uuid')
+
+        result = self.lookup.stats()
+
+        assert_that(result, has_entries(lines=has_entries(hits=1, misses=1, size=1),
+                                        users=has_entries(hits=0, misses=1, size=1)))
@@ -3,10 +3,17 @@
 
 from unittest import TestCase
 
-from mock import Mock, patch
+from hamcrest import assert_that
+from hamcrest import calling
+from hamcrest import equal_to
+from hamcrest import instance_of
+from hamcrest import raises
+from mock import ANY, Mock, patch
 
 from wazo_call_logd.generator import CallLogsCreation
+from wazo_call_logd.writer import BulkCallLogsWriter
 from wazo_call_logd.writer import CallLogsWriter
+from wazo_call_logd.writer import new_call_logs_writer
 
 
 class TestCallLogsWriter(TestCase):
@@ -26,3 +33,66 @@ class TestCallLogsWriter(TestCase):
 
         mock_dao_create.assert_called_once_with(call_logs_creation.new_call_logs)
         mock_dao_delete.assert_called_once_with(call_logs_creation.call_logs_to_delete)
+
+
+class TestBulkCallLogsWriter(TestCase):
+
+    def setUp(self):
+        self.writer = BulkCallLogsWriter()
+
+    @patch('wazo_call_logd.writer.Session')
+    def test_write(self, session):
+        session.execute.return_value.fetchall.return_value = [(42,), (43,)]
+        participant = Mock(role='source', user_uuid='user-uuid', line_id=12, tags=[])
+        call_log_1 = Mock(participants=[participant], cel_ids=[1, 2])
+        call_log_2 = Mock(participants=[], cel_ids=[3])
+        call_logs_creation = CallLogsCreation(new_call_logs=[call_log_1, call_log_2],
+                                              call_logs_to_delete=set())
+
+        self.writer.write(call_logs_creation)
+
+        assert_that(call_log_1.id, equal_to(42))
+        assert_that(call_log_2.id, equal_to(43))
+        session.execute.assert_any_call(ANY, {'cel_ids': [1, 2, 3], 'call_log_ids': [42, 42, 43]})
+        assert_that(session.execute.call_count, equal_to(4))
+        assert_that(session.query.called, equal_to(False))
+
+    @patch('wazo_call_logd.writer.Session')
+    def test_write_links_the_cels_received_from_the_bus_by_linked_id(self, session):
+        session.execute.return_value.fetchall.return_value = [(42,)]
+        call_log = Mock(participants=[], cel_ids=[], linked_id='a-linked-id')
+        call_logs_creation = CallLogsCreation(new_call_logs=[call_log], call_logs_to_delete=set())
+
+        self.writer.write(call_logs_creation)
+
+        session.execute.assert_any_call(ANY, {'linked_ids': ['a-linked-id'], 'call_log_ids': [42]})
+
+    @patch('wazo_call_logd.writer.Session')
+    def test_write_nothing(self, session):
+        call_logs_creation = CallLogsCreation(new_call_logs=[], call_logs_to_delete=set())
+
+        self.writer.write(call_logs_creation)
+
+        assert_that(session.execute.called, equal_to(False))
+        assert_that(session.query.called, equal_to(False))
+
+    @patch('wazo_call_logd.writer.Session')
+    def test_write_deletes_call_logs_in_one_query(self, session):
+        call_logs_creation = CallLogsCreation(new_call_logs=[], call_logs_to_delete={1, 2})
+
+        self.writer.write(call_logs_creation)
+
+        query = session.query.return_value.filter.return_value
+        query.delete.assert_called_once_with(synchronize_session=False)
+
+
+class TestNewCallLogsWriter(TestCase):
+
+    def test_dao(self):
+        assert_that(new_call_logs_writer({'call_logs_writer': 'dao'}), instance_of(CallLogsWriter))
+
+    def test_bulk(self):
+        assert_that(new_call_logs_writer({'call_logs_writer': 'bulk'}), instance_of(BulkCallLogsWriter))
+
+    def test_unknown(self):
+        assert_that(calling(new_call_logs_writer).with_args({'call_logs_writer': 'copy'}), raises(ValueError))
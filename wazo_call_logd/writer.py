@@ -1,11 +1,122 @@
 # Copyright 2013-2017 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0+
 
+from sqlalchemy import sql
+from xivo_dao.alchemy.call_log import CallLog
+from xivo_dao.alchemy.call_log_participant import CallLogParticipant
+from xivo_dao.helpers.db_manager import Session
 from xivo_dao.resources.call_log import dao as call_log_dao
 
+CALL_LOG_FIELDS = (
+    'date',
+    'date_answer',
+    'date_end',
+    'source_name',
+    'source_exten',
+    'source_line_identity',
+    'destination_name',
+    'destination_exten',
+    'destination_line_identity',
+    'user_field',
+    'direction',
+)
+
+PARTICIPANT_FIELDS = (
+    'role',
+    'user_uuid',
+    'line_id',
+    'tags',
+)
+
+_NEXT_CALL_LOG_IDS = sql.text(
+    "SELECT nextval(pg_get_serial_sequence('call_log', 'id')) FROM generate_series(1, :count)"
+)
+
+_LINK_CELS = sql.text(
+    'UPDATE cel SET call_log_id = linked.call_log_id '
+    'FROM unnest(CAST(:cel_ids AS integer[]), CAST(:call_log_ids AS integer[])) AS linked(cel_id, call_log_id) '
+    'WHERE cel.id = linked.cel_id'
+)
+
+_LINK_CELS_BY_LINKED_ID = sql.text(
+    'UPDATE cel SET call_log_id = linked.call_log_id '
+    'FROM unnest(CAST(:linked_ids AS varchar[]), CAST(:call_log_ids AS integer[])) AS linked(linkedid, call_log_id) '
+    'WHERE cel.linkedid = linked.linkedid'
+)
+
 
 class CallLogsWriter(object):
 
     def write(self, call_logs_creation):
         call_log_dao.delete_from_list(call_logs_creation.call_logs_to_delete)
         call_log_dao.create_from_list(call_logs_creation.new_call_logs)
+        _link_cels_by_linked_id(call_logs_creation.new_call_logs)
+
+
+class BulkCallLogsWriter(object):
+
+    def write(self, call_logs_creation):
+        self._delete(call_logs_creation.call_logs_to_delete)
+        self._create(call_logs_creation.new_call_logs)
+
+    def _delete(self, call_log_ids):
+        if not call_log_ids:
+            return
+
+        Session.query(CallLog).filter(CallLog.id.in_(call_log_ids)).delete(synchronize_session=False)
+
+    def _create(self, call_logs):
+        if not call_logs:
+            return
+
+        rows = Session.execute(_NEXT_CALL_LOG_IDS, {'count': len(call_logs)}).fetchall()
+        for call_log, row in zip(call_logs, rows):
+            call_log.id = row[0]
+
+        Session.execute(CallLog.__table__.insert().values([_call_log_values(call_log) for call_log in call_logs]))
+
+        participants = [_participant_values(call_log, participant)
+                        for call_log in call_logs
+                        for participant in call_log.participants]
+        if participants:
+            Session.execute(CallLogParticipant.__table__.insert().values(participants))
+
+        cel_ids, cel_call_log_ids = [], []
+        for call_log in call_logs:
+            cel_ids.extend(call_log.cel_ids)
+            cel_call_log_ids.extend([call_log.id] * len(call_log.cel_ids))
+        if cel_ids:
+            Session.execute(_LINK_CELS, {'cel_ids': cel_ids, 'call_log_ids': cel_call_log_ids})
+        _link_cels_by_linked_id(call_logs)
+
+
+def new_call_logs_writer(config):
+    writer = config['call_logs_writer']
+    if writer == 'dao':
+        return CallLogsWriter()
+    elif writer == 'bulk':
+        return BulkCallLogsWriter()
+
+    raise ValueError('Unknown call logs writer: {}'.format(writer))
+
+
+def _link_cels_by_linked_id(call_logs):
+    # call logs generated from the CEL received from the bus do not know their CEL ids
+    call_logs = [call_log for call_log in call_logs if not call_log.cel_ids]
+    if not call_logs:
+        return
+
+    Session.execute(_LINK_CELS_BY_LINKED_ID, {'linked_ids': [call_log.linked_id for call_log in call_logs],
+                                              'call_log_ids': [call_log.id for call_log in call_logs]})
+
+
+def _call_log_values(call_log):
+    values = {field: getattr(call_log, field) for field in CALL_LOG_FIELDS}
+    values['id'] = call_log.id
+    return values
+
+
+def _participant_values(call_log, participant):
+    values = {field: getattr(participant, field) for field in PARTICIPANT_FIELDS}
+    values['call_log_id'] = call_log.id
+    return values